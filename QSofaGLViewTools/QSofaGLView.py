@@ -10,20 +10,34 @@ except Exception as e:
     from PyQt6.QtOpenGLWidgets import QOpenGLWidget
     Signal = pyqtSignal
 
-import Sofa.SofaGL as SGL
 import Sofa
 from SofaRuntime import importPlugin
 from QSofaGLViewTools.QSofaViewKeyboardController import QSofaViewKeyboardController
+from QSofaGLViewTools.gl_scene import GL_DTYPES, init_gl, draw_scene, read_color_buffer, read_depth_buffer, \
+    render_poses, render_poses_to_arrays, depth_to_image
+from QSofaGLViewTools.depth_pass import DepthLinearizationPass
+from QSofaGLViewTools.markers import MarkerOverlay, SphereNodePool
+from QSofaGLViewTools.camera_state import CameraState
+from QSofaGLViewTools.scheduler import RedrawScheduler
+from QSofaGLViewTools.readback import AsyncReadback, frame_field_future
+from QSofaGLViewTools.recording import VideoRecorder
+from QSofaGLViewTools.profiling import FrameProfiler, profile_section
+from QSofaGLViewTools.point_cloud import RayGridCache, PointCloudWriter, get_point_cloud
+from QSofaGLViewTools.label_pass import LabelPass
+from QSofaGLViewTools.capture import FrameCapture, FrameCopy
+from QSofaGLViewTools.image_sink import ImageSink, write_image
+from QSofaGLViewTools.transforms import project_points, unproject_points, widget_to_window
 from OpenGL.GL import *
 from OpenGL.GLU import *
 import numpy as np
-from typing import List
-from PIL import Image
+from typing import List, TYPE_CHECKING
+from concurrent.futures import Future
 import os
-import cv2
 import time
-import re
 import shutil
+if TYPE_CHECKING:
+    from QSofaGLViewTools.QSofaViewGroup import QSofaViewGroup
+    from QSofaGLViewTools.frame_sync import SimulationSync
 
 
 sim = Sofa.Simulation
@@ -83,10 +97,10 @@ class QSofaGLView(QOpenGLWidget):
     scroll_event = Signal(QWheelEvent)
     resizedGL = Signal(float, float)  # width, height
     repainted = Signal()
+    frame_read_back = Signal(object)  # ReadbackFrame, only emitted with continuous async readback
+    frame_timing = Signal(object)  # frame record of the FrameProfiler, only emitted with profiling enabled
 
-    DTYPES = {np.uint8: GL_UNSIGNED_BYTE,
-              np.float32: GL_FLOAT,
-              np.uint16: GL_UNSIGNED_SHORT}
+    DTYPES = GL_DTYPES
 
     def __init__(self,
                  sofa_visuals_node: Sofa.Core.Node,
@@ -94,7 +108,8 @@ class QSofaGLView(QOpenGLWidget):
                  size: tuple = (800, 600),
                  auto_place_camera: bool = False,
                  internal_refresh_freq = 0,
-                 suppress_base_light: bool = False):
+                 suppress_base_light: bool = False,
+                 idle_refresh_freq: float = None):
         """
 
         Parameters
@@ -114,6 +129,10 @@ class QSofaGLView(QOpenGLWidget):
         suppress_base_light : bool
                 Whether or not the default SOFA light should be turned off. The scene will be black if no other light
                 is added to the scene.
+        idle_refresh_freq : float
+                With internal_refresh_freq, only repaint at the full rate while the simulation time, the camera or the
+                dirty flag (see mark_dirty) changes and at this rate (Hz) otherwise. 0 never repaints an unchanged
+                view. None (default) always repaints at internal_refresh_freq.
         """
 
         super(QSofaGLView, self).__init__()
@@ -129,9 +148,15 @@ class QSofaGLView(QOpenGLWidget):
         self.resize(*size)
         self.z_far = camera.zFar  # get these values using self.z***.value because they are sofa Data objects
         self.z_near = camera.zNear
+        self.camera_state = CameraState(camera)  # cached matrices and intrinsics of the camera
+        self.ray_grids = RayGridCache()  # back-projection rays for get_point_cloud
+        self.frame_capture = FrameCapture(camera)  # framebuffers for capture() at other resolutions
+        self._last_frame = FrameCopy()  # shown again while a lock-free frame_sync cannot draw
         self.setFocusPolicy(Qt.FocusPolicy.StrongFocus)
         self.background_color = [1, 1, 1, 0]
-        self.spheres = []
+        self.sphere_pool = SphereNodePool(self.visuals_node)  # spheres drawn with as_scene_nodes=True
+        self.markers = MarkerOverlay()  # spheres, points and lines drawn on top of the scene
+        self.label_pass = None  # type: LabelPass  # see enable_labels()
         # self.setWindowFlag(Qt.NoDropShadowWindowHint)
         self._rotating = False
         self._panning = False
@@ -142,13 +167,28 @@ class QSofaGLView(QOpenGLWidget):
         self._recording = False
         self._video_file = None  # type: str
         self._save_img = False
-        self._images = []
-        self._update_timer = QTimer()
-        self._update_timer.timeout.connect(self.update, Qt.ConnectionType.QueuedConnection)
+        self._recorder = None  # type: VideoRecorder
+        self._recorder_kwargs = {}
+        self._recording_clock = 'wall'
+        self._recording_sink = None  # type: ImageSink  # writes the images of save_separate_images recordings
+        self._recording_index = None  # CSV with frame number, time and file of every separately saved image
+        self._recording_frame = 0
+        self._point_cloud_writer = None  # type: PointCloudWriter
+        self._point_cloud_kwargs = {}
+        self._async_readback = None  # type: AsyncReadback
+        self._depth_pass = None  # type: DepthLinearizationPass
+        self._readback_timer = QTimer()
+        self._readback_timer.setSingleShot(True)
+        self._readback_timer.timeout.connect(self._poll_async_readback)
+        self.scheduler = RedrawScheduler(self)
+        self.view_group = None  # type: QSofaViewGroup
+        self.frame_sync = None  # type: SimulationSync  # set to synchronize drawing with a simulation thread
+        self.profiler = None  # type: FrameProfiler
+        self.image_sink = None  # type: ImageSink  # see enable_async_saving()
         self.zoom_bb = None
         if internal_refresh_freq > 0:
-            ms = (1000/internal_refresh_freq)
-            self._update_timer.start(internal_refresh_freq)
+            self.scheduler.start(max_fps=internal_refresh_freq,
+                                 idle_fps=internal_refresh_freq if idle_refresh_freq is None else idle_refresh_freq)
         self._keyboard_control = QSofaViewKeyboardController()
         self._keyboard_control.set_viewers(self)
         self._KEYBOARD_DIRECTIONS = {Qt.Key.Key_Up: False,
@@ -167,7 +207,8 @@ class QSofaGLView(QOpenGLWidget):
                                size: tuple = (800, 600),
                                camera_kwargs: dict = {'distance': 5000, "fieldOfView": 45, "computeZClip": False},
                                internal_refresh_freq = 0,
-                               suppress_base_light: bool = False
+                               suppress_base_light: bool = False,
+                               idle_refresh_freq: float = None
                                ):
         """
         Function to create a QSofaGLViewer object and place a camera in it. This will also create a MechanicalObject to
@@ -192,6 +233,8 @@ class QSofaGLView(QOpenGLWidget):
         suppress_base_light : bool
                 Whether or not the default SOFA light should be turned off. The scene will be black if no other light
                 is added to the scene
+        idle_refresh_freq : float
+                repaint rate (Hz) of an unchanged view. See QSofaGLView.__init__.
 
         Returns
         -------
@@ -220,6 +263,7 @@ class QSofaGLView(QOpenGLWidget):
                            size=size,
                            auto_place_camera=auto_place,
                            internal_refresh_freq=internal_refresh_freq,
+                           idle_refresh_freq=idle_refresh_freq,
                            suppress_base_light=suppress_base_light)
         view.dofs = dofs
         _temp_cam = sofa_visuals_node.addObject("InteractiveCamera", name="tempcam", distance=10)
@@ -293,6 +337,10 @@ class QSofaGLView(QOpenGLWidget):
         self.setAttribute(Qt.WidgetAttribute.WA_AlwaysStackOnTop, make_transparent)
         self.update()
 
+    def mark_dirty(self):
+        """ Tell the redraw scheduler that something shown in the view changed (i.e. a scene change while paused) """
+        self.scheduler.mark_dirty()
+
     def set_background_color(self, color):
         """
         :param color: [r, g, b, alpha] alpha determines opacity. Use 0 to save images with a transparent background
@@ -301,19 +349,13 @@ class QSofaGLView(QOpenGLWidget):
         self.update()
 
     def get_intrinsic_parameters(self):
-        # https://github.com/opencv/opencv_contrib/blob/master/modules/viz/src/types.cpp
-        pm = glGetFloatv(GL_PROJECTION_MATRIX)
-        pm = np.transpose(pm)  # openGL is column-major
-        near = self.z_near.value
-        left = (near * (pm[0][2] - 1)) / pm[0][0]
-        right = 2 * near / pm[0][0] + left
-        bottom = near * (pm[1][2] - 1) / pm[1][1]
-        top = 2.0 * near / pm[1][1] + bottom
-        cx = (left * self.width()) / (left - right)
-        cy = (top * self.height()) / (top - bottom)
-        fx = -near * cx / left
-        fy = near * cy / top
-        return fx, fy, cx, cy
+        """
+        Pinhole intrinsics of the view, served from the camera state cache (no GL query).
+
+        :return: fx, fy, cx, cy in pixels
+        """
+        self.camera_state.update(self.width(), self.height())
+        return self.camera_state.intrinsics
 
     def get_transform_to_global_coord(self):
         transformation = np.zeros((4, 4))
@@ -323,22 +365,11 @@ class QSofaGLView(QOpenGLWidget):
         return transformation
 
     def initializeGL(self):
-        glViewport(0, 0, self.width(), self.height())
-        glEnable(GL_LIGHTING)
-        glEnable(GL_DEPTH_TEST)
-        glDepthFunc(GL_LESS)
-        if self.suppress_base_light:
-            glLightfv(GL_LIGHT0, GL_AMBIENT, [0, 0, 0, 0])
-            glLightfv(GL_LIGHT0, GL_DIFFUSE,  [0, 0, 0, 0])
-            glLightfv(GL_LIGHT0, GL_SPECULAR,  [0, 0, 0, 0])
-            glLightfv(GL_LIGHT0, GL_POSITION,  [0, 0, 0, 0])
-            glLightf(GL_LIGHT0, GL_SPOT_CUTOFF, 180)
-            glEnable(GL_LIGHT0)
-
-        SGL.glewInit()
-        Sofa.Simulation.initVisual(self.visuals_node)
-        Sofa.Simulation.initTextures(self.visuals_node)
-        self.visuals_node.getRoot().init()
+        # views of a QSofaViewGroup with shared contexts initialize the scene and its GL objects only once
+        init_visuals = self.view_group is None or self.view_group.claim_visual_init(self)
+        init_gl(self.visuals_node, self.width(), self.height(), self.suppress_base_light, init_visuals)
+        if init_visuals:
+            self.visuals_node.getRoot().init()
         if self.auto_place:
             self.auto_place_camera()
         bbox = self.visuals_node.bbox.array()
@@ -355,26 +386,38 @@ class QSofaGLView(QOpenGLWidget):
 
     def paintGL(self):
         self.makeCurrent()
-        if self.suppress_base_light:
-            glLightfv(GL_LIGHT0, GL_AMBIENT, [0, 0, 0, 0])
-            glLightfv(GL_LIGHT0, GL_DIFFUSE,  [0, 0, 0, 0])
-            glLightfv(GL_LIGHT0, GL_SPECULAR,  [0, 0, 0, 0])
-            glLightfv(GL_LIGHT0, GL_POSITION,  [0, 0, 0, 0])
-            glLightf(GL_LIGHT0, GL_SPOT_CUTOFF, 180)
-            glEnable(GL_LIGHT0)
-
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-        glClearColor(*self.background_color)
-        glMatrixMode(GL_PROJECTION)
-        glLoadIdentity()
-        gluPerspective(self.camera.findData('fieldOfView').value, (self.width() / self.height()), self.z_near.value,
-                       self.z_far.value)
-        glMatrixMode(GL_MODELVIEW)
-        glLoadIdentity()
-        camera_mvm = self.camera.getOpenGLModelViewMatrix()
-        glMultMatrixd(camera_mvm)
-        SGL.draw(self.visuals_node)
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin_frame()
+        can_draw = True
+        if self.frame_sync is not None:
+            with profile_section(profiler, 'sync'):
+                can_draw = self.frame_sync.begin_frame()
+        try:
+            if can_draw:
+                draw_scene(self.visuals_node, self.camera, self.width(), self.height(), self.background_color,
+                           self.suppress_base_light, overlay=self.markers, camera_state=self.camera_state,
+                           profiler=profiler)
+                if self.frame_sync is not None and self.frame_sync.lock_free:
+                    self._last_frame.store(self.defaultFramebufferObject(), self.width(), self.height(),
+                                           max(0, self.format().samples()))
+            else:
+                # a step is running and mappings are writing the visual models, so the scene graph must not be
+                # drawn. Show the last completed frame again.
+                if not self._last_frame.restore(self.defaultFramebufferObject(), self.width(), self.height()):
+                    glClearColor(*self.background_color)
+                    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        finally:
+            if self.frame_sync is not None:
+                self.frame_sync.end_frame()
+        if self._async_readback is not None:
+            with profile_section(profiler, 'readback'):
+                self._async_readback.capture(self.width(), self.height(), self.z_near.value, self.z_far.value)
+            if self._async_readback.has_work:
+                self._readback_timer.start(1)
         self.repainted.emit()
+        if profiler is not None:
+            self.frame_timing.emit(profiler.end_frame())
 
     def resizeGL(self, w: int, h: int) -> None:
         self.camera.widthViewport = w
@@ -382,146 +425,643 @@ class QSofaGLView(QOpenGLWidget):
         glViewport(0, 0, w, h)
         self.resizedGL.emit(w, h)
 
-    def get_depth_image(self, scaled_for_viewing=True, return_type=np.uint16):
+    def get_depth_image(self, scaled_for_viewing=True, return_type=np.uint16, depth_range: tuple = None):
         """
          Get the depth map as an array for displaying
-        :param scaled_for_viewing:
+        :param scaled_for_viewing: stretch the contrast over the pixels that are not background.
         :param return_type: either np.uint8 or np.uint16
+        :param depth_range: optional fixed (min_distance, max_distance) to normalize with instead of the frame's
+                            min/max. With enable_gpu_depth() and np.uint16 this is computed on the GPU.
         :return:
         """
-        depth_image = self.get_depth_map()
-        depth_image = (depth_image - depth_image.min()) / (depth_image.max() - depth_image.min())
-        if scaled_for_viewing:
-            indices = depth_image.nonzero()
-            actual_image_pixels = depth_image[indices[0][:], indices[1][:]]
-            actual_image_pixels = (actual_image_pixels - actual_image_pixels.min()) / (
-                        actual_image_pixels.max() - actual_image_pixels.min())
-            depth_image[indices] = actual_image_pixels
+        if depth_range is not None and self._depth_pass is not None and return_type == np.uint16:
+            self.makeCurrent()
+            return self._depth_pass.run(self.defaultFramebufferObject(), self.width(), self.height(),
+                                        self.z_near.value, self.z_far.value, depth_range=depth_range)
+        return depth_to_image(self.get_depth_map(), scaled_for_viewing, return_type, depth_range, self.z_far.value)
 
-        depth_image = depth_image * np.iinfo(return_type).max
-        return depth_image.astype(return_type)
+    def get_depth_map(self, out: np.ndarray = None):
+        """
+        Get the depth value for each pixel in image
 
-    def get_depth_map(self):
-        """ Get the depth value for each pixel in image """
+        Parameters
+        ----------
+        out : np.ndarray
+                optional C-contiguous (height, width) float32 array to read into. It receives the rows bottom-up (as
+                OpenGL stores them) and the returned depth map is a flipped view of it, so no memory is allocated.
+        """
         self.makeCurrent()
-        width, height = self.width(), self.height()
-        buff = glReadPixels(0, 0, width, height, GL_DEPTH_COMPONENT, GL_FLOAT)
-        image = np.frombuffer(buff, dtype=np.float32)
-        image = image.reshape(height, width)
-        image = np.flipud(image)  # <-- image is now a numpy array you can use
-        far, near = self.z_far.value, self.z_near.value
-        return -far * near / (far + image * (near - far))
+        with profile_section(self.profiler, 'readback_depth'):
+            if self._depth_pass is not None:
+                return self._depth_pass.run(self.defaultFramebufferObject(), self.width(), self.height(),
+                                            self.z_near.value, self.z_far.value, out=out)
+            return read_depth_buffer(self.width(), self.height(), self.z_near.value, self.z_far.value, out=out)
+
+    def enable_profiling(self, enable: bool = True, capacity: int = 300, gpu_timers: bool = True):
+        """
+        Time every frame: CPU and GPU times of lighting setup, matrix setup, SGL.draw, the markers, readbacks and
+        recording. While disabled, the instrumentation costs nothing but a few empty with-statements per frame.
 
-    def get_screen_shot(self, return_with_alpha=False, dtype: np.dtype = np.uint8):
+        Parameters
+        ----------
+        enable : bool
+                turn profiling on or off. Turning it off discards the collected frames.
+        capacity : int
+                number of frames kept in the ring buffer
+        gpu_timers : bool
+                also measure GPU times with timer queries
+        """
+        self.makeCurrent()
+        if enable and self.profiler is None:
+            self.profiler = FrameProfiler(capacity, gpu_timers)
+        elif not enable and self.profiler is not None:
+            self.profiler.release()
+            self.profiler = None
+
+    def frame_stats(self) -> dict:
+        """ Timing statistics of the last frames, see FrameProfiler.frame_stats(). None while profiling is off. """
+        if self.profiler is None:
+            return None
+        self.makeCurrent()
+        self.profiler.collect_gpu_results()
+        return self.profiler.frame_stats()
+
+    def dump_trace(self, filename: str):
+        """ Write the profiled frames as Chrome trace JSON (chrome://tracing or https://ui.perfetto.dev) """
+        if self.profiler is None:
+            raise RuntimeError('Profiling is not enabled. Call enable_profiling() first.')
+        self.makeCurrent()
+        self.profiler.collect_gpu_results()
+        self.profiler.dump_chrome_trace(filename)
+
+    def enable_gpu_depth(self, enable: bool = True):
+        """
+        Linearize (and optionally normalize) depth with a shader pass on the GPU instead of numpy. Affects
+        get_depth_map() and get_depth_image() with a depth_range.
+        """
+        self.makeCurrent()
+        if enable and self._depth_pass is None:
+            self._depth_pass = DepthLinearizationPass()
+        elif not enable and self._depth_pass is not None:
+            self._depth_pass.release()
+            self._depth_pass = None
+
+    def get_screen_shot(self, return_with_alpha=False, dtype: np.dtype = np.uint8, out: np.ndarray = None):
         """
          Returns the RGB image array for the current view
         :param return_with_alpha:
-        :param return_type:
+        :param dtype:
+        :param out: optional C-contiguous (height, width, 3|4) array of dtype to read into. It receives the rows
+                    bottom-up (as OpenGL stores them) and the returned image is a flipped view of it (no copy).
         :return: numpy array representing the screen view with provided dtype
         """
 
         self.makeCurrent()
-        # _, _, width, height = glGetIntegerv(GL_VIEWPORT)
-        width, height = self.width(), self.height()
-        if return_with_alpha:
-            buff = glReadPixels(0, 0, width, height, GL_RGBA, self.DTYPES[dtype])
-            image = np.frombuffer(buff, dtype=dtype)
-            return np.flipud(image.reshape(height, width, 4))
-        else:
-            buff = glReadPixels(0, 0, width, height, GL_RGB, self.DTYPES[dtype])
-            image = np.frombuffer(buff, dtype=dtype)
-            return np.flipud(image.reshape(height, width, 3))
+        with profile_section(self.profiler, 'readback_color'):
+            return read_color_buffer(self.width(), self.height(), with_alpha=return_with_alpha, dtype=dtype, out=out)
+
+    def capture(self, size: tuple = None, outputs=('rgb',), samples: int = 0, supersample: int = 1) -> dict:
+        """
+        Render the current view into an offscreen framebuffer of any size, i.e. a 4K dataset image from a small
+        preview window. The widget itself is not resized or repainted.
+
+        Parameters
+        ----------
+        size : tuple
+                (width, height) of the images. Default is the size of the view.
+        outputs : tuple
+                any of 'rgb', 'rgba', 'depth', 'mask' and 'labels' (see get_label_map())
+        samples : int
+                MSAA samples per pixel (i.e. 4 or 8). 0 disables multisampling.
+        supersample : int
+                render supersample times larger in both directions and average the color down. Depth, mask and
+                labels take the sample in the middle of each block.
+
+        Returns
+        -------
+            dict of output name -> np.ndarray and 'intrinsics' (fx, fy, cx, cy) at the requested size
+        """
+        self.makeCurrent()
+        if size is None:
+            size = (self.width(), self.height())
+        return self.frame_capture.capture(self, size, outputs, samples, supersample, profiler=self.profiler)
+
+    def enable_labels(self, enable: bool = True, id_map: dict = None, label_unmapped: bool = True):
+        """
+        Set up the label pass for get_label_map() and the 'labels' output of render_poses(): every OglModel of the
+        scene is drawn with a unique 16 bit label in one extra pass.
+
+        Parameters
+        ----------
+        enable : bool
+                create the label pass or release it
+        id_map : dict
+                optional node or OglModel (objects or path names) -> label. See label_pass.LabelPass.
+        label_unmapped : bool
+                give OglModels without an entry in id_map the next free labels instead of leaving them out
+        """
+        self.makeCurrent()
+        if self.label_pass is not None:
+            self.label_pass.release()
+            self.label_pass = None
+        if enable:
+            self.label_pass = LabelPass(self.visuals_node, id_map, label_unmapped)
+
+    def get_label_map(self, out: np.ndarray = None) -> np.ndarray:
+        """
+        Label image of the current camera view and scene state, i.e. of the same frame as get_screen_shot() and
+        get_depth_map() when called after a repaint. 0 is the background. Enables the label pass with default labels
+        if enable_labels() was not called.
+
+        :param out: optional C-contiguous (height, width) uint16 array to read into (rows bottom-up, see
+                    get_screen_shot())
+        :return: (height, width) uint16 label image
+        """
+        if self.label_pass is None:
+            self.enable_labels()
+        self.makeCurrent()
+        with profile_section(self.profiler, 'labels'):
+            return self.label_pass.render(self.camera, self.width(), self.height(), camera_state=self.camera_state,
+                                          out=out)
+
+    def get_point_cloud(self, frame: str = 'camera', stride: int = 1, with_color: bool = True) -> np.ndarray:
+        """
+        Back-project the depth map of the current frame into a point cloud. Background pixels are left out.
+
+        Parameters
+        ----------
+        frame : str
+                'camera' for OpenGL camera coordinates (x right, y up, looking along -z) or 'world' for the scene's
+                coordinates.
+        stride : int
+                use every stride-th pixel in both directions
+        with_color : bool
+                add the color of each pixel as r, g, b in [0, 1]
+
+        Returns
+        -------
+            (N, 3) or (N, 6) float32 array of [x, y, z(, r, g, b)]
+        """
+        return get_point_cloud(self, frame, stride, with_color)
+
+    def render_poses(self, poses, outputs=('rgb', 'depth', 'mask'), as_generator=False):
+        """
+        Render the scene from many camera poses in one call. The camera matrix is set directly for every pose, so
+        neither the SOFA camera Data nor the Qt event loop is involved. Objects that follow the camera through SOFA
+        Data (i.e. lights linked to the camera dofs) stay where they are.
+
+        Parameters
+        ----------
+        poses : np.ndarray
+                (N, 7) camera poses [x, y, z, qx, qy, qz, qw] in world coordinates.
+        outputs : tuple
+                any of 'rgb', 'rgba', 'depth' (distance from the camera plane), 'mask' (pixels covered by the scene) and
+                'labels' (uint16 label image, see enable_labels())
+        as_generator : bool
+                if True, return a generator yielding one dict per pose instead of stacking all results. The yielded
+                arrays are only valid until the next iteration.
+
+        Returns
+        -------
+            dict of output name -> (N, height, width, ...) np.ndarray, or a generator of per-pose dicts.
+        """
+        if as_generator:
+            return self._render_poses_generator(poses, outputs)
+        results = render_poses_to_arrays(self, poses, outputs)
+        self.update()
+        return results
+
+    def _render_poses_generator(self, poses, outputs):
+        try:
+            yield from render_poses(self, poses, outputs)
+        finally:
+            self.update()  # show the actual camera view again
+
+    def enable_async_readback(self,
+                              ring_size: int = 3,
+                              read_color: bool = True,
+                              read_depth: bool = True,
+                              with_alpha: bool = False,
+                              continuous: bool = False):
+        """
+        Read frames back through a ring of pixel buffer objects instead of a blocking glReadPixels. Frames are then
+        requested with request_screen_shot()/request_depth_map() and delivered one or two frames later, so paintGL
+        never waits on the GPU->CPU transfer.
+
+        Parameters
+        ----------
+        ring_size : int
+                Number of frames that can be in flight at the same time.
+        read_color : bool
+                Whether the color buffer is read back.
+        read_depth : bool
+                Whether the depth buffer is read back.
+        with_alpha : bool
+                Whether the color buffer is read as RGBA instead of RGB.
+        continuous : bool
+                If True, every painted frame is read back and emitted with the frame_read_back signal.
+        """
+        self.disable_async_readback()
+        self.makeCurrent()
+        self._async_readback = AsyncReadback(ring_size=ring_size,
+                                             read_color=read_color,
+                                             read_depth=read_depth,
+                                             with_alpha=with_alpha,
+                                             continuous=continuous)
+        self._async_readback.add_frame_callback(self.frame_read_back.emit)
+
+    def disable_async_readback(self):
+        """ Resolve all frames that are still in flight and free the pixel buffer objects """
+        if self._async_readback is None:
+            return
+        self._readback_timer.stop()
+        self.makeCurrent()
+        self._async_readback.release()
+        self._async_readback = None
+
+    def request_frame(self, callback=None) -> Future:
+        """
+        Request the color and depth of the next painted frame. Requires enable_async_readback().
+
+        Parameters
+        ----------
+        callback : callable
+                optional function called (in the GUI thread) with the ReadbackFrame once it is available.
+
+        Returns
+        -------
+            concurrent.futures.Future resolving to a ReadbackFrame(frame_index, timestamp, color, depth)
+        """
+        if self._async_readback is None:
+            raise RuntimeError('Asynchronous readback is not enabled. Call enable_async_readback() first.')
+        future = self._async_readback.request(callback)
+        self.update()
+        return future
+
+    def request_screen_shot(self, callback=None) -> Future:
+        """
+        Asynchronous version of get_screen_shot(). Returns a Future resolving to the RGB(A) uint8 image of the next
+        painted frame. Requires enable_async_readback() with read_color=True.
+        """
+        if self._async_readback is not None and not self._async_readback.read_color:
+            raise ValueError('Asynchronous readback was enabled without read_color.')
+        return frame_field_future(self.request_frame(), 'color', callback)
+
+    def request_depth_map(self, callback=None) -> Future:
+        """
+        Asynchronous version of get_depth_map(). Returns a Future resolving to the depth map of the next painted
+        frame. Requires enable_async_readback() with read_depth=True.
+        """
+        if self._async_readback is not None and not self._async_readback.read_depth:
+            raise ValueError('Asynchronous readback was enabled without read_depth.')
+        return frame_field_future(self.request_frame(), 'depth', callback)
+
+    def _poll_async_readback(self):
+        if self._async_readback is None:
+            return
+        self.makeCurrent()
+        self._async_readback.poll()
+        if self._async_readback.pending > 0:
+            self._readback_timer.start(1)
+
+    def enable_async_saving(self,
+                            enable: bool = True,
+                            max_workers: int = None,
+                            max_in_flight: int = 16,
+                            png_compress_level: int = 1,
+                            use_processes: bool = False):
+        """
+        Let save_image(), save_depth_image() and save_depths() only read the frame and write the file on a pool of
+        workers (see ImageSink). The save functions then return a Future. Disabling waits for the queued images.
+
+        Parameters
+        ----------
+        enable : bool
+                save asynchronously or synchronously again
+        max_workers : int
+                number of worker threads (or processes)
+        max_in_flight : int
+                maximum number of images waiting to be written before saving blocks
+        png_compress_level : int
+                zlib level (0-9) for PNG files
+        use_processes : bool
+                use processes instead of threads
+        """
+        if self.image_sink is not None:
+            self.image_sink.close()
+            self.image_sink = None
+        if enable:
+            self.image_sink = ImageSink(max_workers, max_in_flight, png_compress_level, use_processes)
+
+    def flush_saves(self):
+        """ Wait until all images saved asynchronously are written """
+        if self.image_sink is not None:
+            self.image_sink.flush()
+
+    def _write(self, filename, image, mode=None):
+        if self.image_sink is not None:
+            return self.image_sink.write(filename, image, mode)
+        write_image(filename, image, mode)
+        return None
 
     def save_image(self, filename, dtype: np.dtype = np.uint8):
         """
         Save image to file
         :param filename: name of file to save image to. extension determines file type (i.e. "pic.png")
+        :return: Future of the write with enable_async_saving(), otherwise None
         """
         image = self.get_screen_shot(return_with_alpha=True, dtype=dtype)
-        Image.fromarray(image, mode="RGBA").save(filename)
+        return self._write(filename, image, mode="RGBA")
 
     def save_depth_image(self, filename, scaled=True, dtype: np.dtype = np.uint16):
         """
         Save pixel depth values to file
         :param filename: name of file to save depth image to. Extension determines file type (i.e. "pic.jpg")
         :param scaled: whether or not the depths are scaled for better viewing.
+        :return: Future of the write with enable_async_saving(), otherwise None
         """
         image = self.get_depth_image(scaled_for_viewing=scaled, return_type=dtype)
-        Image.fromarray(image).save(filename)
+        return self._write(filename, image)
 
     def save_depths(self, filename):
         """
         Save pixel depth values to file
-        :param filename: name of file to save depths to. extension determines file type (i.e. "pic.jpg")
+        :param filename: name of file to save depths to. ".npy" saves the raw float32 array, ".tif" a float TIFF.
+        :return: Future of the write with enable_async_saving(), otherwise None
         """
         depths = self.get_depth_map()
-        Image.fromarray(depths, mode="F").save(filename)
+        return self._write(filename, depths, mode="F")
 
-    def get_screen_locations(self, points: List[List[float]]):
+    def get_screen_locations(self, points: List[List[float]], return_visibility=False, depth_test=False,
+                             depth_tolerance=1e-4):
         """
-        :param points: list of 3D world coordinate points
-        :return: (x, y, z) positions in the screen coordinates
+        Project world points into the view with the cached camera matrices. All points are projected together.
+
+        Parameters
+        ----------
+        points : array_like
+                (N, 3) list of 3D world coordinate points
+        return_visibility : bool
+                whether or not to also return a boolean mask of the points that are inside the view.
+        depth_test : bool
+                if True, points that are hidden behind a surface of the current frame are not visible. Reads back the
+                part of the depth buffer covering the points.
+        depth_tolerance : float
+                tolerance (in depth buffer units) for the depth test so points on a surface count as visible.
+
+        Returns
+        -------
+            np.ndarray of (x, y, z) positions in the screen coordinates (origin in the bottom left, z in [0, 1]) or,
+            with return_visibility, a tuple (positions, visible).
         """
-        points = np.asarray(points)
-        screen_positions = np.zeros((len(points), 3))
-        for i in range(len(points)):
-            screen_positions[i] = gluProject(points[i][0], points[i][1], points[i][2])
-        return screen_positions
+        self.camera_state.update(self.width(), self.height())
+        viewport = self.camera_state.viewport
+        screen_positions, in_front = project_points(points, self.camera_state.model_view,
+                                                    self.camera_state.projection, viewport)
+        if not return_visibility:
+            return screen_positions
+
+        vx, vy, vw, vh = viewport
+        x, y, z = screen_positions.T
+        visible = in_front & (x >= vx) & (x < vx + vw) & (y >= vy) & (y < vy + vh) & (z >= 0) & (z <= 1)
+        if depth_test and visible.any():
+            self.makeCurrent()
+            cols = x[visible].astype(int)
+            rows = y[visible].astype(int)
+            x0, y0 = cols.min(), rows.min()
+            w, h = cols.max() - x0 + 1, rows.max() - y0 + 1
+            buff = glReadPixels(x0, y0, w, h, GL_DEPTH_COMPONENT, GL_FLOAT)
+            depth = np.frombuffer(buff, dtype=np.float32).reshape(h, w)
+            visible[visible] = z[visible] <= depth[rows - y0, cols - x0] + depth_tolerance
+        return screen_positions, visible
+
+    def pick_world_point(self, x: float, y: float, radius: int = 0):
+        """
+        Find the world coordinates of the surface under a pixel. Only a (2 * radius + 1)^2 window of the depth buffer
+        around the pixel is read back.
+
+        Parameters
+        ----------
+        x : float
+                horizontal widget coordinate (from the left)
+        y : float
+                vertical widget coordinate (from the top, as in Qt events)
+        radius : int
+                half size of the window that is searched for the closest surface. Useful to hit thin objects.
 
-    def start_recording(self, video_file: str = 'test_vid.avi', save_separate_images=False):
+        Returns
+        -------
+            np.ndarray [x, y, z] of the closest surface point in the window or None if there is only background.
+        """
+        self.makeCurrent()
+        width, height = self.width(), self.height()
+        x, y = widget_to_window(x, y, height)
+        x0, y0 = max(0, x - radius), max(0, y - radius)
+        x1, y1 = min(width, x + radius + 1), min(height, y + radius + 1)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        buff = glReadPixels(x0, y0, x1 - x0, y1 - y0, GL_DEPTH_COMPONENT, GL_FLOAT)
+        window = np.frombuffer(buff, dtype=np.float32).reshape(y1 - y0, x1 - x0)
+        row, col = np.unravel_index(np.argmin(window), window.shape)
+        depth = window[row, col]
+        if depth >= 1.0:
+            return None
+        self.camera_state.update(width, height)
+        return unproject_points([x0 + col, y0 + row, depth], self.camera_state.model_view,
+                                self.camera_state.projection, self.camera_state.viewport)
+
+    def start_recording(self,
+                        video_file: str = 'test_vid.avi',
+                        save_separate_images=False,
+                        fps: float = None,
+                        backend: str = 'opencv',
+                        codec: str = None,
+                        crf: int = None,
+                        lossless: bool = False,
+                        max_queue_size: int = 8,
+                        drop_when_full: bool = False,
+                        fixed_rate: bool = False,
+                        clock: str = 'wall',
+                        write_timestamps: bool = False,
+                        png_compress_level: int = 1):
         """
-        Start recording screenshots to create a video.
-        # TODO: add ffmpeg option for lossless recordings.
-        :param video_file: path to video file to save.
-        :param save_separate_images: whether or not to save each screenshot as it records. Better if running out of
-                                     RAM for long videos, but is slower.
+        Start recording screenshots to create a video. Frames are encoded on a background thread while recording, so
+        memory use does not grow with the length of the recording.
+
+        Parameters
+        ----------
+        video_file : str
+                path to video file to save.
+        save_separate_images : bool
+                whether or not to save each screenshot as a png as it records. The video is then created from the
+                images when the recording is stopped.
+        fps : float
+                frame rate of the video. If None, it is estimated from the first recorded frames.
+        backend : str
+                'opencv' (cv2.VideoWriter) or 'ffmpeg' (frames are piped to an ffmpeg subprocess).
+        codec : str
+                FOURCC code for opencv or encoder name for ffmpeg. Default is uncompressed for opencv and libx264 for
+                ffmpeg.
+        crf : int
+                constant rate factor for the ffmpeg backend.
+        lossless : bool
+                whether or not to encode without loss.
+        max_queue_size : int
+                maximum number of frames waiting to be encoded before the recording applies backpressure.
+        drop_when_full : bool
+                drop frames instead of blocking the paint call when the encoder can't keep up.
+        fixed_rate : bool
+                resample the recorded frames to fps (default 30) by dropping and duplicating frames, so the video
+                plays in real time (or simulation time) regardless of how irregular the repaints are.
+        clock : str
+                'wall' to timestamp frames with time.time() or 'simulation' to use the time of the SOFA root node.
+        write_timestamps : bool
+                write a CSV sidecar (<video name>_timestamps.csv) with the video and source time of every frame.
+        png_compress_level : int
+                zlib level of the PNGs written with save_separate_images. They are written on worker threads.
         """
         if self._recording:
             return
+        if clock not in ('wall', 'simulation'):
+            raise ValueError(f'Unknown recording clock "{clock}". Use "wall" or "simulation".')
+        self._recording_clock = clock
         self._save_img = save_separate_images
+        timestamp_file = os.path.splitext(video_file)[0] + '_timestamps.csv' if write_timestamps else None
+        self._recorder_kwargs = dict(fps=fps, backend=backend, codec=codec, crf=crf, lossless=lossless,
+                                     max_queue_size=max_queue_size, drop_when_full=drop_when_full,
+                                     fixed_rate=fixed_rate, timestamp_file=timestamp_file)
         if self._save_img:
             os.mkdir('tmp_screenshots')
+            self._recording_index = open(os.path.join('tmp_screenshots', 'index.csv'), 'w')
+            self._recording_index.write('frame,time,file\n')
+            self._recording_frame = 0
+            self._recording_sink = ImageSink(max_in_flight=max_queue_size, png_compress_level=png_compress_level,
+                                             drop_when_full=drop_when_full)
+        else:
+            self._recorder = VideoRecorder(video_file, **self._recorder_kwargs)
         self._video_file = video_file
         self._recording = True
         self.repainted.connect(self._rec_save_img)
 
     def stop_recording(self):
         """
-        Stop recording for video and combine into final video.
-        TODO: allow for adjusting of fps setting.
+        Stop recording and finish writing the video. Blocks until all queued frames are encoded.
         """
         if not self._recording:
             return
         self._recording = False
         self.repainted.disconnect(self._rec_save_img)
         if self._save_img:
-            images = [os.path.join("tmp_screenshots", x) for x in os.listdir('tmp_screenshots')]
-            times = [float(re.findall('(\d+\.\d+).png', x)[0]) for x in images]
-            frame = cv2.imread(images[0])
+            from PIL import Image
+            self._recording_sink.close()
+            self._recording_sink = None
+            self._recording_index.close()
+            self._recording_index = None
+            with open(os.path.join('tmp_screenshots', 'index.csv')) as f:
+                frames = [line.rstrip('\n').split(',') for line in f.readlines()[1:]]
+            self._recorder = VideoRecorder(self._video_file, **self._recorder_kwargs)
+            try:
+                for _, t, image in frames:  # in capture order, several frames may share a simulation time
+                    with Image.open(os.path.join('tmp_screenshots', image)) as img:
+                        self._recorder.write(float(t), np.asarray(img.convert('RGB')))
+            finally:
+                self._recorder.close()
+                self._recorder = None
+                shutil.rmtree('tmp_screenshots')
         else:
-            images = [cv2.cvtColor(x[1], cv2.COLOR_BGR2RGB) for x in self._images]
-            times = [x[0] for x in self._images]
-            frame = images[0]
-
-        avg = np.array(times)
-        fps = 1 / (np.average(np.diff(avg)))
-        height, width, layers = frame.shape
-        video = cv2.VideoWriter(self._video_file, 0, fps, (width, height))
-        if self._save_img:
-            [video.write(cv2.cvtColor(cv2.imread(image), cv2.COLOR_BGR2RGB)) for image in images]
-        else:
-            [video.write(image) for image in images]
+            self._recorder.close()
+            self._recorder = None
+
+    def start_point_cloud_recording(self,
+                                    directory: str,
+                                    file_format: str = 'ply',
+                                    frame: str = 'world',
+                                    stride: int = 4,
+                                    with_color: bool = True,
+                                    clock: str = 'wall'):
+        """
+        Write the point cloud of every repainted frame to directory (see PointCloudWriter). Can run at the same time
+        as a video recording.
 
-        cv2.destroyAllWindows()
-        video.release()
-        if self._save_img:
-            shutil.rmtree('tmp_screenshots')
+        Parameters
+        ----------
+        directory : str
+                folder for the point cloud files and their index.csv
+        file_format : str
+                'ply' or 'npz'
+        frame : str
+                'camera' or 'world', see get_point_cloud()
+        stride : int
+                use every stride-th pixel in both directions
+        with_color : bool
+                store the pixel colors
+        clock : str
+                'wall' or 'simulation' time for the timestamps in index.csv
+        """
+        if self._point_cloud_writer is not None:
+            return
+        if clock not in ('wall', 'simulation'):
+            raise ValueError(f'Unknown recording clock "{clock}". Use "wall" or "simulation".')
+        self._point_cloud_writer = PointCloudWriter(directory, file_format)
+        self._point_cloud_kwargs = dict(frame=frame, stride=stride, with_color=with_color, clock=clock)
+        self.repainted.connect(self._rec_save_point_cloud)
+
+    def stop_point_cloud_recording(self) -> int:
+        """
+        Returns
+        -------
+            number of point clouds written
+        """
+        if self._point_cloud_writer is None:
+            return 0
+        self.repainted.disconnect(self._rec_save_point_cloud)
+        self._point_cloud_writer.close()
+        frames, self._point_cloud_writer = self._point_cloud_writer.frames_written, None
+        return frames
+
+    def recording_stats(self):
+        """
+        Live counters of the current recording, see VideoRecorder.stats(). Returns None if not recording.
+
+        With save_separate_images, 'queue_depth' is the number of PNGs waiting for a worker and 'duplicated' stays 0:
+        the images are only resampled to the fixed frame rate when stop_recording() encodes the video.
+        """
+        if self._recording_sink is not None:
+            sink = self._recording_sink.stats()
+            return {'captured': sink['submitted'] + sink['dropped'],  # like VideoRecorder, dropped frames count
+                    'written': sink['written'],
+                    'dropped': sink['dropped'],
+                    'duplicated': 0,
+                    'queue_depth': sink['in_flight']}
+        if self._recorder is None:
+            return None
+        return self._recorder.stats()
+
+    def _recording_time(self):
+        if self._recording_clock == 'simulation':
+            return self.visuals_node.getRoot().time.value
+        return time.time()
 
     def _rec_save_img(self):
-        if self._save_img:
-            self.save_image(f'tmp_screenshots/{time.time()}.png', dtype=np.uint8)
-        else:
-            self._images.append((time.time(), self.get_screen_shot(dtype=np.uint8)))
+        with profile_section(self.profiler, 'recording'):
+            if self._save_img:
+                # numbered instead of named by time, so repaints within one simulation step do not overwrite
+                # each other
+                name = f'{self._recording_frame:06d}.png'
+                timestamp = self._recording_time()
+                if self._recording_sink.write(os.path.join('tmp_screenshots', name),
+                                              self.get_screen_shot(return_with_alpha=True), mode="RGBA") is not None:
+                    self._recording_index.write(f'{self._recording_frame},{timestamp:.6f},{name}\n')
+                    self._recording_frame += 1
+            else:
+                self._recorder.write(self._recording_time(), self.get_screen_shot(dtype=np.uint8))
+
+    def _rec_save_point_cloud(self):
+        kwargs = self._point_cloud_kwargs
+        with profile_section(self.profiler, 'point_cloud'):
+            timestamp = self.visuals_node.getRoot().time.value if kwargs['clock'] == 'simulation' else time.time()
+            points = self.get_point_cloud(kwargs['frame'], kwargs['stride'], kwargs['with_color'])
+            self._point_cloud_writer.write(points, timestamp)
 
     def keyPressEvent(self, a0: QKeyEvent) -> None:
         key = a0.key()
@@ -577,21 +1117,11 @@ class QSofaGLView(QOpenGLWidget):
             self._rotating = True
             x, y = event.pos().x(), event.pos().y()
             self._rotate_screen_origin = [x, y]
-            self.makeCurrent()
-            width, height = self.width(), self.height()
-            buff = glReadPixels(0, 0, width, height, GL_DEPTH_COMPONENT, GL_FLOAT)
-            image = np.frombuffer(buff, dtype=np.float32)
-            image = image.reshape(height, width)
-            image = np.flipud(image)
-            # get the fragment depth
-            depth = image[int(y)][int(x)]
-            # get projection matrix, view matrix and the viewport rectangle
-            model_view = np.array(glGetDoublev(GL_MODELVIEW_MATRIX))
-            proj = np.array(glGetDoublev(GL_PROJECTION_MATRIX))
-            view = np.array(glGetIntegerv(GL_VIEWPORT))
-
-            # unproject the point
-            self._rotate_point = list(gluUnProject(y, x, depth, model_view, proj, view))
+            point = self.pick_world_point(x, y, radius=2)
+            if point is None:
+                # nothing under the cursor. Rotate around the center of the scene instead.
+                point = np.mean(self.zoom_bb.array(), axis=0)
+            self._rotate_point = list(point)
 
         elif event.button() == Qt.MouseButton.RightButton:
             self._panning = True
@@ -639,26 +1169,56 @@ class QSofaGLView(QOpenGLWidget):
         if event.button() == Qt.MouseButton.RightButton:
             self._panning = False
 
-    def draw_spheres(self, positions, radii, colors, clear_existing=True):
+    def draw_spheres(self, positions, radii, colors, clear_existing=True, as_scene_nodes=False):
         """
+        Draw spheres (i.e. landmarks) into the view. By default they are added to the marker overlay (see
+        self.markers), which draws all of them in one instanced call and does not change the scene graph. Use
+        self.markers.update_spheres() to move or recolor them afterwards.
+
         :param clear_existing: whether or not to clear other spheres from the scene
         :param positions: list of x,y,z positions
-        :param radii: list of radii for each sphere
-        :param colors: list of colors [r, g, b] for each sphere
+        :param radii: radius for all spheres or list of radii for each sphere
+        :param colors: color for all spheres or list of colors [r, g, b] or [r, g, b, a] for each sphere
+        :param as_scene_nodes: add a node with an OglModel per sphere to the visuals node instead (old behavior). Only
+                               needed if the spheres have to be part of the SOFA scene itself. The nodes are recycled
+                               through self.sphere_pool.
         """
         if clear_existing:
             self.clear_spheres()
-        for i in range(len(positions)):
-            new_node = self.visuals_node.addChild('sphere' + str(i))
-            self.spheres.append(new_node)
-            new_node.addObject("MeshObjLoader", name="loader" + str(i), filename="mesh/sphere.obj", scale=radii[i],
-                               translation=positions[i])
-            new_node.addObject("OglModel", name="i" + str(i), src="@loader" + str(i), color=colors[i])
-        Sofa.Simulation.initVisual(self.visuals_node)
-        Sofa.Simulation.initTextures(self.visuals_node)
+        if not as_scene_nodes:
+            self.markers.set_spheres(positions, radii, colors, append=True)
+            self.update()
+            return
+        self.makeCurrent()
+        for new_node in self.sphere_pool.acquire(positions, radii, colors):
+            Sofa.Simulation.initVisual(new_node)
+            Sofa.Simulation.initTextures(new_node)
+        self.update()
 
     def clear_spheres(self):
         """
-        clear all spheres from scene
+        clear all spheres from scene. Scene graph spheres are detached and kept in self.sphere_pool for reuse.
+        """
+        self.markers.clear('spheres')
+        if self.sphere_pool.live:
+            self.makeCurrent()  # nodes dropped from a full pool free their GL buffers
+            self.sphere_pool.release_all()
+            self.update()
+
+    @property
+    def spheres(self):
+        """ scene graph nodes of the spheres drawn with as_scene_nodes=True """
+        return self.sphere_pool.live
+
+    def marker_stats(self) -> dict:
+        """
+        Returns
+        -------
+            dict with the overlay counters (see MarkerOverlay.stats()) and the number of scene graph spheres that are
+            'live_sphere_nodes' and 'pooled_sphere_nodes'.
         """
-        [x.detachFromGraph() for x in self.spheres]
+        stats = self.markers.stats()
+        pool = self.sphere_pool.stats()
+        stats['live_sphere_nodes'] = pool['live']
+        stats['pooled_sphere_nodes'] = pool['pooled']
+        return stats
@@ -0,0 +1,265 @@
+try:
+    from qtpy.QtWidgets import *
+    from qtpy.QtCore import *
+    from qtpy.QtGui import *
+    try:
+        from qtpy.QtOpenGL import QOpenGLFramebufferObject, QOpenGLFramebufferObjectFormat
+    except ImportError:
+        from qtpy.QtGui import QOpenGLFramebufferObject, QOpenGLFramebufferObjectFormat
+except Exception as e:
+    print(e)
+    from PyQt6.QtWidgets import *
+    from PyQt6.QtCore import *
+    from PyQt6.QtGui import *
+    from PyQt6.QtOpenGL import QOpenGLFramebufferObject, QOpenGLFramebufferObjectFormat
+    Signal = pyqtSignal
+
+import Sofa
+from QSofaGLViewTools.gl_scene import init_gl, draw_scene, read_color_buffer, read_depth_buffer, render_poses, \
+    render_poses_to_arrays
+from QSofaGLViewTools.depth_pass import DepthLinearizationPass
+from QSofaGLViewTools.markers import MarkerOverlay
+from QSofaGLViewTools.camera_state import CameraState
+from QSofaGLViewTools.point_cloud import RayGridCache, get_point_cloud
+from QSofaGLViewTools.label_pass import LabelPass
+from QSofaGLViewTools.capture import FrameCapture
+from OpenGL.GL import *
+import numpy as np
+import os
+
+
+class QSofaOffscreenRenderer(QObject):
+    """
+    Renders a SOFA visuals node without a window. Uses a QOffscreenSurface for the GL context and draws into a
+    QOpenGLFramebufferObject of arbitrary size, using the same lighting, camera and drawing code as QSofaGLView.
+
+    A QGuiApplication (or QApplication) must exist. On machines without a display, call
+    QSofaOffscreenRenderer.create_application() before anything else, or run under Xvfb.
+    """
+    rendered = Signal()
+
+    def __init__(self,
+                 sofa_visuals_node: Sofa.Core.Node,
+                 camera: Sofa.Components.BaseCamera,
+                 size: tuple = (800, 600),
+                 suppress_base_light: bool = False,
+                 share_context: QOpenGLContext = None):
+        """
+
+        Parameters
+        ----------
+        sofa_visuals_node : Sofa.Core.Node
+                The SOFA Node that will be transversed for calculating the visuals.
+        camera : Sofa.Components.BaseCamera
+                The SOFA BaseCamera object that is used for calculating the view
+        size : Tuple[int, int]
+                Size of the rendered images (width, height) in pixels. Default = (800, 600)
+        suppress_base_light : bool
+                Whether or not the default SOFA light should be turned off. The scene will be black if no other light
+                is added to the scene.
+        share_context : QOpenGLContext
+                optional context to share textures and buffers with (i.e. QSofaGLView.context()).
+        """
+        super(QSofaOffscreenRenderer, self).__init__()
+        self.visuals_node = sofa_visuals_node
+        self.camera = camera
+        self.suppress_base_light = suppress_base_light
+        self.background_color = [1, 1, 1, 0]
+        self.z_far = camera.zFar
+        self.z_near = camera.zNear
+        self.markers = MarkerOverlay()
+        self.label_pass = None  # type: LabelPass
+        self.camera_state = CameraState(camera)
+        self.ray_grids = RayGridCache()
+        self.frame_capture = FrameCapture(camera)
+
+        surface_format = QSurfaceFormat.defaultFormat()
+        surface_format.setDepthBufferSize(24)
+        self._surface = QOffscreenSurface()
+        self._surface.setFormat(surface_format)
+        self._surface.create()
+        self._context = QOpenGLContext()
+        self._context.setFormat(surface_format)
+        if share_context is not None:
+            self._context.setShareContext(share_context)
+        if not self._context.create():
+            raise RuntimeError('Could not create an OpenGL context for offscreen rendering.')
+        self._fbo = None  # type: QOpenGLFramebufferObject
+        self._depth_pass = None  # type: DepthLinearizationPass
+        self._width, self._height = size
+        self.resize(*size)
+        init_gl(self.visuals_node, self._width, self._height, self.suppress_base_light)
+
+    @staticmethod
+    def create_application(software_rendering: bool = False):
+        """
+        Create a QGuiApplication suitable for rendering without a display if none exists yet.
+
+        Parameters
+        ----------
+        software_rendering : bool
+                force Mesa's software rasterizer (llvmpipe). Useful on compute nodes without a GPU.
+
+        Returns
+        -------
+            QGuiApplication instance
+        """
+        app = QGuiApplication.instance()
+        if app is not None:
+            return app
+        if 'DISPLAY' not in os.environ and 'WAYLAND_DISPLAY' not in os.environ:
+            os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        if software_rendering:
+            os.environ['LIBGL_ALWAYS_SOFTWARE'] = '1'
+        return QGuiApplication(["SOFA offscreen renderer"])
+
+    def context(self) -> QOpenGLContext:
+        return self._context
+
+    def width(self) -> int:
+        return self._width
+
+    def height(self) -> int:
+        return self._height
+
+    def size(self) -> tuple:
+        return self._width, self._height
+
+    def resize(self, width: int, height: int):
+        """ Change the size of the rendered images. Only re-creates the framebuffer object. """
+        self._width, self._height = int(width), int(height)
+        self.makeCurrent(bind_framebuffer=False)
+        if self._fbo is not None:
+            self._fbo.release()
+            self._fbo = None  # deletes the GL objects while the context is current
+        fbo_format = QOpenGLFramebufferObjectFormat()
+        fbo_format.setAttachment(QOpenGLFramebufferObject.Attachment.CombinedDepthStencil)
+        self._fbo = QOpenGLFramebufferObject(self._width, self._height, fbo_format)
+        self.camera.widthViewport = self._width
+        self.camera.heightViewport = self._height
+        self._fbo.bind()
+        glViewport(0, 0, self._width, self._height)
+
+    def makeCurrent(self, bind_framebuffer: bool = True):
+        """ Make the offscreen context current and bind the framebuffer object that is rendered to """
+        self._context.makeCurrent(self._surface)
+        if bind_framebuffer and self._fbo is not None:
+            self._fbo.bind()
+
+    def doneCurrent(self):
+        self._context.doneCurrent()
+
+    def render(self):
+        """ Draw the scene as seen by the camera into the framebuffer object """
+        self.makeCurrent()
+        glViewport(0, 0, self._width, self._height)
+        draw_scene(self.visuals_node, self.camera, self._width, self._height, self.background_color,
+                   self.suppress_base_light, overlay=self.markers, camera_state=self.camera_state)
+        self.rendered.emit()
+
+    def set_background_color(self, color):
+        """
+        :param color: [r, g, b, alpha] alpha determines opacity. Use 0 to save images with a transparent background
+        """
+        self.background_color = color
+
+    def get_screen_shot(self, return_with_alpha=False, dtype: np.dtype = np.uint8, out: np.ndarray = None):
+        """
+         Returns the RGB image array of the last render() call
+        :param return_with_alpha:
+        :param dtype:
+        :param out: optional C-contiguous (height, width, 3|4) array to read into. See QSofaGLView.get_screen_shot().
+        :return: numpy array representing the rendered image with provided dtype
+        """
+        self.makeCurrent()
+        return read_color_buffer(self._width, self._height, with_alpha=return_with_alpha, dtype=dtype, out=out)
+
+    def get_depth_map(self, out: np.ndarray = None):
+        """
+        Get the depth value for each pixel of the last render() call
+
+        Parameters
+        ----------
+        out : np.ndarray
+                optional C-contiguous (height, width) float32 array to read into. It receives the rows bottom-up (as
+                OpenGL stores them) and the returned depth map is a flipped view of it, so no memory is allocated.
+        """
+        self.makeCurrent()
+        if self._depth_pass is not None:
+            return self._depth_pass.run(self._fbo.handle(), self._width, self._height,
+                                        self.z_near.value, self.z_far.value, out=out)
+        return read_depth_buffer(self._width, self._height, self.z_near.value, self.z_far.value, out=out)
+
+    def enable_gpu_depth(self, enable: bool = True):
+        """ Linearize depth with a shader pass on the GPU in get_depth_map(). See QSofaGLView.enable_gpu_depth(). """
+        self.makeCurrent()
+        if enable and self._depth_pass is None:
+            self._depth_pass = DepthLinearizationPass()
+        elif not enable and self._depth_pass is not None:
+            self._depth_pass.release()
+            self._depth_pass = None
+
+    def capture(self, size: tuple = None, outputs=('rgb',), samples: int = 0, supersample: int = 1) -> dict:
+        """ Render at another resolution without resizing the renderer, see QSofaGLView.capture() """
+        self.makeCurrent()
+        if size is None:
+            size = (self._width, self._height)
+        return self.frame_capture.capture(self, size, outputs, samples, supersample)
+
+    def enable_labels(self, enable: bool = True, id_map: dict = None, label_unmapped: bool = True):
+        """ Set up or release the label pass, see QSofaGLView.enable_labels() """
+        self.makeCurrent()
+        if self.label_pass is not None:
+            self.label_pass.release()
+            self.label_pass = None
+        if enable:
+            self.label_pass = LabelPass(self.visuals_node, id_map, label_unmapped)
+
+    def get_label_map(self, out: np.ndarray = None) -> np.ndarray:
+        """ uint16 label image of the current camera view, see QSofaGLView.get_label_map() """
+        if self.label_pass is None:
+            self.enable_labels()
+        self.makeCurrent()
+        return self.label_pass.render(self.camera, self._width, self._height, camera_state=self.camera_state, out=out)
+
+    def get_point_cloud(self, frame: str = 'camera', stride: int = 1, with_color: bool = True) -> np.ndarray:
+        """ Point cloud of the last rendered frame, see QSofaGLView.get_point_cloud() """
+        return get_point_cloud(self, frame, stride, with_color)
+
+    def render_poses(self, poses, outputs=('rgb', 'depth', 'mask'), as_generator=False):
+        """
+        Render the scene from many camera poses in one call. See QSofaGLView.render_poses().
+
+        Parameters
+        ----------
+        poses : np.ndarray
+                (N, 7) camera poses [x, y, z, qx, qy, qz, qw] in world coordinates.
+        outputs : tuple
+                any of 'rgb', 'rgba', 'depth', 'mask' and 'labels'
+        as_generator : bool
+                if True, return a generator yielding one dict per pose instead of stacking all results.
+
+        Returns
+        -------
+            dict of output name -> (N, height, width, ...) np.ndarray, or a generator of per-pose dicts.
+        """
+        if as_generator:
+            return render_poses(self, poses, outputs)
+        return render_poses_to_arrays(self, poses, outputs)
+
+    def release(self):
+        """ Free the framebuffer object and the GL context """
+        self.makeCurrent(bind_framebuffer=False)
+        self.markers.release()
+        self.frame_capture.release()
+        if self.label_pass is not None:
+            self.label_pass.release()
+            self.label_pass = None
+        if self._depth_pass is not None:
+            self._depth_pass.release()
+            self._depth_pass = None
+        if self._fbo is not None:
+            self._fbo.release()
+            self._fbo = None
+        self._context.doneCurrent()
+        self._surface.destroy()
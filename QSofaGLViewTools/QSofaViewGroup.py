@@ -0,0 +1,165 @@
+try:
+    from qtpy.QtWidgets import *
+    from qtpy.QtCore import *
+    from qtpy.QtGui import *
+except Exception as e:
+    print(e)
+    from PyQt6.QtWidgets import *
+    from PyQt6.QtCore import *
+    from PyQt6.QtGui import *
+    Signal = pyqtSignal
+
+import Sofa
+from QSofaGLViewTools.QSofaGLView import QSofaGLView
+from typing import List
+
+
+class QSofaViewGroup(QObject):
+    """
+    Several QSofaGLViews of the same scene (i.e. endoscope, overview and top view) that share their GL objects and are
+    repainted in one scheduled pass.
+
+    With context sharing enabled (call QSofaViewGroup.enable_context_sharing() before creating the QApplication), all
+    views use one share group. The scene's visual models, textures and buffers are then initialized once for the first
+    view, instead of once per view. A single timer checks the simulation time and the cameras of all views and
+    repaints only the views that changed, so an idle group costs almost nothing.
+    """
+    frame_scheduled = Signal(int)  # number of views repainted in a pass
+
+    def __init__(self, sofa_visuals_node: Sofa.Core.Node, max_fps: float = 30, idle_fps: float = 1,
+                 update_visuals: bool = False):
+        """
+
+        Parameters
+        ----------
+        sofa_visuals_node : Sofa.Core.Node
+                The SOFA Node shown by all views of the group.
+        max_fps : float
+                maximum repaint rate of the views in Hz
+        idle_fps : float
+                repaint rate in Hz of views whose camera and scene did not change. 0 never repaints them.
+        update_visuals : bool
+                call Sofa.Simulation.updateVisual once per pass when the simulation time changed, instead of leaving
+                it to the simulation loop. It runs with the GL context of the first view current.
+        """
+        super(QSofaViewGroup, self).__init__()
+        self.visuals_node = sofa_visuals_node
+        self.max_fps = max_fps
+        self.idle_fps = idle_fps
+        self.update_visuals = update_visuals
+        self.views = []  # type: List[QSofaGLView]
+        self._initialized = []  # type: List[QSofaGLView]
+        self._last_sim_time = None
+        self._timer = QTimer()
+        self._timer.timeout.connect(self.tick)
+
+    @staticmethod
+    def enable_context_sharing():
+        """
+        Make all QOpenGLWidgets share one GL context group. Must be called before the QApplication is created.
+        """
+        if QCoreApplication.instance() is not None:
+            raise RuntimeError('Context sharing must be enabled before the QApplication is created.')
+        QCoreApplication.setAttribute(Qt.ApplicationAttribute.AA_ShareOpenGLContexts)
+
+    @staticmethod
+    def context_sharing_enabled() -> bool:
+        return QCoreApplication.testAttribute(Qt.ApplicationAttribute.AA_ShareOpenGLContexts)
+
+    def create_view(self,
+                    camera: Sofa.Components.BaseCamera,
+                    size: tuple = (800, 600),
+                    auto_place_camera: bool = False,
+                    suppress_base_light: bool = False) -> QSofaGLView:
+        """
+        Create a QSofaGLView of the group's visuals node and add it to the group. See QSofaGLView for the arguments.
+        """
+        view = QSofaGLView(sofa_visuals_node=self.visuals_node,
+                           camera=camera,
+                           size=size,
+                           auto_place_camera=auto_place_camera,
+                           suppress_base_light=suppress_base_light)
+        self.add_view(view)
+        return view
+
+    def add_view(self, view: QSofaGLView):
+        """ Add a view. Its own refresh timer is stopped, the group repaints it from now on. """
+        if view.view_group is not None and view.view_group is not self:
+            view.view_group.remove_view(view)
+        view.scheduler.stop()
+        view.view_group = self
+        if view not in self.views:
+            self.views.append(view)
+        if view.isValid() and view not in self._initialized:
+            self._initialized.append(view)  # initialized before joining the group
+        view.destroyed.connect(lambda *_, v=view: self._forget(v))
+
+    def remove_view(self, view: QSofaGLView):
+        self._forget(view)
+        view.view_group = None
+
+    def _forget(self, view):
+        if view in self.views:
+            self.views.remove(view)
+        if view in self._initialized:
+            self._initialized.remove(view)
+
+    def claim_visual_init(self, view: QSofaGLView) -> bool:
+        """
+        Called by a view of the group in initializeGL.
+
+        Returns
+        -------
+            bool: True if the view has to initialize the visuals, False if a view with a context sharing objects with
+            its context already did.
+        """
+        context = view.context()
+        shared = any(other is not view and other.context() is not None and
+                     QOpenGLContext.areSharing(context, other.context()) for other in self._initialized)
+        if view not in self._initialized:
+            self._initialized.append(view)
+        return not shared
+
+    def start(self, max_fps: float = None, idle_fps: float = None):
+        """ Start repainting the views from one timer """
+        if max_fps is not None:
+            self.max_fps = max_fps
+        if idle_fps is not None:
+            self.idle_fps = idle_fps
+        self._timer.start(max(1, int(round(1000 / self.max_fps))))
+
+    def stop(self):
+        self._timer.stop()
+
+    def mark_dirty(self):
+        """ Repaint all views in the next pass """
+        for view in self.views:
+            view.mark_dirty()
+
+    def tick(self):
+        """ One scheduled pass: update the visuals once if needed, then repaint every view that changed """
+        if self.update_visuals and self.views:
+            sim_time = self.visuals_node.getRoot().time.value
+            if sim_time != self._last_sim_time:
+                self._last_sim_time = sim_time
+                # updateVisual uploads the buffers and textures of the visual models, so it needs a GL context. With
+                # context sharing, the objects created in the first view's context are visible in all views.
+                first_view = self.views[0]
+                first_view.makeCurrent()
+                try:
+                    Sofa.Simulation.updateVisual(self.visuals_node)
+                finally:
+                    first_view.doneCurrent()
+        repainted = 0
+        for view in self.views:
+            scheduler = view.scheduler
+            scheduler.max_fps, scheduler.idle_fps = self.max_fps, self.idle_fps
+            redraws = scheduler.redraws
+            scheduler.tick()
+            repainted += scheduler.redraws - redraws
+        self.frame_scheduled.emit(repainted)
+
+    def stats(self) -> dict:
+        """ Per view redraw statistics (see RedrawScheduler.stats()) and whether the contexts are shared """
+        return {'context_sharing': self.context_sharing_enabled(),
+                'views': [view.scheduler.stats() for view in self.views]}
@@ -8,10 +8,12 @@ except Exception as e:
     from PyQt6.QtGui import *
     Signal = pyqtSignal
 
+from QSofaGLViewTools.transforms import quaternion_to_matrix
 import numpy as np
-import scipy.spatial.transform as transform
 import time
-from QSofaGLViewTools import QSofaGLView
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from QSofaGLViewTools.QSofaGLView import QSofaGLView
 
 
 class QSofaViewKeyboardController(QObject):
@@ -28,16 +30,15 @@ class QSofaViewKeyboardController(QObject):
         self._viewer_set = False
         self.translate_rate_limit = translate_rate_limit
         self.rotate_rate_limit = rotate_rate_limit
+        self.update_rate = update_rate
         self._update_timer = QTimer()
         self.camera_timer = QTimer()
         self.camera_timer.timeout.connect(self.update_camera)
-        self.camera_timer.setInterval(1/update_rate)
-        self.translate_rate_limit = translate_rate_limit
-        self.rotate_rate_limit = rotate_rate_limit
-        self.current_translational_speed = [0., 0., 0.]  # in percent of max speed
-        self.current_rotational_speed = [0., 0., 0.]  # in percent of max speed
-        self.camera_timer.start()
-        self.time_at_last_update = time.time()
+        self.camera_timer.setInterval(max(1, int(round(1000 / update_rate))))  # QTimer takes integer milliseconds
+        self.current_translational_speed = [0., 0., 0.]  # in fractions of the max speed [-1, 1]
+        self.current_rotational_speed = [0., 0., 0.]  # in fractions of the max speed [-1, 1]
+        self.time_at_last_update = time.perf_counter()
+        self.tick_rate = 0.  # measured rate of camera updates in Hz while keys are held
 
     def set_viewers(self, viewers):
         if hasattr(viewers, '__iter__'):
@@ -59,7 +60,7 @@ class QSofaViewKeyboardController(QObject):
         if not self._viewer_set:
             print('Cannot start auto-update. No SofaGLViewer is set.')
             return
-        self._update_timer.setInterval(rate)
+        self._update_timer.setInterval(max(1, int(round(rate * 1000))))  # rate is the period in seconds
         self._update_timer.start()
 
     def stop_auto_update(self):
@@ -70,38 +71,39 @@ class QSofaViewKeyboardController(QObject):
         mod = event.modifiers()
 
         if key == Qt.Key.Key_Up:
-            self.current_rotational_speed[0] = -self.rotate_rate_limit
+            self.current_rotational_speed[0] = 1
         elif key == Qt.Key.Key_Down:
-            self.current_rotational_speed[0] = self.rotate_rate_limit
+            self.current_rotational_speed[0] = -1
         elif key == Qt.Key.Key_Left:
             if mod == Qt.KeyboardModifier.ControlModifier:
-                self.current_rotational_speed[2] = -self.rotate_rate_limit
+                self.current_rotational_speed[2] = 1
             else:
-                self.current_rotational_speed[1] = -self.rotate_rate_limit
+                self.current_rotational_speed[1] = 1
         elif key == Qt.Key.Key_Right:
             if mod == Qt.KeyboardModifier.ControlModifier:
-                self.current_rotational_speed[2] = self.rotate_rate_limit
+                self.current_rotational_speed[2] = -1
             else:
-                self.current_rotational_speed[1] = self.rotate_rate_limit
+                self.current_rotational_speed[1] = -1
 
         elif key == Qt.Key.Key_W:
             if mod == Qt.KeyboardModifier.ControlModifier:
-                self.current_translational_speed[2] = self.translate_rate_limit
+                self.current_translational_speed[2] = -1
             else:
-                self.current_translational_speed[1] = -self.translate_rate_limit
+                self.current_translational_speed[1] = 1
         elif key == Qt.Key.Key_S:
             if mod == Qt.KeyboardModifier.ControlModifier:
-                self.current_translational_speed[2] = -self.translate_rate_limit
+                self.current_translational_speed[2] = 1
             else:
-                self.current_translational_speed[1] = self.translate_rate_limit
+                self.current_translational_speed[1] = -1
         elif key == Qt.Key.Key_A:
-            self.current_translational_speed[0] = self.translate_rate_limit
+            self.current_translational_speed[0] = -1
         elif key == Qt.Key.Key_D:
-            self.current_translational_speed[0] = -self.translate_rate_limit
+            self.current_translational_speed[0] = 1
 
         elif key == Qt.Key.Key_Control:
             self.current_rotational_speed[1] = 0
             self.current_translational_speed[1] = 0
+        self._update_ticking()
 
     def keyReleaseEvent(self, event: QKeyEvent):
         key = event.key()
@@ -140,21 +142,54 @@ class QSofaViewKeyboardController(QObject):
         elif key == Qt.Key.Key_Control:
             self.current_rotational_speed[2] = 0
             self.current_translational_speed[2] = 0
+        self._update_ticking()
+
+    @property
+    def is_moving(self) -> bool:
+        return any(self.current_rotational_speed) or any(self.current_translational_speed)
+
+    def _update_ticking(self):
+        """ Run the camera timer only while a key is held """
+        if self.is_moving and not self.camera_timer.isActive():
+            self.time_at_last_update = time.perf_counter()
+            self.camera_timer.start()
+        elif not self.is_moving and self.camera_timer.isActive():
+            self.camera_timer.stop()
+            self.tick_rate = 0.
 
     def update_camera(self):
-        now = time.time()
-        time_since_last_update = self.time_at_last_update - now
+        if not self.viewers:
+            return
+        now = time.perf_counter()
+        dt = now - self.time_at_last_update
         self.time_at_last_update = now
-
-        # very inefficiently calculate the new angle for the camera
-        current_rotational_speed = np.array(self.current_rotational_speed) * self.rotate_rate_limit
-        additional_rotation = current_rotational_speed * time_since_last_update
-        rotation = transform.Rotation.from_euler("XYZ", additional_rotation, degrees=True)
-        self.viewers[0].camera.rotate(rotation.as_quat().tolist())
-        current_orientation = transform.Rotation.from_quat(self.viewers[0].camera_orientation.array())
-        # calculate the new position
-        current_translational_speed = np.array(self.current_translational_speed) * self.translate_rate_limit
-        current_pos = self.viewers[0].camera_position.array()
-        current_pos = np.reshape(current_pos, (current_pos.shape[-1]))
-        self.viewers[0].update_position(current_pos[:3] + current_orientation.apply(current_translational_speed * time_since_last_update))
-        self.viewers[0].update_orientation(current_orientation.as_quat())
+        if dt <= 0:
+            return
+        self.tick_rate = 1 / dt if self.tick_rate == 0 else 0.9 * self.tick_rate + 0.1 / dt
+
+        viewer = self.viewers[0]
+        angles = np.radians(np.multiply(self.current_rotational_speed, self.rotate_rate_limit * dt))
+        if angles.any():
+            viewer.camera.rotate(euler_xyz_to_quaternion(angles).tolist())
+        orientation = np.asarray(viewer.camera_orientation.array(), dtype=np.float64).reshape(-1)
+        translation = np.multiply(self.current_translational_speed, self.translate_rate_limit * dt)
+        current_pos = np.asarray(viewer.camera_position.array()).reshape(-1)
+        viewer.update_position(current_pos[:3] + quaternion_to_matrix(orientation) @ translation)
+        viewer.update_orientation(orientation)
+        for v in self.viewers:
+            v.update()
+        self.view_update_requested.emit()
+
+
+def euler_xyz_to_quaternion(angles) -> np.ndarray:
+    """
+    Quaternion [x, y, z, w] of intrinsic X, Y, Z rotations in radians. Same as
+    scipy.spatial.transform.Rotation.from_euler("XYZ", angles).as_quat()
+    """
+    half = np.asarray(angles, dtype=np.float64) / 2
+    cx, cy, cz = np.cos(half)
+    sx, sy, sz = np.sin(half)
+    return np.array([sx * cy * cz + cx * sy * sz,
+                     cx * sy * cz - sx * cy * sz,
+                     cx * cy * sz + sx * sy * cz,
+                     cx * cy * cz - sx * sy * sz])
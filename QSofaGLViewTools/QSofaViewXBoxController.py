@@ -8,11 +8,15 @@ except Exception as e:
     from PyQt6.QtGui import *
     Signal = pyqtSignal
 
+from QSofaGLViewTools.QXboxController import QXboxController, AxisSnapshot
+from QSofaGLViewTools.QSofaViewKeyboardController import euler_xyz_to_quaternion
+from QSofaGLViewTools.transforms import quaternion_to_matrix
+from collections import deque
 import numpy as np
-import scipy.spatial.transform as transform
 import time
-from QSofaGLViewTools import QSofaGLView
-from QSofaGLViewTools import QXboxController
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from QSofaGLViewTools.QSofaGLView import QSofaGLView
 
 
 class QSofaViewXBoxController(QObject):
@@ -28,32 +32,33 @@ class QSofaViewXBoxController(QObject):
 
         self.viewer = None  # type: QSofaGLView
         self._viewer_set = False
-        self._bumper_pressed = False
         self._dead_zone = dead_zone
         self.translate_rate_limit = translate_rate_limit
         self.rotate_rate_limit = rotate_rate_limit
+        self.update_rate = update_rate
         self.xbox_thread = QThread()
         self.controller = QXboxController()
         self.controller.moveToThread(self.xbox_thread)
         self.xbox_thread.started.connect(self.controller.start)
         self.xbox_thread.start()
-        self.controller.axis_rjoy_action.connect(lambda x: self.update_viewer_cam(self.viewer, 'r_thumb', x))
-        self.controller.axis_ljoy_action.connect(lambda x: self.update_viewer_cam(self.viewer, 'l_thumb', x))
-        self.controller.button_lbump_action.connect(lambda x: setattr(self, '_bumper_pressed', x))
-        self.controller.axis_rtrigger_action.connect(lambda x: self.update_viewer_cam(self.viewer, 'r_trigger', x))
-        self.controller.axis_ltrigger_action.connect(lambda x: self.update_viewer_cam(self.viewer, 'l_trigger', x))
         self._update_timer = QTimer()
+        # the axes are read from the controller's snapshot once per tick instead of reacting to every device event
         self.camera_timer = QTimer()
         self.camera_timer.timeout.connect(self.update_camera)
-        self.camera_timer.setInterval(1/update_rate)
-        self.translate_rate_limit = translate_rate_limit
-        self.rotate_rate_limit = rotate_rate_limit
-        self.current_translational_speed = [0., 0., 0.]  # in percent of max speed
-        self.current_rotational_speed = [0., 0., 0.]  # in percent of max speed
+        self.camera_timer.setInterval(max(1, int(round(1000 / update_rate))))  # QTimer takes integer milliseconds
+        self.current_translational_speed = [0., 0., 0.]  # in fractions of the max speed [-1, 1]
+        self.current_rotational_speed = [0., 0., 0.]  # in fractions of the max speed [-1, 1]
+        self._last_revision = 0
+        self._pending_input_time = None  # read time of axis values that have not moved the camera yet
+        self._latencies = deque(maxlen=100)  # seconds from reading an axis event to moving the camera with it
         self.camera_timer.start()
-        self.time_at_last_update = time.time()
+        self.time_at_last_update = time.perf_counter()
+
+        self.controller.button_x_action.connect(self._print_camera)
 
-        self.controller.button_x_action.connect(lambda: print(self.viewer.camera.position.array(), self.viewer.camera.orientation.array()))
+    def _print_camera(self, pressed):
+        if pressed and self._viewer_set:
+            print(self.viewer.camera.position.array(), self.viewer.camera.orientation.array())
 
     def set_viewer(self, viewer):
         self.viewer = viewer
@@ -68,33 +73,52 @@ class QSofaViewXBoxController(QObject):
         if not self._viewer_set:
             print('Cannot start auto-update. No SofaGLViewer is set.')
             return
-        self._update_timer.setInterval(rate)
+        self._update_timer.setInterval(max(1, int(round(rate * 1000))))  # rate is the period in seconds
         self._update_timer.start()
 
     def stop_auto_update(self):
         self._update_timer.stop()
 
-    def update_viewer_cam(self, viewer, action, value):
-        if not self._viewer_set:
-            return
-        if action == 'l_thumb':
-            self.current_translational_speed = [self.scale_axis_value(-value['x']),
-                                                  self.scale_axis_value(-value['y']),
-                                                  self.current_translational_speed[2]]
-        elif action == 'r_thumb':
-            self.current_rotational_speed = [self.scale_axis_value(-value['y']), self.current_rotational_speed[1],
-                                               self.scale_axis_value(value['x'])] if self._bumper_pressed else [
-                self.scale_axis_value(-value['y']), self.scale_axis_value(value['x']),
-                self.current_rotational_speed[2]]
-        elif action == 'r_trigger':
-            self.current_translational_speed = [self.current_translational_speed[0],
-                                                  self.current_translational_speed[1],
-                                                  value]
-        elif action == 'l_trigger':
-            self.current_translational_speed = [self.current_translational_speed[0],
-                                                  self.current_translational_speed[1],
-                                                  -value]
-        self.view_update_requested.emit()
+    def stop(self, timeout_ms: int = 2000) -> bool:
+        """
+        Stop the camera updates and shut down the controller thread.
+
+        :param timeout_ms: how long to wait for the thread to finish
+        :return: True if the thread finished
+        """
+        self.camera_timer.stop()
+        self._update_timer.stop()
+        self.controller.stop()  # wakes the input thread up, so start() returns and the thread's event loop runs
+        self.xbox_thread.quit()
+        return self.xbox_thread.wait(timeout_ms)
+
+    def latency_stats(self) -> dict:
+        """
+        Input-to-camera latency over the last 100 axis changes: time from reading the event on the controller thread
+        to the camera update that used it.
+
+        Returns
+        -------
+            dict with 'mean_ms', 'max_ms' and 'last_ms' (None before the first axis change) and the number of
+            'events' the controller received.
+        """
+        latencies = np.array(self._latencies) * 1000
+        return {'mean_ms': float(latencies.mean()) if len(latencies) else None,
+                'max_ms': float(latencies.max()) if len(latencies) else None,
+                'last_ms': float(latencies[-1]) if len(latencies) else None,
+                'events': self.controller.events_received}
+
+    def apply_axes(self, axes: AxisSnapshot):
+        """ Set the camera speeds from a snapshot of the controller axes """
+        self.current_translational_speed = [self.scale_axis_value(axes.ljoy_x),
+                                            self.scale_axis_value(axes.ljoy_y),
+                                            axes.ltrigger - axes.rtrigger]
+        if axes.lbump:
+            self.current_rotational_speed = [self.scale_axis_value(axes.rjoy_y), 0.,
+                                             self.scale_axis_value(-axes.rjoy_x)]
+        else:
+            self.current_rotational_speed = [self.scale_axis_value(axes.rjoy_y),
+                                             self.scale_axis_value(-axes.rjoy_x), 0.]
 
     def scale_axis_value(self, axis_input):
         scaled = axis_input * 2
@@ -104,20 +128,28 @@ class QSofaViewXBoxController(QObject):
             return np.sign(scaled) * (abs(scaled) - self._dead_zone) / (1 - self._dead_zone)
 
     def update_camera(self):
-        now = time.time()
-        time_since_last_update = self.time_at_last_update - now
+        now = time.perf_counter()
+        dt = now - self.time_at_last_update
         self.time_at_last_update = now
+        axes = self.controller.axis_snapshot()
+        if axes.revision != self._last_revision:
+            self._last_revision = axes.revision
+            self.apply_axes(axes)
+            self._pending_input_time = axes.timestamp
+            self.view_update_requested.emit()
+        moving = any(self.current_rotational_speed) or any(self.current_translational_speed)
+        if not self._viewer_set or not moving:
+            self._pending_input_time = None
+            return
 
-        # very inefficiently calculate the new angle for the camera
-        current_rotational_speed = np.array(self.current_rotational_speed) * self.rotate_rate_limit
-        additional_rotation = current_rotational_speed * time_since_last_update
-        rotation = transform.Rotation.from_euler("XYZ", additional_rotation, degrees=True)
-        self.viewer.camera.rotate(rotation.as_quat().tolist())
-        current_orientation = transform.Rotation.from_quat(self.viewer.camera.orientation.array())
-
-        # calculate the new position
-        current_position = self.viewer.camera.position.array()
-        current_translational_speed = np.array(self.current_translational_speed) * self.translate_rate_limit
-        self.viewer.camera.position = self.viewer.camera.position.array()
-        self.viewer.camera.position = list(
-            current_position + current_orientation.apply(current_translational_speed * time_since_last_update))
\ No newline at end of file
+        angles = np.radians(np.multiply(self.current_rotational_speed, self.rotate_rate_limit * dt))
+        if angles.any():
+            self.viewer.camera.rotate(euler_xyz_to_quaternion(angles).tolist())
+        orientation = np.asarray(self.viewer.camera.orientation.array(), dtype=np.float64).reshape(-1)
+        translation = np.multiply(self.current_translational_speed, self.translate_rate_limit * dt)
+        self.viewer.camera.position = list(self.viewer.camera.position.array() +
+                                           quaternion_to_matrix(orientation) @ translation)
+        self.viewer.update()
+        if self._pending_input_time is not None:
+            self._latencies.append(time.perf_counter() - self._pending_input_time)
+            self._pending_input_time = None
@@ -8,9 +8,116 @@ except Exception as e:
     from PyQt6.QtGui import *
     Signal = pyqtSignal
 
-import importlib
+from collections import namedtuple
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
 import time
-import inputs
+
+
+AxisSnapshot = namedtuple('AxisSnapshot', ['ljoy_x', 'ljoy_y', 'rjoy_x', 'rjoy_y', 'ltrigger', 'rtrigger', 'lbump',
+                                           'timestamp', 'revision'])
+AxisSnapshot.__doc__ = """
+Latest state of all axes (and the left bumper, which changes what the right stick does). timestamp is the
+time.perf_counter() at which the newest of these values was read from the device and revision counts the changes.
+"""
+
+
+class _DeviceWatcher:
+    """
+    Sleeps until an input device appears in device_dir (Linux inotify) or until stop() is called. Also used to wait
+    for the gamepad's device file to become readable, so a blocking read never prevents stopping the thread. Without
+    inotify, wait_for_device() falls back to waking up every poll_interval seconds. select() only works on sockets on
+    Windows, so there the waits use a threading.Event instead of the self-pipe.
+    """
+
+    _IN_ATTRIB = 0x00000004  # udev changes the permissions after creating the device file
+    _IN_CREATE = 0x00000100
+    _IN_NONBLOCK = 0o4000
+    _IN_CLOEXEC = 0o2000000
+    _EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+    def __init__(self, device_dir: str = '/dev/input', poll_interval: float = 1.0):
+        self.device_dir = device_dir
+        self.poll_interval = poll_interval
+        self._inotify_fd = None
+        self._stop_read = self._stop_write = None
+        self._stopped = threading.Event()
+        if os.name != 'posix':
+            return
+        self._stop_read, self._stop_write = os.pipe()
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(self._IN_NONBLOCK | self._IN_CLOEXEC)
+            if fd >= 0:
+                if libc.inotify_add_watch(fd, os.fsencode(device_dir), self._IN_CREATE | self._IN_ATTRIB) < 0:
+                    os.close(fd)
+                else:
+                    self._inotify_fd = fd
+        except (OSError, AttributeError):  # no libc or no inotify
+            pass
+
+    @property
+    def uses_inotify(self) -> bool:
+        return self._inotify_fd is not None
+
+    def stop(self):
+        """ Wake up any wait. Thread-safe. """
+        self._stopped.set()
+        if self._stop_write is not None:
+            os.write(self._stop_write, b'x')
+
+    def wait_for_device(self) -> bool:
+        """
+        Block until an event device is created (or its permissions change) in device_dir.
+
+        :return: False if stop() was called
+        """
+        if self._stop_read is None:
+            return not self._stopped.wait(self.poll_interval)
+        while True:
+            watched = [self._stop_read] + ([self._inotify_fd] if self.uses_inotify else [])
+            readable, _, _ = select.select(watched, [], [], None if self.uses_inotify else self.poll_interval)
+            if self._stop_read in readable:
+                return False
+            if not self.uses_inotify or self._read_device_names():
+                return True
+
+    def wait_readable(self, file_descriptor: int) -> bool:
+        """
+        Block until file_descriptor has data.
+
+        :return: False if stop() was called
+        """
+        if self._stop_read is None:  # the gamepads of inputs have no file descriptor there, see _read_events()
+            return not self._stopped.is_set()
+        readable, _, _ = select.select([self._stop_read, file_descriptor], [], [])
+        return self._stop_read not in readable
+
+    def _read_device_names(self):
+        names = []
+        try:
+            data = os.read(self._inotify_fd, 4096)
+        except BlockingIOError:
+            return names
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = self._EVENT_HEADER.unpack_from(data, offset)
+            offset += self._EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode(errors='replace')
+            offset += length
+            if name.startswith('event') or name.startswith('js'):
+                names.append(name)
+        return names
+
+    def close(self):
+        for fd in (self._inotify_fd, self._stop_read, self._stop_write):
+            if fd is not None:
+                os.close(fd)
+        self._inotify_fd = None
 
 
 class QXboxController(QObject):
@@ -28,46 +135,77 @@ class QXboxController(QObject):
     button_dleft_action = Signal(bool)
     button_dright_action = Signal(bool)
     button_ddown_action = Signal(bool)
+    # axis signals are only emitted with emit_axis_events = True. Poll axis_snapshot() instead to get one coalesced
+    # update per frame rather than one queued signal per device event.
     axis_ljoy_action = Signal(object)  # will send a dict{'x': x_val, 'y': y_val}
     axis_rjoy_action = Signal(object)  # will send a dict{'x': x_val, 'y': y_val}
     axis_ltrigger_action = Signal(float)
     axis_rtrigger_action = Signal(float)
 
-    def __init__(self):
+    def __init__(self, emit_axis_events: bool = False, device_dir: str = '/dev/input'):
+        """
+        :param emit_axis_events: emit the axis_*_action signals for every axis event (see axis_snapshot())
+        :param device_dir: directory that is watched for new input devices while no gamepad is connected
+        """
         super(QXboxController, self).__init__()
         self._stop = False
+        self.device_dir = device_dir
+        self._watcher = None  # type: _DeviceWatcher
         self.connected = False
+        self.emit_axis_events = emit_axis_events
+        self.events_received = 0
         self.gamepad = None  # type: inputs.GamePad
-        self._ljoyx = 0
-        self._ljoyy = 0
-        self._rjoyx = 0
-        self._rjoyy = 0
         self._haty = 0
         self._hatx = 0
+        self._axis_lock = threading.Lock()
+        self._axes = dict.fromkeys(('ljoy_x', 'ljoy_y', 'rjoy_x', 'rjoy_y', 'ltrigger', 'rtrigger'), 0.0)
+        self._axes['lbump'] = False
+        self._axis_timestamp = 0.0
+        self._axis_revision = 0
+
+        # exact event code -> handler
+        self.signaldictionary = {'BTN_SOUTH': lambda x: self.button_a_action.emit(x),
+                                 'BTN_EAST': lambda x: self.button_b_action.emit(x),
+                                 'BTN_WEST': lambda x: self.button_x_action.emit(x),
+                                 'BTN_NORTH': lambda x: self.button_y_action.emit(x),
+                                 'BTN_TR': lambda x: self.button_rbump_action.emit(x),
+                                 'BTN_TL': self._left_bumper,
+                                 'BTN_THUMBR': lambda x: self.button_rjoy_action.emit(x),
+                                 'BTN_THUMBL': lambda x: self.button_ljoy_action.emit(x),
+                                 'BTN_SELECT': lambda x: self.button_select_action.emit(x),
+                                 'BTN_START': lambda x: self.button_start_action.emit(x),
+                                 'ABS_HAT0Y': lambda x: self._determine_d_button('y', x),
+                                 'ABS_HAT0X': lambda x: self._determine_d_button('x', x),
+                                 'ABS_RY': lambda x: self._set_axis('rjoy_y', x / 32768),
+                                 'ABS_RX': lambda x: self._set_axis('rjoy_x', x / 32768),
+                                 'ABS_Y': lambda x: self._set_axis('ljoy_y', x / 32768),
+                                 'ABS_X': lambda x: self._set_axis('ljoy_x', x / 32768),
+                                 'ABS_RZ': lambda x: self._set_axis('rtrigger', x / 255),
+                                 'ABS_Z': lambda x: self._set_axis('ltrigger', x / 255)}
+
+    def axis_snapshot(self) -> AxisSnapshot:
+        """ Thread-safe copy of the latest axis values """
+        with self._axis_lock:
+            return AxisSnapshot(timestamp=self._axis_timestamp, revision=self._axis_revision, **self._axes)
 
-        self.signaldictionary = {'SOUTH': lambda x: self.button_a_action.emit(x),
-                                 'EAST': lambda x: self.button_b_action.emit(x),
-                                 'WEST': lambda x: self.button_x_action.emit(x),
-                                 'NORTH': lambda x: self.button_y_action.emit(x),
-                                 'TR': lambda x: self.button_rbump_action.emit(x),
-                                 'TL': lambda x: self.button_lbump_action.emit(x),
-                                 'THUMBR': lambda x: self.button_rjoy_action.emit(x),
-                                 'THUMBL': lambda x: self.button_ljoy_action.emit(x),
-                                 'SELECT': lambda x: self.button_select_action.emit(x),
-                                 'START': lambda x: self.button_start_action.emit(x),
-                                 'HAT0Y': lambda x: self._determine_d_button('y', x),
-                                 'HAT0X': lambda x: self._determine_d_button('x', x),
-                                 'RY': lambda x: [self.__setattr__('_rjoyy', x/32768),
-                                                  self.axis_rjoy_action.emit({'x': self._rjoyx, 'y': self._rjoyy})],
-                                 'RX': lambda x: [self.__setattr__('_rjoyx', x/32768),
-                                                  self.axis_rjoy_action.emit({'x': self._rjoyx, 'y': self._rjoyy})],
-                                 'Y': lambda x: [self.__setattr__('_ljoyy', x/32768),
-                                                  self.axis_ljoy_action.emit({'x': self._ljoyx, 'y': self._ljoyy})],
-                                 'X': lambda x: [self.__setattr__('_ljoyx', x/32768),
-                                                  self.axis_ljoy_action.emit({'x': self._ljoyx, 'y': self._ljoyy})],
-                                 'RZ': lambda x: self.axis_rtrigger_action.emit(x/255),
-                                 'Z': lambda x: self.axis_ltrigger_action.emit(x/255)}
-        self._keys = self.signaldictionary.keys()
+    def _set_axis(self, name, value):
+        with self._axis_lock:
+            self._axes[name] = value
+            self._axis_timestamp = time.perf_counter()
+            self._axis_revision += 1
+        if self.emit_axis_events:
+            if name.startswith('ljoy'):
+                self.axis_ljoy_action.emit({'x': self._axes['ljoy_x'], 'y': self._axes['ljoy_y']})
+            elif name.startswith('rjoy'):
+                self.axis_rjoy_action.emit({'x': self._axes['rjoy_x'], 'y': self._axes['rjoy_y']})
+            elif name == 'ltrigger':
+                self.axis_ltrigger_action.emit(value)
+            elif name == 'rtrigger':
+                self.axis_rtrigger_action.emit(value)
+
+    def _left_bumper(self, state):
+        self._set_axis('lbump', bool(state))
+        self.button_lbump_action.emit(state)
 
     def _determine_d_button(self, axis, state):
         prev_val = self._haty if axis == 'y' else self._hatx
@@ -100,29 +238,81 @@ class QXboxController(QObject):
                     self.button_dright_action.emit(state)
 
     def start(self):
-        while not self.connected and not self._stop:
+        """
+        Read the gamepad until stop() is called. Blocks, so run it on its own thread. While no gamepad is connected,
+        the thread sleeps until a new input device shows up instead of rescanning the devices periodically.
+        """
+        import inputs  # scans the input devices on import, so only do it when the controller is actually used
+        self._watcher = _DeviceWatcher(self.device_dir)
+        try:
+            while not self._stop:
+                try:
+                    self.gamepad = inputs.devices.gamepads[0]
+                except IndexError:
+                    if not self._watcher.wait_for_device():
+                        break
+                    inputs.devices = inputs.DeviceManager()  # rescan only when a device was added
+                    continue
+                self.connected = True
+                self._read_events(inputs)
+                self.connected = False
+                self.gamepad = None
+        finally:
+            self._watcher.close()
+            self._watcher = None
+            self._stop = False
+
+    def _read_events(self, inputs):
+        """ Dispatch gamepad events until it is unplugged or stop() is called """
+        file_descriptor = None  # without an evdev character device (i.e. XInput on Windows), use blocking reads
+        if os.name == 'posix':
             try:
-                self.gamepad = inputs.devices.gamepads[0]
-            except IndexError as e:
-                time.sleep(0.1)
-                importlib.reload(inputs)  # in case controller wasn't plugged in, this refreshes the module
-                continue
-            self.connected = True
+                file_descriptor = self.gamepad._character_device.fileno()
+            except (AttributeError, OSError, ValueError):
+                pass
+        if file_descriptor is None:
             while not self._stop:
                 try:
                     events = self.gamepad.read()
-                except inputs.UnpluggedError:
-                    self.connected = False
-                    break
-
-                for event in events:
-                    if event.ev_type != 'Sync':
-                        for key in self._keys:
-                            if key in event.code:
-                                self.signaldictionary[key](event.state)
-                                break
+                except (inputs.UnpluggedError, OSError):
+                    inputs.devices = inputs.DeviceManager()  # forget the unplugged device
+                    return
+                self._dispatch(events)
+            return
+        # Read the evdev records straight from the file descriptor. gamepad.read() goes through a buffered reader that
+        # returns one event per call, so records of a burst could wait in its buffer while select() sees no new data.
+        event_format = inputs.EVENT_FORMAT
+        event_size = struct.calcsize(event_format)
+        remainder = b''
+        while not self._stop:
+            if not self._watcher.wait_readable(file_descriptor):
+                return
+            try:
+                data = os.read(file_descriptor, 64 * event_size)
+            except OSError:
+                data = b''
+            if not data:  # unplugged
+                inputs.devices = inputs.DeviceManager()
+                return
+            data = remainder + data
+            complete = len(data) - len(data) % event_size
+            remainder = data[complete:]
+            self._dispatch(self.gamepad._make_event(*record)
+                           for record in struct.iter_unpack(event_format, data[:complete]))
 
-            self._stop = False
+    def _dispatch(self, events):
+        for event in events:
+            handler = self.signaldictionary.get(event.code)
+            if handler is not None:
+                self.events_received += 1
+                handler(event.state)
 
     def stop(self):
+        """ Make start() return. Thread-safe, wakes up the input thread if it is waiting. """
         self._stop = True
+        watcher = self._watcher
+        if watcher is not None:
+            try:
+                watcher.stop()
+            except OSError:  # closed in the meantime
+                pass
@@ -1,4 +1,6 @@
 from .QSofaGLView import QSofaGLView
+from .QSofaOffscreenRenderer import QSofaOffscreenRenderer
+from .QSofaViewGroup import QSofaViewGroup
 from .QSofaViewXBoxController import QSofaViewXBoxController
 from .QSofaViewKeyboardController import QSofaViewKeyboardController
 from .QXboxController import QXboxController
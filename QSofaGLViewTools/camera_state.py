@@ -0,0 +1,72 @@
+import numpy as np
+from QSofaGLViewTools.transforms import pose_to_model_view
+
+
+def perspective_matrix(field_of_view: float, aspect: float, near: float, far: float) -> np.ndarray:
+    """ Row-major 4x4 equivalent of gluPerspective (field_of_view is the vertical angle in degrees) """
+    f = 1 / np.tan(np.radians(field_of_view) / 2)
+    return np.array([[f / aspect, 0, 0, 0],
+                     [0, f, 0, 0],
+                     [0, 0, (far + near) / (near - far), 2 * far * near / (near - far)],
+                     [0, 0, -1, 0]])
+
+
+class CameraState:
+    """
+    Matrices and intrinsics of a SOFA BaseCamera computed in Python and cached until the camera changes. Changes are
+    detected with the change counters of the camera Data (position, orientation, fieldOfView, zNear, zFar and the
+    viewport size), so an unchanged camera costs a few counter reads per frame and no GL query at all.
+    """
+
+    _WATCHED = ('position', 'orientation', 'fieldOfView', 'zNear', 'zFar', 'widthViewport', 'heightViewport')
+
+    def __init__(self, camera):
+        self.camera = camera
+        self.revision = 0  # incremented every time the cached values change
+        self.model_view = np.eye(4)
+        self.projection = np.eye(4)
+        self.gl_model_view = np.eye(4)  # column-major copies for glLoadMatrixd
+        self.gl_projection = np.eye(4)
+        self.viewport = (0, 0, 1, 1)
+        self.intrinsics = (1.0, 1.0, 0.5, 0.5)
+        self.near = self.far = self.field_of_view = 0.0
+        self._data = [camera.findData(name) for name in self._WATCHED]
+        self._key = None
+
+    def _counters(self):
+        counters = []
+        for data in self._data:
+            data.updateIfDirty()  # pull values of linked Data (i.e. a camera following MechanicalObject dofs)
+            counters.append(data.getCounter())
+        return tuple(counters)
+
+    def update(self, width: int, height: int) -> bool:
+        """
+        Recompute the cached values if the camera Data or the viewport size changed.
+
+        Returns
+        -------
+            bool: True if anything was recomputed
+        """
+        key = self._counters() + (width, height)
+        if key == self._key:
+            return False
+        self._key = key
+        camera = self.camera
+        self.near, self.far = camera.zNear.value, camera.zFar.value
+        self.field_of_view = camera.findData('fieldOfView').value
+        pose = np.concatenate([camera.position.array(), camera.orientation.array()])
+        self.model_view = pose_to_model_view(pose)
+        self.projection = perspective_matrix(self.field_of_view, width / height, self.near, self.far)
+        self.gl_model_view = np.ascontiguousarray(self.model_view.T)
+        self.gl_projection = np.ascontiguousarray(self.projection.T)
+        self.viewport = (0, 0, width, height)
+        # https://github.com/opencv/opencv_contrib/blob/master/modules/viz/src/types.cpp for a symmetric frustum
+        self.intrinsics = (self.projection[0, 0] * width / 2, self.projection[1, 1] * height / 2,
+                           width / 2, height / 2)
+        self.revision += 1
+        return True
+
+    def invalidate(self):
+        """ Force a recomputation on the next update(), i.e. after replacing Data objects of the camera """
+        self._key = None
@@ -0,0 +1,232 @@
+"""
+Capture of frames at a resolution independent of the size of the view, with optional multisampling (MSAA) and
+supersampling.
+"""
+from OpenGL.GL import *
+from QSofaGLViewTools.gl_scene import draw_scene, read_color_buffer, read_raw_depth_buffer
+from QSofaGLViewTools.readback import linearize_depth
+from QSofaGLViewTools.camera_state import CameraState
+from QSofaGLViewTools.profiling import profile_section
+import numpy as np
+
+
+CAPTURE_OUTPUTS = ('rgb', 'rgba', 'depth', 'mask', 'labels')
+
+
+def downsample_mean(image: np.ndarray, factor: int) -> np.ndarray:
+    """ Average factor x factor pixel blocks of a (height * factor, width * factor, ...) image (box filter) """
+    if factor == 1:
+        return image
+    height, width = image.shape[0] // factor, image.shape[1] // factor
+    blocks = image.reshape(height, factor, width, factor, *image.shape[2:]).astype(np.float32)
+    mean = blocks.mean(axis=(1, 3))
+    if np.issubdtype(image.dtype, np.integer):
+        mean = np.rint(mean)
+    return mean.astype(image.dtype)
+
+
+def downsample_nearest(image: np.ndarray, factor: int) -> np.ndarray:
+    """ Take the sample closest to the center of every factor x factor pixel block (for depth, masks and labels) """
+    if factor == 1:
+        return image
+    return np.ascontiguousarray(image[factor // 2::factor, factor // 2::factor])
+
+
+class _Framebuffer:
+    """ Framebuffer with a color and a depth renderbuffer, optionally multisampled """
+
+    def __init__(self, width: int, height: int, samples: int = 0):
+        self.width, self.height, self.samples = width, height, samples
+        self.handle = int(glGenFramebuffers(1))
+        self.renderbuffers = [int(r) for r in glGenRenderbuffers(2)]
+        glBindFramebuffer(GL_FRAMEBUFFER, self.handle)
+        for renderbuffer, internal_format, attachment in zip(self.renderbuffers,
+                                                             (GL_RGBA8, GL_DEPTH24_STENCIL8),
+                                                             (GL_COLOR_ATTACHMENT0, GL_DEPTH_STENCIL_ATTACHMENT)):
+            glBindRenderbuffer(GL_RENDERBUFFER, renderbuffer)
+            if samples:
+                glRenderbufferStorageMultisample(GL_RENDERBUFFER, samples, internal_format, width, height)
+            else:
+                glRenderbufferStorage(GL_RENDERBUFFER, internal_format, width, height)
+            glFramebufferRenderbuffer(GL_FRAMEBUFFER, attachment, GL_RENDERBUFFER, renderbuffer)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+        status = glCheckFramebufferStatus(GL_FRAMEBUFFER)
+        if status != GL_FRAMEBUFFER_COMPLETE:
+            self.release()
+            raise RuntimeError(f'Could not create a {width}x{height} capture framebuffer with {samples} samples '
+                               f'(status {status}). The size may exceed GL_MAX_RENDERBUFFER_SIZE.')
+
+    def release(self):
+        glDeleteFramebuffers(1, [self.handle])
+        glDeleteRenderbuffers(len(self.renderbuffers), self.renderbuffers)
+
+
+class FrameCopy:
+    """
+    Copy of the last completed frame (color and depth) of a framebuffer, kept on the GPU so it can be shown again
+    without drawing the scene, i.e. while a simulation step is running (see frame_sync.SimulationSync). The copy has
+    the same number of samples as the framebuffer, so storing and restoring are plain blits.
+    """
+
+    def __init__(self):
+        self._framebuffer = None  # type: _Framebuffer
+        self.valid = False
+
+    def store(self, source_framebuffer: int, width: int, height: int, samples: int = 0):
+        """ Copy the frame in source_framebuffer. The context must be current. source_framebuffer stays bound. """
+        framebuffer = self._framebuffer
+        key = (width, height, samples)
+        if framebuffer is None or (framebuffer.width, framebuffer.height, framebuffer.samples) != key:
+            self.release()
+            self._framebuffer = framebuffer = _Framebuffer(width, height, samples)
+        _blit(source_framebuffer, framebuffer.handle, width, height, width, height)
+        glBindFramebuffer(GL_FRAMEBUFFER, source_framebuffer)
+        self.valid = True
+
+    def restore(self, target_framebuffer: int, width: int, height: int) -> bool:
+        """
+        Show the stored frame in target_framebuffer, stretched if the size changed since. target_framebuffer is bound
+        afterwards.
+
+        :return: False if there is no stored frame or it cannot be stretched (multisampled)
+        """
+        framebuffer = self._framebuffer
+        if not self.valid or (framebuffer.samples and (framebuffer.width, framebuffer.height) != (width, height)):
+            return False
+        _blit(framebuffer.handle, target_framebuffer, framebuffer.width, framebuffer.height, width, height)
+        glBindFramebuffer(GL_FRAMEBUFFER, target_framebuffer)
+        return True
+
+    def release(self):
+        """ Free the framebuffer. The context it was created in must be current. """
+        if self._framebuffer is not None:
+            self._framebuffer.release()
+        self._framebuffer = None
+        self.valid = False
+
+
+def _blit(source, target, source_width, source_height, target_width, target_height):
+    glBindFramebuffer(GL_READ_FRAMEBUFFER, source)
+    glBindFramebuffer(GL_DRAW_FRAMEBUFFER, target)
+    glBlitFramebuffer(0, 0, source_width, source_height, 0, 0, target_width, target_height,
+                      GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT, GL_NEAREST)
+
+
+class FrameCapture:
+    """
+    Renders the scene of a QSofaGLView or QSofaOffscreenRenderer into framebuffers of any size, so images for datasets
+    can be exported at 2-4K while the view itself stays small and fast.
+
+    Anti-aliasing can be done with multisampling (samples > 0, resolved on the GPU) and/or supersampling (the frame
+    is rendered supersample times larger in both directions and reduced with a box filter on the CPU). Depth, masks
+    and labels are never averaged: they come from the resolved first sample and, when supersampling, from the sample
+    in the middle of each block, so they stay valid values.
+
+    The camera of the view is used with its own cached matrices (the aspect ratio of the capture may differ from the
+    view's). The framebuffers are kept until the size or the number of samples changes. release() frees them and
+    needs the same context to be current.
+    """
+
+    def __init__(self, camera):
+        self.camera_state = CameraState(camera)
+        self._framebuffers = None  # (draw framebuffer, resolve framebuffer or None)
+        self._key = None
+
+    def _allocate(self, width, height, samples):
+        key = (width, height, samples)
+        if key == self._key:
+            return
+        self.release()
+        draw = _Framebuffer(width, height, samples)
+        resolve = _Framebuffer(width, height) if samples else None
+        self._framebuffers = (draw, resolve)
+        self._key = key
+
+    def capture(self, renderer, size: tuple, outputs=('rgb',), samples: int = 0, supersample: int = 1,
+                profiler=None) -> dict:
+        """
+        Render one frame of the renderer's scene and camera. The renderer's GL context must be current. The
+        framebuffer and viewport that were set before are restored afterwards.
+
+        Parameters
+        ----------
+        renderer : QSofaGLView or QSofaOffscreenRenderer
+        size : tuple
+                (width, height) of the returned images
+        outputs : tuple
+                any of 'rgb', 'rgba', 'depth' (distance from the camera plane), 'mask' and 'labels' (see
+                label_pass.LabelPass)
+        samples : int
+                MSAA samples per pixel. 0 disables multisampling.
+        supersample : int
+                render supersample times larger in both directions and average down
+        profiler : profiling.FrameProfiler
+                optional profiler for the sections 'capture_draw' and 'capture_readback'
+
+        Returns
+        -------
+            dict of output name -> np.ndarray in image orientation, plus 'intrinsics' (fx, fy, cx, cy) for the
+            returned resolution.
+        """
+        unknown = set(outputs) - set(CAPTURE_OUTPUTS)
+        if unknown:
+            raise ValueError(f'Unknown capture outputs {unknown}. Choose from {CAPTURE_OUTPUTS}.')
+        if supersample < 1:
+            raise ValueError('supersample must be at least 1.')
+        width, height = int(size[0]) * supersample, int(size[1]) * supersample
+        previous = int(glGetIntegerv(GL_FRAMEBUFFER_BINDING))
+        viewport = glGetIntegerv(GL_VIEWPORT)
+        try:
+            with profile_section(profiler, 'capture_draw'):
+                self._allocate(width, height, samples)
+                draw, resolve = self._framebuffers
+                glBindFramebuffer(GL_FRAMEBUFFER, draw.handle)
+                glViewport(0, 0, width, height)
+                draw_scene(renderer.visuals_node, renderer.camera, width, height, renderer.background_color,
+                           renderer.suppress_base_light, overlay=renderer.markers, camera_state=self.camera_state)
+                if resolve is not None:
+                    glBindFramebuffer(GL_READ_FRAMEBUFFER, draw.handle)
+                    glBindFramebuffer(GL_DRAW_FRAMEBUFFER, resolve.handle)
+                    glBlitFramebuffer(0, 0, width, height, 0, 0, width, height, GL_COLOR_BUFFER_BIT, GL_LINEAR)
+                    glBlitFramebuffer(0, 0, width, height, 0, 0, width, height, GL_DEPTH_BUFFER_BIT, GL_NEAREST)
+                    glBindFramebuffer(GL_FRAMEBUFFER, resolve.handle)
+            with profile_section(profiler, 'capture_readback'):
+                result = self._read(renderer, width, height, outputs)
+                if 'labels' in outputs:
+                    if renderer.label_pass is None:
+                        renderer.enable_labels()
+                    result['labels'] = renderer.label_pass.render(renderer.camera, width, height,
+                                                                  camera_state=self.camera_state)
+        finally:
+            glBindFramebuffer(GL_FRAMEBUFFER, previous)
+            glViewport(*viewport)
+        for name in result:
+            if name in ('rgb', 'rgba'):
+                result[name] = downsample_mean(result[name], supersample)
+            else:
+                result[name] = downsample_nearest(result[name], supersample)
+        result['intrinsics'] = tuple(value / supersample for value in self.camera_state.intrinsics)
+        return result
+
+    def _read(self, renderer, width, height, outputs):
+        result = {}
+        if 'rgb' in outputs:
+            result['rgb'] = read_color_buffer(width, height)
+        if 'rgba' in outputs:
+            result['rgba'] = read_color_buffer(width, height, with_alpha=True)
+        if 'depth' in outputs or 'mask' in outputs:
+            depth = read_raw_depth_buffer(width, height)
+            if 'mask' in outputs:
+                result['mask'] = depth < 1.0
+            if 'depth' in outputs:
+                result['depth'] = linearize_depth(depth, renderer.z_near.value, renderer.z_far.value, out=depth)
+        return result
+
+    def release(self):
+        """ Free the framebuffers. The context they were created in must be current. """
+        if self._framebuffers is not None:
+            for framebuffer in self._framebuffers:
+                if framebuffer is not None:
+                    framebuffer.release()
+        self._framebuffers = None
+        self._key = None
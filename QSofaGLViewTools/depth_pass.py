@@ -0,0 +1,160 @@
+from OpenGL.GL import *
+from QSofaGLViewTools.gl_scene import compile_program, read_pixels_into
+import numpy as np
+
+
+_VERTEX_SHADER = """
+#version 120
+varying vec2 uv;
+void main()
+{
+    uv = gl_Vertex.xy * 0.5 + 0.5;
+    gl_Position = gl_Vertex;
+}
+"""
+
+_FRAGMENT_SHADER = """
+#version 120
+uniform sampler2D depth_texture;
+uniform float near;
+uniform float far;
+uniform int u_normalize;
+uniform float range_min;
+uniform float range_max;
+varying vec2 uv;
+void main()
+{
+    float d = texture2D(depth_texture, uv).r;
+    float z = -far * near / (far + d * (near - far));  // same as linearize_depth()
+    if (u_normalize == 1)
+    {
+        // distance range_min -> 1, range_max -> 0, background -> 0 (same look as get_depth_image)
+        float value = (range_max + z) / (range_max - range_min);
+        z = d < 1.0 ? clamp(value, 0.0, 1.0) : 0.0;
+    }
+    gl_FragColor = vec4(z, 0.0, 0.0, 1.0);
+}
+"""
+
+
+class DepthLinearizationPass:
+    """
+    Converts the depth buffer on the GPU. The depth of the source framebuffer is copied into a texture and a
+    full-screen shader pass writes either the linear depth (float32, same values as get_depth_map) or a depth image
+    normalized to a fixed distance range (uint16) into a single channel color attachment that is then read back. This
+    avoids the CPU conversion passes and halves the read back size for uint16 images.
+
+    Must be used with the GL context of the source framebuffer current.
+    """
+
+    def __init__(self):
+        self._program = compile_program(_VERTEX_SHADER, _FRAGMENT_SHADER)
+        self._uniforms = {name: glGetUniformLocation(self._program, name)
+                          for name in ('depth_texture', 'near', 'far', 'u_normalize', 'range_min', 'range_max')}
+        self._depth_texture = int(glGenTextures(1))
+        self._color_textures = {}  # dtype -> texture
+        self._framebuffers = {}  # dtype -> framebuffer
+        self._size = (0, 0)
+
+    def _allocate(self, width, height):
+        if self._size == (width, height):
+            return
+        glBindTexture(GL_TEXTURE_2D, self._depth_texture)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_DEPTH_COMPONENT32F, width, height, 0, GL_DEPTH_COMPONENT, GL_FLOAT, None)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_COMPARE_MODE, GL_NONE)
+        for dtype, internal_format, gl_type in ((np.float32, GL_R32F, GL_FLOAT),
+                                                (np.uint16, GL_R16, GL_UNSIGNED_SHORT)):
+            if dtype not in self._color_textures:
+                self._color_textures[dtype] = int(glGenTextures(1))
+                self._framebuffers[dtype] = int(glGenFramebuffers(1))
+            glBindTexture(GL_TEXTURE_2D, self._color_textures[dtype])
+            glTexImage2D(GL_TEXTURE_2D, 0, internal_format, width, height, 0, GL_RED, gl_type, None)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+            glBindFramebuffer(GL_FRAMEBUFFER, self._framebuffers[dtype])
+            glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D,
+                                   self._color_textures[dtype], 0)
+            if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+                raise RuntimeError(f'Could not create the {dtype.__name__} depth framebuffer.')
+        glBindTexture(GL_TEXTURE_2D, 0)
+        self._size = (width, height)
+
+    def run(self,
+            source_framebuffer: int,
+            width: int,
+            height: int,
+            near: float,
+            far: float,
+            depth_range: tuple = None,
+            out: np.ndarray = None) -> np.ndarray:
+        """
+        Convert the depth buffer of source_framebuffer and read back the result.
+
+        Parameters
+        ----------
+        source_framebuffer : int
+                GL name of the framebuffer holding the depth to convert (i.e. QOpenGLWidget.defaultFramebufferObject())
+        width : int
+        height : int
+        near : float
+                camera zNear
+        far : float
+                camera zFar
+        depth_range : tuple
+                (min_distance, max_distance). If given, the result is a uint16 image with min_distance mapped to the
+                maximum value and max_distance (and the background) to 0. Otherwise the float32 linear depth is
+                returned.
+        out : np.ndarray
+                optional C-contiguous array to read into. See gl_scene.read_color_buffer().
+
+        Returns
+        -------
+            (height, width) np.ndarray in image orientation
+        """
+        dtype = np.float32 if depth_range is None else np.uint16
+        if out is None:
+            out = np.empty((height, width), dtype=dtype)
+        elif out.dtype != dtype:
+            raise ValueError(f'out must be of type {dtype.__name__}.')
+        self._allocate(width, height)
+
+        glBindFramebuffer(GL_FRAMEBUFFER, source_framebuffer)
+        glActiveTexture(GL_TEXTURE0)
+        glBindTexture(GL_TEXTURE_2D, self._depth_texture)
+        glCopyTexSubImage2D(GL_TEXTURE_2D, 0, 0, 0, 0, 0, width, height)
+
+        glBindFramebuffer(GL_FRAMEBUFFER, self._framebuffers[dtype])
+        glPushAttrib(GL_ENABLE_BIT | GL_VIEWPORT_BIT)
+        glDisable(GL_DEPTH_TEST)
+        glDisable(GL_LIGHTING)
+        glDisable(GL_BLEND)
+        glViewport(0, 0, width, height)
+        glUseProgram(self._program)
+        glUniform1i(self._uniforms['depth_texture'], 0)
+        glUniform1f(self._uniforms['near'], near)
+        glUniform1f(self._uniforms['far'], far)
+        glUniform1i(self._uniforms['u_normalize'], 0 if depth_range is None else 1)
+        if depth_range is not None:
+            glUniform1f(self._uniforms['range_min'], depth_range[0])
+            glUniform1f(self._uniforms['range_max'], depth_range[1])
+        glBegin(GL_QUADS)
+        for x, y in ((-1, -1), (1, -1), (1, 1), (-1, 1)):
+            glVertex2f(x, y)
+        glEnd()
+        glUseProgram(0)
+        glPopAttrib()
+
+        read_pixels_into(0, 0, width, height, GL_RED, out)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glBindFramebuffer(GL_FRAMEBUFFER, source_framebuffer)
+        return out.reshape(height, width)[::-1]
+
+    def release(self):
+        """ Free all GL resources. The context must be current. """
+        glDeleteProgram(self._program)
+        glDeleteTextures([self._depth_texture] + list(self._color_textures.values()))
+        if self._framebuffers:
+            glDeleteFramebuffers(len(self._framebuffers), list(self._framebuffers.values()))
+        self._color_textures, self._framebuffers = {}, {}
@@ -0,0 +1,131 @@
+"""
+Synchronization between a simulation loop running on its own thread and the GUI thread drawing the scene.
+"""
+import Sofa
+from collections import deque
+from contextlib import contextmanager
+import threading
+import time
+
+
+class _RateCounter:
+    """ Events per second over the last window events """
+
+    def __init__(self, window: int = 60):
+        self._times = deque(maxlen=window)
+
+    def tick(self):
+        self._times.append(time.perf_counter())
+
+    @property
+    def rate(self) -> float:
+        if len(self._times) < 2 or self._times[-1] <= self._times[0]:
+            return 0.0
+        return (len(self._times) - 1) / (self._times[-1] - self._times[0])
+
+
+class SimulationSync:
+    """
+    Hands completed simulation steps from a simulation thread to the GUI thread.
+
+    The simulation thread advances the scene with step() (or changes it inside a `with sync.modifying():` block). Each
+    completed step publishes a new generation. The GUI thread calls begin_frame()/end_frame() around drawing
+    (QSofaGLView does this when its frame_sync is set). When a new generation is available, begin_frame() runs
+    Sofa.Simulation.updateVisual on the GUI thread with the view's GL context current, so visual models, buffers and
+    textures are updated where the GL context lives.
+
+    Stepping and drawing are serialized by a plain mutex that is held for the whole step and the whole draw, so frames
+    are never torn. A double-buffered handoff is not possible with SOFA: the visual state lives in the scene graph
+    itself (mappings write OglModel positions and topology during animate, and SGL.draw reads them), so there is no
+    separate copy that could be published. In the default mode the simulation therefore waits for a running draw and
+    the GUI for a running step.
+
+    In lock_free mode the GUI thread never waits for a running step: if the simulation holds the lock, begin_frame()
+    returns False and the scene is not drawn. QSofaGLView then shows a copy of the last completed frame again, which
+    keeps the GUI responsive at the cost of repeated frames.
+
+    Simulation loops that call Sofa.Simulation.animate directly still work. A change of the root node's time is then
+    treated as a new generation, but nothing prevents drawing during the step.
+    """
+
+    def __init__(self, node: Sofa.Core.Node, lock_free: bool = False):
+        """
+
+        Parameters
+        ----------
+        node : Sofa.Core.Node
+                root node of the simulation
+        lock_free : bool
+                never block the GUI thread (see class description)
+        """
+        self.node = node
+        self.lock_free = lock_free
+        self.generation = 0  # last completed simulation step
+        self.drawn_generation = -1  # generation whose visual state was last updated for drawing
+        self.frames_skipped = 0  # lock-free frames that repeated the last frame because a step was running
+        self._lock = threading.RLock()
+        self._holding = False
+        self._last_time = None
+        self._sim_rate = _RateCounter()
+        self._render_rate = _RateCounter()
+
+    def step(self, dt: float = None):
+        """ Advance the simulation by dt (default node.dt) and publish the result. Call from the simulation thread. """
+        with self.modifying():
+            Sofa.Simulation.animate(self.node, self.node.getDt() if dt is None else dt)
+
+    @contextmanager
+    def modifying(self):
+        """ Context manager for changing the scene from the simulation thread. Publishes a generation on exit. """
+        with self._lock:
+            yield
+            self.generation += 1
+            self._sim_rate.tick()
+
+    def begin_frame(self) -> bool:
+        """
+        Call from the GUI thread before drawing, with the GL context current. Updates the visual state if a new
+        generation was published. Call end_frame() afterwards in any case.
+
+        Returns
+        -------
+            bool: True if the scene may be drawn (it then shows the newest generation). False only in lock_free mode
+            while a step is running: the scene graph must not be drawn then.
+        """
+        if self.lock_free:
+            self._holding = self._lock.acquire(blocking=False)
+        else:
+            self._holding = self._lock.acquire()
+        if not self._holding:
+            self.frames_skipped += 1
+            return False
+        sim_time = self.node.time.value
+        if self.generation != self.drawn_generation or sim_time != self._last_time:
+            Sofa.Simulation.updateVisual(self.node)
+            self.drawn_generation = self.generation
+            self._last_time = sim_time
+        return True
+
+    def end_frame(self):
+        """ Call from the GUI thread after drawing """
+        if self._holding:
+            self._holding = False
+            self._lock.release()
+        self._render_rate.tick()
+
+    @property
+    def sim_fps(self) -> float:
+        """ Published simulation steps per second """
+        return self._sim_rate.rate
+
+    @property
+    def render_fps(self) -> float:
+        """ Frames drawn per second """
+        return self._render_rate.rate
+
+    def stats(self) -> dict:
+        return {'sim_fps': self.sim_fps,
+                'render_fps': self.render_fps,
+                'generation': self.generation,
+                'drawn_generation': self.drawn_generation,
+                'frames_skipped': self.frames_skipped}
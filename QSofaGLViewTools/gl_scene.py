@@ -0,0 +1,303 @@
+"""
+GL state setup, scene drawing and readback shared by QSofaGLView and QSofaOffscreenRenderer. All functions expect the
+GL context (and framebuffer) to draw to or read from to be current.
+"""
+import Sofa.SofaGL as SGL
+import Sofa
+from OpenGL.GL import *
+from OpenGL.GLU import *
+from QSofaGLViewTools.readback import linearize_depth, gl_read_pixels_raw
+from QSofaGLViewTools.transforms import pose_to_model_view
+from QSofaGLViewTools.profiling import profile_section
+import numpy as np
+import ctypes
+
+
+GL_DTYPES = {np.uint8: GL_UNSIGNED_BYTE,
+             np.float32: GL_FLOAT,
+             np.uint16: GL_UNSIGNED_SHORT}
+
+
+def compile_program(vertex_source: str, fragment_source: str) -> int:
+    """ Compile and link a GLSL program. Raises a RuntimeError with the info log if anything fails. """
+    program = glCreateProgram()
+    shaders = []
+    for shader_type, source in ((GL_VERTEX_SHADER, vertex_source), (GL_FRAGMENT_SHADER, fragment_source)):
+        shader = glCreateShader(shader_type)
+        glShaderSource(shader, source)
+        glCompileShader(shader)
+        if not glGetShaderiv(shader, GL_COMPILE_STATUS):
+            log = glGetShaderInfoLog(shader)
+            glDeleteShader(shader)
+            raise RuntimeError(f'Shader compilation failed: {log}')
+        glAttachShader(program, shader)
+        shaders.append(shader)
+    glLinkProgram(program)
+    for shader in shaders:
+        glDetachShader(program, shader)
+        glDeleteShader(shader)
+    if not glGetProgramiv(program, GL_LINK_STATUS):
+        log = glGetProgramInfoLog(program)
+        glDeleteProgram(program)
+        raise RuntimeError(f'Shader program linking failed: {log}')
+    return program
+
+
+def setup_base_light(suppress_base_light: bool):
+    """ Turn off the default light (GL_LIGHT0) if requested """
+    if suppress_base_light:
+        glLightfv(GL_LIGHT0, GL_AMBIENT, [0, 0, 0, 0])
+        glLightfv(GL_LIGHT0, GL_DIFFUSE,  [0, 0, 0, 0])
+        glLightfv(GL_LIGHT0, GL_SPECULAR,  [0, 0, 0, 0])
+        glLightfv(GL_LIGHT0, GL_POSITION,  [0, 0, 0, 0])
+        glLightf(GL_LIGHT0, GL_SPOT_CUTOFF, 180)
+        glEnable(GL_LIGHT0)
+
+
+def init_gl(visuals_node: Sofa.Core.Node, width: int, height: int, suppress_base_light: bool,
+            init_visuals: bool = True):
+    """
+    Set up the GL state for drawing SOFA visuals and initialize the visual and texture data of the node. init_visuals
+    can be False if a context sharing objects with the current one already initialized them.
+    """
+    glViewport(0, 0, width, height)
+    glEnable(GL_LIGHTING)
+    glEnable(GL_DEPTH_TEST)
+    glDepthFunc(GL_LESS)
+    setup_base_light(suppress_base_light)
+
+    SGL.glewInit()
+    if init_visuals:
+        Sofa.Simulation.initVisual(visuals_node)
+        Sofa.Simulation.initTextures(visuals_node)
+
+
+def load_camera_matrices(camera, width: int, height: int, model_view: np.ndarray = None, camera_state=None):
+    """
+    Load the projection and model-view matrices of a SOFA BaseCamera. If model_view (row-major 4x4) is given, it is
+    used instead of the camera's own model-view matrix. With a camera_state.CameraState, the matrices come from its
+    cache instead of being rebuilt and fetched from SOFA every time.
+    """
+    glMatrixMode(GL_PROJECTION)
+    if camera_state is not None:
+        camera_state.update(width, height)
+        glLoadMatrixd(camera_state.gl_projection)
+    else:
+        glLoadIdentity()
+        gluPerspective(camera.findData('fieldOfView').value, (width / height), camera.zNear.value,
+                       camera.zFar.value)
+    glMatrixMode(GL_MODELVIEW)
+    if model_view is not None:
+        glLoadMatrixd(np.ascontiguousarray(model_view.T))  # OpenGL is column-major
+    elif camera_state is not None:
+        glLoadMatrixd(camera_state.gl_model_view)
+    else:
+        glLoadIdentity()
+        glMultMatrixd(camera.getOpenGLModelViewMatrix())
+
+
+def draw_scene(visuals_node: Sofa.Core.Node, camera, width: int, height: int, background_color,
+               suppress_base_light: bool, model_view: np.ndarray = None, overlay=None, camera_state=None,
+               profiler=None):
+    """
+    Clear the current framebuffer and draw the visuals node as seen by the camera. overlay is an optional
+    markers.MarkerOverlay drawn on top of the scene. See load_camera_matrices() for camera_state. With a
+    profiling.FrameProfiler, the steps are timed as the sections 'lighting', 'matrices', 'sofa_draw' and 'markers'.
+    """
+    with profile_section(profiler, 'lighting'):
+        setup_base_light(suppress_base_light)
+        glClearColor(*background_color)
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+    with profile_section(profiler, 'matrices'):
+        load_camera_matrices(camera, width, height, model_view, camera_state)
+    with profile_section(profiler, 'sofa_draw'):
+        SGL.draw(visuals_node)
+    if overlay is not None:
+        with profile_section(profiler, 'markers'):
+            overlay.draw()
+
+
+def read_pixels_into(x: int, y: int, width: int, height: int, pixel_format, out: np.ndarray) -> np.ndarray:
+    """
+    glReadPixels straight into the memory of a C-contiguous numpy array. Rows end up in OpenGL order (bottom row
+    first).
+    """
+    if not out.flags.c_contiguous:
+        raise ValueError('out must be a C-contiguous array.')
+    channels = {GL_RGB: 3, GL_RGBA: 4, GL_DEPTH_COMPONENT: 1, GL_RED: 1}[pixel_format]
+    if out.size != width * height * channels:
+        raise ValueError(f'out has {out.size} elements but {width * height * channels} are needed.')
+    glPixelStorei(GL_PACK_ALIGNMENT, 1)
+    gl_read_pixels_raw(x, y, width, height, pixel_format, GL_DTYPES[out.dtype.type],
+                       out.ctypes.data_as(ctypes.c_void_p))
+    return out
+
+
+def read_color_buffer(width: int, height: int, with_alpha: bool = False, dtype: np.dtype = np.uint8,
+                      out: np.ndarray = None):
+    """
+    Read the color buffer into a (height, width, 3|4) array in image orientation (first row is the top).
+
+    If out is given, the pixels are read directly into it (it must be C-contiguous with the right size and dtype).
+    out then holds the rows in OpenGL order and the returned array is a flipped view of it, so nothing is copied.
+    """
+    channels = 4 if with_alpha else 3
+    if out is None:
+        out = np.empty((height, width, channels), dtype=dtype)
+    read_pixels_into(0, 0, width, height, GL_RGBA if with_alpha else GL_RGB, out)
+    return out.reshape(height, width, channels)[::-1]
+
+
+def read_raw_depth_buffer(width: int, height: int, out: np.ndarray = None):
+    """
+    Read the depth buffer values [0, 1] into a (height, width) float32 array in image orientation. See
+    read_color_buffer() for the out argument.
+    """
+    if out is None:
+        out = np.empty((height, width), dtype=np.float32)
+    read_pixels_into(0, 0, width, height, GL_DEPTH_COMPONENT, out)
+    return out.reshape(height, width)[::-1]
+
+
+def read_depth_buffer(width: int, height: int, near: float, far: float, out: np.ndarray = None):
+    """
+    Read the depth buffer and convert it to the distance from the camera plane. The conversion happens in place, so
+    with out given there is no allocation at all. See read_color_buffer() for the out argument.
+    """
+    image = read_raw_depth_buffer(width, height, out)
+    return linearize_depth(image, near, far, out=image)
+
+
+def depth_to_image(depth: np.ndarray, scaled_for_viewing: bool = True, return_type=np.uint16,
+                   depth_range: tuple = None, far: float = None) -> np.ndarray:
+    """
+    Convert a depth map (as returned by get_depth_map) into an integer image with near surfaces bright.
+
+    Parameters
+    ----------
+    depth : np.ndarray
+            depth map from get_depth_map(). Not modified.
+    scaled_for_viewing : bool
+            stretch the contrast over the non-background pixels only. Ignored if depth_range is given.
+    return_type : np.dtype
+            either np.uint8 or np.uint16
+    depth_range : tuple
+            optional fixed (min_distance, max_distance) mapped to (max value, 0) instead of the per-frame min/max.
+    far : float
+            camera zFar. If given, background pixels are always 0 with a fixed depth_range.
+    """
+    image = np.array(depth, dtype=np.float32)
+    if depth_range is not None:
+        near_distance, far_distance = depth_range
+        image += far_distance
+        image /= far_distance - near_distance
+        if far is not None:
+            image[depth <= -far] = 0
+    else:
+        lo, hi = image.min(), image.max()
+        if scaled_for_viewing:
+            # background is at the minimum. Stretch everything else over the full range.
+            lo = image.min(where=image > lo, initial=hi)
+        if hi <= lo:
+            image[:] = 0
+        else:
+            image -= lo
+            image /= hi - lo
+    np.clip(image, 0, 1, out=image)
+    image *= np.iinfo(return_type).max
+    return image.astype(return_type)
+
+
+RENDER_OUTPUTS = ('rgb', 'rgba', 'depth', 'mask', 'labels')
+
+
+def render_poses(renderer, poses, outputs=('rgb', 'depth', 'mask'), out: dict = None):
+    """
+    Generator drawing the scene of a QSofaGLView or QSofaOffscreenRenderer once per camera pose. The camera matrix is
+    loaded directly, no SOFA Data is changed and no Qt event is processed between the poses. Scene objects that
+    follow the camera through SOFA Data (i.e. engines linked to the camera) are therefore not moved.
+
+    Parameters
+    ----------
+    renderer : QSofaGLView or QSofaOffscreenRenderer
+    poses : np.ndarray
+            (N, 7) camera poses [x, y, z, qx, qy, qz, qw]
+    outputs : tuple
+            any of 'rgb', 'rgba', 'depth' (linear depth), 'mask' (pixels covered by the scene) and 'labels' (uint16
+            OglModel labels of the renderer's label pass, see label_pass.LabelPass)
+    out : dict
+            optional output name -> (N, height, width, ...) C-contiguous array. Pose i is read directly into
+            out[name][i] in OpenGL row order (see read_color_buffer). Without it, one set of buffers is allocated and
+            reused for every pose.
+
+    Yields
+    ------
+        dict of output name -> np.ndarray for each pose in image orientation. Without out, the arrays are only valid
+        until the next iteration.
+    """
+    unknown = set(outputs) - set(RENDER_OUTPUTS)
+    if unknown:
+        raise ValueError(f'Unknown render outputs {unknown}. Choose from {RENDER_OUTPUTS}.')
+    poses = np.asarray(poses, dtype=np.float64).reshape(-1, 7)
+    width, height = renderer.width(), renderer.height()
+    near, far = renderer.z_near.value, renderer.z_far.value
+    if out is None:
+        shapes = _output_shapes(1, width, height)
+        out = {name: np.empty(*shapes[name]) for name in outputs}
+        reuse = True
+    else:
+        reuse = False
+    raw_depth = None
+    if 'mask' in outputs and 'depth' not in outputs:
+        raw_depth = np.empty((height, width), dtype=np.float32)
+    if 'labels' in outputs and renderer.label_pass is None:
+        renderer.enable_labels()
+    for i, pose in enumerate(poses):
+        index = 0 if reuse else i
+        renderer.makeCurrent()  # the caller may have switched contexts between iterations
+        glViewport(0, 0, width, height)
+        model_view = pose_to_model_view(pose)
+        draw_scene(renderer.visuals_node, renderer.camera, width, height, renderer.background_color,
+                   renderer.suppress_base_light, model_view=model_view, overlay=renderer.markers,
+                   camera_state=renderer.camera_state)
+        result = {}
+        if 'rgb' in outputs:
+            result['rgb'] = read_color_buffer(width, height, out=out['rgb'][index])
+        if 'rgba' in outputs:
+            result['rgba'] = read_color_buffer(width, height, with_alpha=True, out=out['rgba'][index])
+        if 'depth' in outputs or 'mask' in outputs:
+            depth = read_raw_depth_buffer(width, height, out=out['depth'][index] if raw_depth is None else raw_depth)
+            if 'mask' in outputs:
+                result['mask'] = np.less(depth, 1.0, out=out['mask'][index][::-1])
+            if 'depth' in outputs:
+                result['depth'] = linearize_depth(depth, near, far, out=depth)
+        if 'labels' in outputs:
+            result['labels'] = renderer.label_pass.render(renderer.camera, width, height, model_view=model_view,
+                                                          camera_state=renderer.camera_state,
+                                                          out=out['labels'][index])
+        yield result
+
+
+def _output_shapes(n, width, height):
+    return {'rgb': ((n, height, width, 3), np.uint8),
+            'rgba': ((n, height, width, 4), np.uint8),
+            'depth': ((n, height, width), np.float32),
+            'mask': ((n, height, width), bool),
+            'labels': ((n, height, width), np.uint16)}
+
+
+def render_poses_to_arrays(renderer, poses, outputs=('rgb', 'depth', 'mask')):
+    """
+    Same as render_poses(), but every pose is read directly into preallocated (N, height, width, ...) arrays.
+
+    Returns
+    -------
+        dict of output name -> np.ndarray with the results of all poses stacked along the first axis. The arrays are
+        vertically flipped views of the buffers that were read into.
+    """
+    poses = np.asarray(poses, dtype=np.float64).reshape(-1, 7)
+    shapes = _output_shapes(len(poses), renderer.width(), renderer.height())
+    results = {name: np.empty(*shapes[name]) for name in outputs if name in shapes}
+    for _ in render_poses(renderer, poses, outputs, out=results):
+        pass
+    return {name: value[:, ::-1] for name, value in results.items()}
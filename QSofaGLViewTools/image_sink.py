@@ -0,0 +1,152 @@
+"""
+Writing of images and depth maps to disk on a pool of worker threads (or processes), off the render path.
+"""
+import numpy as np
+import threading
+import os
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+
+
+def write_image(filename: str, image: np.ndarray, mode: str = None, compress_level: int = 6):
+    """
+    Write an image or depth map. The format follows the extension of filename:
+        .npy : the raw array with np.save (lossless for any dtype, fastest for float depth maps)
+        .png : PIL with the given zlib compress_level (0 = no compression, 9 = smallest)
+        others (.tif, .jpg, ...) : PIL, with mode if given (i.e. 'F' for a float32 depth TIFF)
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.npy':
+        np.save(filename, image)
+        return
+    from PIL import Image
+    pil_image = Image.fromarray(image, mode=mode) if mode is not None else Image.fromarray(image)
+    if extension == '.png':
+        pil_image.save(filename, compress_level=compress_level)
+    else:
+        pil_image.save(filename)
+
+
+class ImageSink:
+    """
+    Encodes and writes images on a pool of workers. write() only hands the array over and returns a Future, so PNG
+    compression and disk I/O scale over several cores instead of stalling the GUI thread. zlib and numpy release
+    the GIL, so threads are usually enough. Processes avoid the GIL completely at the cost of pickling every image.
+
+    The number of images in flight (submitted but not written yet) is bounded: when the limit is reached, write()
+    either blocks until a worker is done (backpressure) or drops the image. Errors of the workers are raised by the
+    next write(), flush() or close().
+    """
+
+    def __init__(self,
+                 max_workers: int = None,
+                 max_in_flight: int = 16,
+                 png_compress_level: int = 1,
+                 use_processes: bool = False,
+                 drop_when_full: bool = False):
+        """
+
+        Parameters
+        ----------
+        max_workers : int
+                number of worker threads or processes. Default is the number of CPUs (at most 8).
+        max_in_flight : int
+                maximum number of images waiting to be written. Bounds the memory used by queued images.
+        png_compress_level : int
+                zlib level for PNG files. 1 is several times faster than PIL's default (6) for slightly larger files.
+        use_processes : bool
+                use a process pool instead of threads
+        drop_when_full : bool
+                drop images instead of blocking write() when max_in_flight images are waiting
+        """
+        if max_workers is None:
+            max_workers = min(8, os.cpu_count() or 1)
+        self.png_compress_level = png_compress_level
+        self.drop_when_full = drop_when_full
+        self.images_submitted = 0
+        self.images_written = 0
+        self.images_dropped = 0
+        executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self._executor = executor(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._error = None  # type: Exception
+
+    @property
+    def in_flight(self) -> int:
+        """ Number of images submitted but not written yet """
+        with self._lock:
+            return len(self._pending)
+
+    def stats(self) -> dict:
+        """
+        Returns
+        -------
+            dict with the number of images 'submitted', 'written', 'dropped' (because max_in_flight was reached) and
+            currently 'in_flight'.
+        """
+        return {'submitted': self.images_submitted,
+                'written': self.images_written,
+                'dropped': self.images_dropped,
+                'in_flight': self.in_flight}
+
+    def write(self, filename: str, image: np.ndarray, mode: str = None) -> Future:
+        """
+        Queue an image for writing. The array must not be modified afterwards.
+
+        Parameters
+        ----------
+        filename : str
+                path of the file. The extension determines the format, see write_image().
+        image : np.ndarray
+                image or depth map
+        mode : str
+                optional PIL mode, i.e. 'RGBA' or 'F'
+
+        Returns
+        -------
+            Future of the write, or None if the image was dropped.
+        """
+        self._raise_error()
+        if not self._slots.acquire(blocking=not self.drop_when_full):
+            self.images_dropped += 1
+            return None
+        self.images_submitted += 1
+        try:
+            future = self._executor.submit(write_image, filename, image, mode, self.png_compress_level)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future: Future):
+        with self._lock:
+            self._pending.discard(future)
+            if future.exception() is not None:
+                if self._error is None:
+                    self._error = future.exception()
+            else:
+                self.images_written += 1
+        self._slots.release()
+
+    def flush(self):
+        """ Wait until all queued images are written """
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            future.exception()  # waits without raising, errors are raised below
+        self._raise_error()
+
+    def close(self):
+        """ Write the remaining images and stop the workers. Blocks until done. """
+        self._executor.shutdown(wait=True)
+        self._raise_error()
+
+    def _raise_error(self):
+        with self._lock:
+            error, self._error = self._error, None
+        if error is not None:
+            raise RuntimeError('Writing an image failed.') from error
@@ -0,0 +1,295 @@
+"""
+Instance label pass: every OglModel is drawn with a flat color encoding its 16 bit ID into an offscreen framebuffer,
+which is read back as a uint16 label image (0 is the background).
+"""
+import Sofa
+from OpenGL.GL import *
+from QSofaGLViewTools.gl_scene import compile_program, load_camera_matrices, read_pixels_into
+from QSofaGLViewTools.markers import _GLBuffer
+import numpy as np
+import ctypes
+
+
+_VERTEX_SHADER = """
+#version 120
+attribute vec3 vertex;
+void main()
+{
+    gl_Position = gl_ModelViewProjectionMatrix * vec4(vertex, 1.0);
+}
+"""
+
+_FRAGMENT_SHADER = """
+#version 120
+uniform vec3 label_color;
+void main()
+{
+    gl_FragColor = vec4(label_color, 1.0);
+}
+"""
+
+MAX_LABEL = 2 ** 16 - 1
+
+
+def encode_label(label: int) -> tuple:
+    """ RGB color in [0, 1] of a label: the low byte in red, the high byte in green """
+    return (label & 0xFF) / 255, (label >> 8) / 255, 0.0
+
+
+def decode_labels(rgba: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    """ uint16 labels of a (height, width, 3|4) uint8 image rendered by LabelPass """
+    if out is None:
+        out = np.empty(rgba.shape[:2], dtype=np.uint16)
+    np.left_shift(rgba[..., 1], 8, out=out, dtype=np.uint16)
+    out |= rgba[..., 0]
+    return out
+
+
+def find_visual_models(node: Sofa.Core.Node) -> list:
+    """ All OglModels in node and its children, depth first """
+    models = [obj for obj in node.objects if obj.getClassName() == 'OglModel']
+    for child in node.children:
+        models += find_visual_models(child)
+    return models
+
+
+class _Model:
+    """ GL buffers of one OglModel, re-uploaded only when the change counters of its Data change """
+
+    def __init__(self, model, label: int):
+        self.model = model
+        self.label = label
+        self.color = encode_label(label)
+        self.vertices = None  # type: _GLBuffer
+        self.indices = None  # type: _GLBuffer
+        self.index_count = 0
+        self._data = {name: model.findData(name) for name in ('vertices', 'position', 'triangles', 'quads')}
+        self._enabled = model.findData('enable')
+        self._counters = {}
+
+    def _changed(self, *names) -> bool:
+        counters = tuple(self._data[name].getCounter() for name in names)
+        changed = self._counters.get(names) != counters
+        self._counters[names] = counters
+        return changed
+
+    def upload(self):
+        if self.vertices is None:
+            self.vertices, self.indices = _GLBuffer(), _GLBuffer(GL_ELEMENT_ARRAY_BUFFER)
+        # vertices holds the positions duplicated for texture seams and is empty for models without a texture
+        vertices = self._data['vertices'].array()
+        name = 'vertices' if len(vertices) else 'position'
+        if self._changed(name):
+            self.vertices.upload(np.ascontiguousarray(self._data[name].array(), dtype=np.float32))
+        if self._changed('triangles', 'quads'):
+            triangles = np.asarray(self._data['triangles'].array(), dtype=np.uint32).reshape(-1, 3)
+            quads = np.asarray(self._data['quads'].array(), dtype=np.uint32).reshape(-1, 4)
+            indices = np.concatenate([triangles.ravel(), quads[:, [0, 1, 2, 0, 2, 3]].ravel()])
+            self.indices.upload(indices)
+            self.index_count = len(indices)
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled is None or bool(self._enabled.value)
+
+    def release(self):
+        if self.vertices is not None:
+            self.vertices.release()
+            self.indices.release()
+            self.vertices = self.indices = None
+
+
+class LabelPass:
+    """
+    Draws every OglModel below a node with a unique flat color (no lighting, textures or blending) into its own
+    framebuffer and reads it back as a uint16 label image, so masks of all objects come from a single extra pass
+    instead of one render per object. Labels are encoded in the red (low byte) and green (high byte) channel of an
+    RGBA8 renderbuffer, which is exact because nothing is interpolated or multisampled.
+
+    The pass draws from the vertex, triangle and quad Data of the models with the camera matrices of the frame. Vertex
+    buffers are only re-uploaded when the Data change. Markers are not part of the label image.
+
+    GL resources are created on the first render() and must be freed with release() while the same context is
+    current.
+    """
+
+    def __init__(self, visuals_node: Sofa.Core.Node, id_map: dict = None, label_unmapped: bool = True):
+        """
+
+        Parameters
+        ----------
+        visuals_node : Sofa.Core.Node
+                node whose OglModels are labeled
+        id_map : dict
+                optional label for nodes or OglModels (the objects or their path names, i.e. '/liver/visual'). A
+                label given for a node applies to all OglModels below it unless a deeper entry overrides it.
+        label_unmapped : bool
+                give OglModels without an entry in id_map the next free labels (in scene graph order). If False,
+                they are not drawn and stay background (0).
+        """
+        self.visuals_node = visuals_node
+        self.id_map = {}
+        for key, label in (id_map or {}).items():
+            if not 0 <= int(label) <= MAX_LABEL:
+                raise ValueError(f'Label {label} does not fit into 16 bits.')
+            self.id_map[key if isinstance(key, str) else key.getPathName()] = int(label)
+        self.label_unmapped = label_unmapped
+        self._program = None
+        self._locations = {}
+        self._framebuffer = None
+        self._renderbuffers = []
+        self._size = (0, 0)
+        self._rgba = np.empty((0, 0, 4), dtype=np.uint8)
+        self._models = []  # type: list[_Model]
+        self._stale = []  # type: list[_Model]  # models to release once the context is current
+        self._models_found = False
+
+    @property
+    def labels(self) -> dict:
+        """ Path name of every labeled OglModel -> its label """
+        self._find_models()
+        return {m.model.getPathName(): m.label for m in self._models}
+
+    def refresh(self):
+        """ Search the OglModels again, i.e. after objects were added to or removed from the scene """
+        self._models_found = False
+
+    def _label_of(self, path: str):
+        while path:
+            if path in self.id_map:
+                return self.id_map[path]
+            path = path[:path.rfind('/')]
+        return self.id_map.get('/')
+
+    def _find_models(self):
+        if self._models_found:
+            return
+        old = {m.model.getPathName(): m for m in self._models}
+        mapped = {}
+        unmapped = []
+        for model in find_visual_models(self.visuals_node):
+            path = model.getPathName()
+            label = self._label_of(path)
+            if label is not None:
+                mapped[path] = (model, label)
+            elif self.label_unmapped:
+                unmapped.append((path, model))
+        used = set(label for _, label in mapped.values())
+        free = (label for label in range(1, MAX_LABEL + 1) if label not in used)
+        for path, model in unmapped:
+            mapped[path] = (model, next(free))
+        models = []
+        for path, (model, label) in mapped.items():
+            entry = old.pop(path, None)
+            if entry is None or entry.label != label:
+                if entry is not None:
+                    self._stale.append(entry)
+                entry = _Model(model, label)
+            models.append(entry)
+        self._stale += old.values()
+        self._models = models
+        self._models_found = True
+
+    def _allocate(self, width, height):
+        if self._program is None:
+            self._program = compile_program(_VERTEX_SHADER, _FRAGMENT_SHADER)
+            self._locations = {'vertex': glGetAttribLocation(self._program, 'vertex'),
+                               'label_color': glGetUniformLocation(self._program, 'label_color')}
+            self._framebuffer = int(glGenFramebuffers(1))
+            self._renderbuffers = [int(r) for r in glGenRenderbuffers(2)]
+        if self._size == (width, height):
+            return
+        glBindFramebuffer(GL_FRAMEBUFFER, self._framebuffer)
+        for renderbuffer, internal_format, attachment in zip(self._renderbuffers,
+                                                             (GL_RGBA8, GL_DEPTH_COMPONENT24),
+                                                             (GL_COLOR_ATTACHMENT0, GL_DEPTH_ATTACHMENT)):
+            glBindRenderbuffer(GL_RENDERBUFFER, renderbuffer)
+            glRenderbufferStorage(GL_RENDERBUFFER, internal_format, width, height)
+            glFramebufferRenderbuffer(GL_FRAMEBUFFER, attachment, GL_RENDERBUFFER, renderbuffer)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError('Could not create the label framebuffer.')
+        self._size = (width, height)
+        self._rgba = np.empty((height, width, 4), dtype=np.uint8)
+
+    def render(self, camera, width: int, height: int, model_view: np.ndarray = None, camera_state=None,
+               out: np.ndarray = None) -> np.ndarray:
+        """
+        Draw the labels as seen by the camera and read them back. The framebuffer that was bound before is bound
+        again afterwards.
+
+        Parameters
+        ----------
+        camera : Sofa.Components.BaseCamera
+                camera of the frame. See gl_scene.load_camera_matrices() for model_view and camera_state.
+        width : int
+                width of the image
+        height : int
+                height of the image
+        out : np.ndarray
+                optional C-contiguous (height, width) uint16 array. It receives the rows bottom-up (as OpenGL stores
+                them) and the returned label image is a flipped view of it.
+
+        Returns
+        -------
+            (height, width) uint16 label image in image orientation (first row is the top)
+        """
+        previous = glGetIntegerv(GL_FRAMEBUFFER_BINDING)
+        self._allocate(width, height)
+        self._find_models()
+        for model in self._stale:
+            model.release()
+        self._stale = []
+        glBindFramebuffer(GL_FRAMEBUFFER, self._framebuffer)
+        glPushAttrib(GL_ENABLE_BIT | GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT | GL_VIEWPORT_BIT)
+        glViewport(0, 0, width, height)
+        glDisable(GL_BLEND)
+        glDisable(GL_MULTISAMPLE)
+        glDisable(GL_CULL_FACE)
+        glEnable(GL_DEPTH_TEST)
+        glDepthFunc(GL_LESS)
+        glDepthMask(GL_TRUE)
+        glClearColor(0, 0, 0, 0)
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        load_camera_matrices(camera, width, height, model_view, camera_state)
+        glUseProgram(self._program)
+        location = self._locations['vertex']
+        glEnableVertexAttribArray(location)
+        for model in self._models:
+            if not model.enabled:
+                continue
+            model.upload()
+            if not model.index_count:
+                continue
+            glUniform3f(self._locations['label_color'], *model.color)
+            glBindBuffer(GL_ARRAY_BUFFER, model.vertices.handle)
+            glVertexAttribPointer(location, 3, GL_FLOAT, GL_FALSE, 0, ctypes.c_void_p(0))
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, model.indices.handle)
+            glDrawElements(GL_TRIANGLES, model.index_count, GL_UNSIGNED_INT, ctypes.c_void_p(0))
+        glDisableVertexAttribArray(location)
+        glUseProgram(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        read_pixels_into(0, 0, width, height, GL_RGBA, self._rgba)
+        glPopAttrib()
+        glBindFramebuffer(GL_FRAMEBUFFER, int(previous))
+        if out is None:
+            out = np.empty((height, width), dtype=np.uint16)
+        return decode_labels(self._rgba, out=out.reshape(height, width))[::-1]
+
+    def release(self):
+        """ Free the GL resources. The context they were created in must be current. """
+        if self._program is None:
+            return
+        for model in self._models + self._stale:
+            model.release()
+        glDeleteProgram(self._program)
+        glDeleteFramebuffers(1, [self._framebuffer])
+        glDeleteRenderbuffers(len(self._renderbuffers), self._renderbuffers)
+        self._program = None
+        self._framebuffer = None
+        self._renderbuffers = []
+        self._size = (0, 0)
+        self._models = []
+        self._stale = []
+        self._models_found = False
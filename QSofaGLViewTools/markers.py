@@ -0,0 +1,495 @@
+"""
+Marker overlay drawn on top of the SOFA scene. Spheres, points and line segments are kept in numpy arrays and drawn
+with a few GL calls after SGL.draw, so adding or moving markers never touches the scene graph.
+"""
+import Sofa
+from OpenGL.GL import *
+from QSofaGLViewTools.gl_scene import compile_program
+import numpy as np
+import ctypes
+
+
+_SPHERE_VERTEX_SHADER = """
+#version 120
+attribute vec3 vertex;
+attribute vec4 center_radius;
+attribute vec4 color;
+varying vec4 frag_color;
+varying vec3 normal;
+void main()
+{
+    gl_Position = gl_ModelViewProjectionMatrix * vec4(center_radius.xyz + vertex * center_radius.w, 1.0);
+    normal = gl_NormalMatrix * vertex;
+    frag_color = color;
+}
+"""
+
+_SPHERE_FRAGMENT_SHADER = """
+#version 120
+varying vec4 frag_color;
+varying vec3 normal;
+void main()
+{
+    // head light, so markers are visible no matter which lights the scene has
+    float shade = 0.3 + 0.7 * abs(normalize(normal).z);
+    gl_FragColor = vec4(frag_color.rgb * shade, frag_color.a);
+}
+"""
+
+_FLAT_VERTEX_SHADER = """
+#version 120
+attribute vec4 vertex_size;
+attribute vec4 color;
+varying vec4 frag_color;
+void main()
+{
+    gl_Position = gl_ModelViewProjectionMatrix * vec4(vertex_size.xyz, 1.0);
+    gl_PointSize = vertex_size.w;
+    frag_color = color;
+}
+"""
+
+_FLAT_FRAGMENT_SHADER = """
+#version 120
+varying vec4 frag_color;
+void main()
+{
+    gl_FragColor = frag_color;
+}
+"""
+
+_FLOAT_SIZE = 4
+_STRIDE = 8 * _FLOAT_SIZE  # every marker array has rows of [x, y, z, radius|size, r, g, b, a]
+
+
+def sphere_mesh(stacks: int = 12, slices: int = 16):
+    """
+    Unit UV sphere.
+
+    Returns
+    -------
+        tuple(np.ndarray, np.ndarray): (N, 3) float32 vertices (which are also the normals) and (M,) uint32 triangle
+        indices.
+    """
+    theta = np.linspace(0, np.pi, stacks + 1)[:, None]
+    phi = np.linspace(0, 2 * np.pi, slices + 1)[None, :]
+    vertices = np.stack([np.sin(theta) * np.cos(phi),
+                         np.sin(theta) * np.sin(phi),
+                         np.cos(theta) * np.ones_like(phi)], axis=-1).reshape(-1, 3).astype(np.float32)
+    ring = slices + 1
+    i, j = np.meshgrid(np.arange(stacks), np.arange(slices), indexing='ij')
+    a = (i * ring + j).ravel()
+    b, c, d = a + ring, a + 1, a + ring + 1
+    indices = np.stack([a, b, c, c, b, d], axis=-1).ravel().astype(np.uint32)
+    return vertices, indices
+
+
+def _rows(count, positions, sizes, colors, default_alpha=1.0):
+    """ Build an (N, 8) float32 marker array from positions, scalar or per-marker sizes and RGB(A) colors """
+    rows = np.empty((count, 8), dtype=np.float32)
+    rows[:, :3] = np.asarray(positions, dtype=np.float32).reshape(count, 3)
+    rows[:, 3] = sizes
+    _set_colors(rows, colors, default_alpha)
+    return rows
+
+
+def _set_colors(rows, colors, default_alpha=1.0):
+    colors = np.asarray(colors, dtype=np.float32)
+    if colors.ndim == 1:
+        colors = colors[None, :]
+    rows[:, 4:4 + colors.shape[-1]] = colors
+    if colors.shape[-1] == 3:
+        rows[:, 7] = default_alpha
+
+
+class _GLBuffer:
+    """ Vertex buffer that is only re-allocated when its content outgrows it. Everything else is a glBufferSubData. """
+
+    def __init__(self, target=GL_ARRAY_BUFFER):
+        self.target = target
+        self.handle = int(glGenBuffers(1))
+        self.capacity = 0
+
+    def upload(self, data: np.ndarray):
+        glBindBuffer(self.target, self.handle)
+        if data.nbytes > self.capacity:
+            self.capacity = max(data.nbytes, 2 * self.capacity)
+            glBufferData(self.target, self.capacity, None, GL_DYNAMIC_DRAW)
+        if data.nbytes:
+            glBufferSubData(self.target, 0, data.nbytes, data)
+
+    def release(self):
+        glDeleteBuffers(1, [self.handle])
+        self.capacity = 0
+
+
+class MarkerOverlay:
+    """
+    Spheres, points and lines drawn after the scene with depth testing, so they are hidden by the scene where
+    appropriate. All spheres are one instanced draw call of a shared sphere mesh, all points and all lines one draw
+    call each. Setting or updating markers only changes numpy arrays; the GL buffers are updated on the next draw().
+
+    GL resources are created on the first draw() and must be freed with release() while the same context is current.
+    """
+
+    def __init__(self, sphere_stacks: int = 12, sphere_slices: int = 16):
+        """
+
+        Parameters
+        ----------
+        sphere_stacks : int
+                latitude subdivisions of the sphere mesh
+        sphere_slices : int
+                longitude subdivisions of the sphere mesh
+        """
+        self.point_smooth = True
+        self.line_width = 1.0
+        self._sphere_mesh = sphere_mesh(sphere_stacks, sphere_slices)
+        self._spheres = np.empty((0, 8), dtype=np.float32)
+        self._points = np.empty((0, 8), dtype=np.float32)
+        self._lines = np.empty((0, 8), dtype=np.float32)
+        self._dirty = {'spheres': True, 'points': True, 'lines': True}
+        self._gl = None  # dict of programs, locations and buffers once created
+
+    @property
+    def sphere_count(self) -> int:
+        return len(self._spheres)
+
+    @property
+    def point_count(self) -> int:
+        return len(self._points)
+
+    @property
+    def line_count(self) -> int:
+        return len(self._lines) // 2
+
+    @property
+    def is_empty(self) -> bool:
+        return not (len(self._spheres) or len(self._points) or len(self._lines))
+
+    def stats(self) -> dict:
+        """
+        Returns
+        -------
+            dict with the number of 'spheres', 'points' and 'lines' and the 'buffer_bytes' allocated on the GPU for
+            them. Buffers are kept when markers are cleared, so buffer_bytes only grows to the largest marker set.
+        """
+        buffer_bytes = 0
+        if self._gl is not None:
+            buffer_bytes = sum(self._gl[name].capacity for name in ('spheres', 'points', 'lines'))
+        return {'spheres': self.sphere_count,
+                'points': self.point_count,
+                'lines': self.line_count,
+                'buffer_bytes': buffer_bytes}
+
+    def set_spheres(self, positions, radii, colors, append: bool = False):
+        """
+        Replace (or extend) the spheres.
+
+        Parameters
+        ----------
+        positions : array_like
+                (N, 3) sphere centers in world coordinates
+        radii : array_like
+                a single radius or (N,) radii
+        colors : array_like
+                a single color or (N, 3|4) colors [r, g, b(, a)] in [0, 1]
+        append : bool
+                keep the existing spheres and add these after them
+        """
+        positions = np.asarray(positions, dtype=np.float32).reshape(-1, 3)
+        rows = _rows(len(positions), positions, radii, colors)
+        self._spheres = np.concatenate([self._spheres, rows]) if append else rows
+        self._dirty['spheres'] = True
+
+    def update_spheres(self, positions=None, radii=None, colors=None, indices=None):
+        """
+        Change existing spheres in place. Arguments that are None are left as they are.
+
+        Parameters
+        ----------
+        positions : array_like
+                new (N, 3) centers
+        radii : array_like
+                new radius or (N,) radii
+        colors : array_like
+                new color or (N, 3|4) colors
+        indices : array_like
+                which spheres to change (any numpy index). Default is all of them.
+        """
+        selection = slice(None) if indices is None else indices
+        view = self._spheres[selection]
+        if positions is not None:
+            view[..., :3] = np.asarray(positions, dtype=np.float32).reshape(-1, 3)
+        if radii is not None:
+            view[..., 3] = radii
+        if colors is not None:
+            _set_colors(view.reshape(-1, 8), colors)
+        if indices is not None:  # fancy indexing returned a copy
+            self._spheres[selection] = view
+        self._dirty['spheres'] = True
+
+    def set_points(self, positions, colors, size=5.0, append: bool = False):
+        """
+        Replace (or extend) the points.
+
+        Parameters
+        ----------
+        positions : array_like
+                (N, 3) point positions in world coordinates
+        colors : array_like
+                a single color or (N, 3|4) colors
+        size : float or array_like
+                point size(s) in pixels
+        append : bool
+                keep the existing points and add these after them
+        """
+        positions = np.asarray(positions, dtype=np.float32).reshape(-1, 3)
+        rows = _rows(len(positions), positions, size, colors)
+        self._points = np.concatenate([self._points, rows]) if append else rows
+        self._dirty['points'] = True
+
+    def update_points(self, positions=None, colors=None, size=None, indices=None):
+        """ Change existing points in place. See update_spheres(). """
+        selection = slice(None) if indices is None else indices
+        view = self._points[selection]
+        if positions is not None:
+            view[..., :3] = np.asarray(positions, dtype=np.float32).reshape(-1, 3)
+        if size is not None:
+            view[..., 3] = size
+        if colors is not None:
+            _set_colors(view.reshape(-1, 8), colors)
+        if indices is not None:
+            self._points[selection] = view
+        self._dirty['points'] = True
+
+    def set_lines(self, segments, colors, append: bool = False):
+        """
+        Replace (or extend) the line segments. The width of all lines is line_width.
+
+        Parameters
+        ----------
+        segments : array_like
+                (N, 2, 3) start and end points of the segments in world coordinates
+        colors : array_like
+                a single color, (N, 3|4) colors per segment or (N, 2, 3|4) colors per end point
+        append : bool
+                keep the existing lines and add these after them
+        """
+        segments = np.asarray(segments, dtype=np.float32).reshape(-1, 2, 3)
+        colors = np.asarray(colors, dtype=np.float32)
+        if colors.ndim == 2:  # one color per segment
+            colors = np.repeat(colors, 2, axis=0)
+        rows = _rows(2 * len(segments), segments, 0, colors.reshape(-1, colors.shape[-1]))
+        self._lines = np.concatenate([self._lines, rows]) if append else rows
+        self._dirty['lines'] = True
+
+    def clear(self, kind: str = None):
+        """
+        Remove markers. The GL buffers are kept for reuse.
+
+        :param kind: 'spheres', 'points' or 'lines'. Default removes all of them.
+        """
+        for name in ((kind,) if kind is not None else ('spheres', 'points', 'lines')):
+            setattr(self, '_' + name, np.empty((0, 8), dtype=np.float32))
+            self._dirty[name] = True
+
+    def _create_gl_resources(self):
+        sphere_program = compile_program(_SPHERE_VERTEX_SHADER, _SPHERE_FRAGMENT_SHADER)
+        flat_program = compile_program(_FLAT_VERTEX_SHADER, _FLAT_FRAGMENT_SHADER)
+        self._gl = {'sphere_program': sphere_program,
+                    'flat_program': flat_program,
+                    'sphere_attributes': {name: glGetAttribLocation(sphere_program, name)
+                                          for name in ('vertex', 'center_radius', 'color')},
+                    'flat_attributes': {name: glGetAttribLocation(flat_program, name)
+                                        for name in ('vertex_size', 'color')},
+                    'mesh_vertices': _GLBuffer(),
+                    'mesh_indices': _GLBuffer(GL_ELEMENT_ARRAY_BUFFER),
+                    'spheres': _GLBuffer(),
+                    'points': _GLBuffer(),
+                    'lines': _GLBuffer()}
+        vertices, indices = self._sphere_mesh
+        self._gl['mesh_vertices'].upload(vertices)
+        self._gl['mesh_indices'].upload(indices)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        self._dirty = dict.fromkeys(self._dirty, True)
+
+    def _upload(self):
+        for name in ('spheres', 'points', 'lines'):
+            if self._dirty[name]:
+                self._gl[name].upload(getattr(self, '_' + name))
+                self._dirty[name] = False
+
+    def draw(self):
+        """ Draw all markers with the current matrices. Call after the scene was drawn. """
+        if self.is_empty:
+            return
+        if self._gl is None:
+            self._create_gl_resources()
+        self._upload()
+        glPushAttrib(GL_ENABLE_BIT | GL_LINE_BIT | GL_POINT_BIT | GL_COLOR_BUFFER_BIT)
+        glEnable(GL_DEPTH_TEST)
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+        if len(self._spheres):
+            self._draw_spheres()
+        if len(self._points) or len(self._lines):
+            self._draw_flat()
+        glUseProgram(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        glPopAttrib()
+
+    def _draw_spheres(self):
+        locations = self._gl['sphere_attributes']
+        glUseProgram(self._gl['sphere_program'])
+        glBindBuffer(GL_ARRAY_BUFFER, self._gl['mesh_vertices'].handle)
+        glEnableVertexAttribArray(locations['vertex'])
+        glVertexAttribPointer(locations['vertex'], 3, GL_FLOAT, GL_FALSE, 0, ctypes.c_void_p(0))
+        glBindBuffer(GL_ARRAY_BUFFER, self._gl['spheres'].handle)
+        for name, offset in (('center_radius', 0), ('color', 4 * _FLOAT_SIZE)):
+            glEnableVertexAttribArray(locations[name])
+            glVertexAttribPointer(locations[name], 4, GL_FLOAT, GL_FALSE, _STRIDE, ctypes.c_void_p(offset))
+            glVertexAttribDivisor(locations[name], 1)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self._gl['mesh_indices'].handle)
+        glDrawElementsInstanced(GL_TRIANGLES, len(self._sphere_mesh[1]), GL_UNSIGNED_INT, ctypes.c_void_p(0),
+                                len(self._spheres))
+        for name in ('center_radius', 'color'):
+            glVertexAttribDivisor(locations[name], 0)  # the SOFA draw code does not expect instanced attributes
+        for location in locations.values():
+            glDisableVertexAttribArray(location)
+
+    def _draw_flat(self):
+        locations = self._gl['flat_attributes']
+        glUseProgram(self._gl['flat_program'])
+        glEnable(GL_VERTEX_PROGRAM_POINT_SIZE)
+        if self.point_smooth:
+            glEnable(GL_POINT_SMOOTH)
+        glLineWidth(self.line_width)
+        for name, mode in (('points', GL_POINTS), ('lines', GL_LINES)):
+            count = len(getattr(self, '_' + name))
+            if not count:
+                continue
+            glBindBuffer(GL_ARRAY_BUFFER, self._gl[name].handle)
+            for attribute, offset in (('vertex_size', 0), ('color', 4 * _FLOAT_SIZE)):
+                glEnableVertexAttribArray(locations[attribute])
+                glVertexAttribPointer(locations[attribute], 4, GL_FLOAT, GL_FALSE, _STRIDE, ctypes.c_void_p(offset))
+            glDrawArrays(mode, 0, count)
+        for location in locations.values():
+            glDisableVertexAttribArray(location)
+
+    def release(self):
+        """ Free the GL resources. The context they were created in must be current. """
+        if self._gl is None:
+            return
+        glDeleteProgram(self._gl['sphere_program'])
+        glDeleteProgram(self._gl['flat_program'])
+        for name in ('mesh_vertices', 'mesh_indices', 'spheres', 'points', 'lines'):
+            self._gl[name].release()
+        self._gl = None
+
+
+def _material(color) -> str:
+    """ OglModel material string for a color, the same that the "color" attribute of an OglModel creates """
+    r, g, b, a = (list(color) + [1.0])[:4]
+    return (f'Default Diffuse 1 {r} {g} {b} {a} Ambient 1 {0.2 * r} {0.2 * g} {0.2 * b} {a} '
+            f'Specular 0 {r} {g} {b} {a} Emissive 0 {r} {g} {b} {a} Shininess 0 45')
+
+
+class SphereNodePool:
+    """
+    Sphere nodes (MeshObjLoader + OglModel) in the scene graph that are recycled instead of re-created. Released
+    spheres are detached from the graph but keep their loaded mesh and GL buffers, so acquiring them again only
+    rewrites the vertex positions and the material. Only new nodes need initVisual/initTextures.
+
+    Nodes beyond max_pooled are dropped when released, which frees them (and their GL buffers, so the GL context of
+    the view should be current).
+    """
+
+    def __init__(self, parent_node: Sofa.Core.Node, mesh_file: str = 'mesh/sphere.obj', max_pooled: int = None):
+        """
+
+        Parameters
+        ----------
+        parent_node : Sofa.Core.Node
+                node the sphere nodes are added to
+        mesh_file : str
+                sphere mesh to load
+        max_pooled : int
+                maximum number of detached nodes to keep for reuse. None keeps all of them.
+        """
+        self.parent_node = parent_node
+        self.mesh_file = mesh_file
+        self.max_pooled = max_pooled
+        self.live = []  # type: list
+        self.pooled = []  # type: list
+        self._created = 0
+        self._unit_vertices = None  # type: np.ndarray
+
+    def stats(self) -> dict:
+        """ Number of sphere nodes in the scene ('live'), kept for reuse ('pooled') and 'created' in total """
+        return {'live': len(self.live), 'pooled': len(self.pooled), 'created': self._created}
+
+    def acquire(self, positions, radii, colors):
+        """
+        Add spheres to the scene, reusing pooled nodes first.
+
+        Parameters
+        ----------
+        positions : array_like
+                (N, 3) sphere centers
+        radii : array_like
+                a single radius or (N,) radii
+        colors : array_like
+                a single color or (N, 3|4) colors
+
+        Returns
+        -------
+            list of the nodes that were newly created and still need Sofa.Simulation.initVisual/initTextures
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        radii = np.broadcast_to(radii, (len(positions),))
+        colors = np.asarray(colors, dtype=np.float64)
+        colors = np.broadcast_to(colors, (len(positions), colors.shape[-1]))
+        new_nodes = []
+        for position, radius, color in zip(positions, radii, colors):
+            if self.pooled:
+                node = self.pooled.pop()
+                self.parent_node.addChild(node)
+                self._place(node, position, float(radius), color)
+            else:
+                node = self._create(position, float(radius), color)
+                new_nodes.append(node)
+            self.live.append(node)
+        return new_nodes
+
+    def release_all(self):
+        """ Detach all live spheres from the scene and keep them (up to max_pooled) for reuse """
+        for node in self.live:
+            node.detachFromGraph()
+            if self.max_pooled is None or len(self.pooled) < self.max_pooled:
+                self.pooled.append(node)
+        self.live = []
+
+    def clear_pool(self):
+        """ Drop all pooled nodes so SOFA frees them """
+        self.pooled = []
+
+    def _create(self, position, radius, color):
+        index = self._created
+        self._created += 1
+        node = self.parent_node.addChild('sphere' + str(index))
+        node.addObject("MeshObjLoader", name="loader", filename=self.mesh_file, scale=radius,
+                       translation=position.tolist())
+        node.addObject("OglModel", name="visual", src="@loader", color=color.tolist())
+        return node
+
+    def _place(self, node, position, radius, color):
+        if self._unit_vertices is None:
+            loader = node.getObject('loader')
+            self._unit_vertices = ((loader.position.array() - loader.translation.array()) /
+                                   np.asarray(loader.scale3d.value))
+        visual = node.getObject('visual')
+        visual.position.value = self._unit_vertices * radius + position
+        visual.material.value = _material(color)
+        Sofa.Simulation.updateVisual(node)
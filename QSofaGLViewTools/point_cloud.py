@@ -0,0 +1,182 @@
+"""
+Back-projection of depth maps into point clouds and a streaming writer for point cloud sequences.
+
+Camera coordinates are OpenGL eye coordinates: x to the right, y up and the camera looking along -z.
+"""
+import numpy as np
+import os
+
+
+class RayGridCache:
+    """
+    Per pixel ray directions (x / -z and y / -z in camera coordinates) for the pixel centers of an image, cached per
+    resolution, stride and intrinsics, so back-projecting a depth map is a few multiplications.
+    """
+
+    def __init__(self, max_entries: int = 8):
+        self.max_entries = max_entries
+        self._grids = {}
+
+    def get(self, width: int, height: int, intrinsics, stride: int = 1) -> np.ndarray:
+        """
+        Returns
+        -------
+            (ceil(height / stride), ceil(width / stride), 2) float32 array in image orientation (first row is the top)
+        """
+        key = (width, height, stride, tuple(float(v) for v in intrinsics))
+        grid = self._grids.get(key)
+        if grid is None:
+            fx, fy, cx, cy = intrinsics
+            u = (np.arange(0, width, stride, dtype=np.float64) + 0.5 - cx) / fx
+            v = (cy - (np.arange(0, height, stride, dtype=np.float64) + 0.5)) / fy  # image rows go down, y goes up
+            grid = np.empty((len(v), len(u), 2), dtype=np.float32)
+            grid[..., 0] = u[None, :]
+            grid[..., 1] = v[:, None]
+            if len(self._grids) >= self.max_entries:
+                self._grids.pop(next(iter(self._grids)))
+            self._grids[key] = grid
+        return grid
+
+
+def depth_to_point_cloud(depth: np.ndarray, rays: np.ndarray, far: float = None, stride: int = 1,
+                         model_view: np.ndarray = None, colors: np.ndarray = None) -> np.ndarray:
+    """
+    Back-project a depth map.
+
+    Parameters
+    ----------
+    depth : np.ndarray
+            (height, width) depth map as returned by get_depth_map() (camera z, negative in front of the camera)
+    rays : np.ndarray
+            ray grid of RayGridCache.get() for the same size, intrinsics and stride
+    far : float
+            camera zFar. Pixels at the far plane (background) are left out.
+    stride : int
+            use every stride-th pixel in both directions
+    model_view : np.ndarray
+            row-major 4x4 model-view matrix. If given, the points are transformed to world coordinates.
+    colors : np.ndarray
+            optional (height, width, 3|4) uint8 image of the same frame. Adds r, g, b in [0, 1] to every point.
+
+    Returns
+    -------
+        (N, 3) or (N, 6) float32 array of [x, y, z(, r, g, b)]
+    """
+    depth = depth[::stride, ::stride]
+    valid = depth > -far * (1 - 1e-6) if far is not None else np.isfinite(depth)
+    z = depth[valid]
+    distance = -z
+    ray = rays[valid]
+    points = np.empty((len(z), 6 if colors is not None else 3), dtype=np.float32)
+    points[:, 0] = ray[:, 0] * distance
+    points[:, 1] = ray[:, 1] * distance
+    points[:, 2] = z
+    if model_view is not None:
+        camera_to_world = np.linalg.inv(model_view)
+        xyz = points[:, :3] @ camera_to_world[:3, :3].T.astype(np.float32)
+        xyz += camera_to_world[:3, 3].astype(np.float32)
+        points[:, :3] = xyz
+    if colors is not None:
+        points[:, 3:6] = colors[::stride, ::stride][valid][:, :3]
+        points[:, 3:6] /= 255
+    return points
+
+
+def get_point_cloud(renderer, frame: str = 'camera', stride: int = 1, with_color: bool = True) -> np.ndarray:
+    """
+    Point cloud of the current frame of a QSofaGLView or QSofaOffscreenRenderer. See QSofaGLView.get_point_cloud().
+    """
+    if frame not in ('camera', 'world'):
+        raise ValueError(f'frame must be "camera" or "world", not "{frame}".')
+    width, height = renderer.width(), renderer.height()
+    state = renderer.camera_state
+    state.update(width, height)
+    rays = renderer.ray_grids.get(width, height, state.intrinsics, stride)
+    depth = renderer.get_depth_map()
+    colors = renderer.get_screen_shot() if with_color else None
+    return depth_to_point_cloud(depth, rays, far=state.far, stride=stride,
+                                model_view=state.model_view if frame == 'world' else None, colors=colors)
+
+
+class PointCloudWriter:
+    """
+    Writes a sequence of point clouds as one file per frame (binary PLY or compressed NPZ) plus an index.csv with the
+    frame number, timestamp, file name and number of points. Each frame is written as soon as it is added, so memory
+    does not grow with the length of the sequence.
+    """
+
+    def __init__(self, directory: str, file_format: str = 'ply', prefix: str = 'cloud'):
+        """
+
+        Parameters
+        ----------
+        directory : str
+                folder for the files. Created if needed.
+        file_format : str
+                'ply' (binary little endian, colors as uchar) or 'npz' (float32 'points' array and 'timestamp')
+        prefix : str
+                file names are {prefix}_{frame:06d}.{file_format}
+        """
+        if file_format not in ('ply', 'npz'):
+            raise ValueError(f'Unknown point cloud format "{file_format}". Use "ply" or "npz".')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.file_format = file_format
+        self.prefix = prefix
+        self.frames_written = 0
+        self._index = open(os.path.join(directory, 'index.csv'), 'w')
+        self._index.write('frame,timestamp,file,points\n')
+
+    def write(self, points: np.ndarray, timestamp: float = None) -> str:
+        """
+        Parameters
+        ----------
+        points : np.ndarray
+                (N, 3) or (N, 6) array from get_point_cloud()
+        timestamp : float
+                optional time of the frame
+
+        Returns
+        -------
+            path of the written file
+        """
+        if self._index is None:
+            raise RuntimeError('The writer was closed.')
+        name = f'{self.prefix}_{self.frames_written:06d}.{self.file_format}'
+        path = os.path.join(self.directory, name)
+        if self.file_format == 'ply':
+            write_ply(path, points)
+        else:
+            np.savez_compressed(path, points=np.asarray(points, dtype=np.float32),
+                                timestamp=np.nan if timestamp is None else timestamp)
+        self._index.write(f'{self.frames_written},{"" if timestamp is None else timestamp},{name},{len(points)}\n')
+        self._index.flush()
+        self.frames_written += 1
+        return path
+
+    def close(self):
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+
+
+def write_ply(filename: str, points: np.ndarray):
+    """ Write an (N, 3) or (N, 6) point cloud (colors in [0, 1]) as binary little endian PLY """
+    points = np.asarray(points, dtype=np.float32)
+    with_color = points.shape[1] >= 6
+    fields = [('x', '<f4'), ('y', '<f4'), ('z', '<f4')]
+    if with_color:
+        fields += [('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
+    vertices = np.empty(len(points), dtype=fields)
+    vertices['x'], vertices['y'], vertices['z'] = points[:, 0], points[:, 1], points[:, 2]
+    if with_color:
+        rgb = np.clip(np.rint(points[:, 3:6] * 255), 0, 255).astype(np.uint8)
+        vertices['red'], vertices['green'], vertices['blue'] = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+    header = ['ply', 'format binary_little_endian 1.0', f'element vertex {len(points)}']
+    header += [f'property float {name}' for name in 'xyz']
+    if with_color:
+        header += [f'property uchar {name}' for name in ('red', 'green', 'blue')]
+    header.append('end_header')
+    with open(filename, 'wb') as f:
+        f.write(('\n'.join(header) + '\n').encode('ascii'))
+        vertices.tofile(f)
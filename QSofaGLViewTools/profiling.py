@@ -0,0 +1,182 @@
+from OpenGL.GL import *
+from contextlib import contextmanager, nullcontext
+from collections import deque
+import numpy as np
+import json
+import time
+
+
+_NO_SECTION = nullcontext()
+
+
+def profile_section(profiler, name: str):
+    """
+    profiler.section(name), or a shared do-nothing context manager if profiler is None. Lets instrumented code cost a
+    single with-statement while profiling is off.
+    """
+    if profiler is None:
+        return _NO_SECTION
+    return profiler.section(name)
+
+
+def _summary(values) -> dict:
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return {'mean': None, 'p95': None, 'max': None}
+    return {'mean': float(values.mean()), 'p95': float(np.percentile(values, 95)), 'max': float(values.max())}
+
+
+class FrameProfiler:
+    """
+    Collects CPU and GPU timings of named sections per frame in a ring buffer of the last capacity frames.
+
+    CPU times are taken with time.perf_counter. GPU times use GL_TIMESTAMP queries (so sections may be nested) whose
+    results are collected at the next begin_frame() once the GPU has finished, so the profiler never stalls the
+    pipeline. gpu_ms of a frame is therefore None until a later frame. Sections outside of begin_frame()/end_frame()
+    (i.e. a screenshot requested by the application) are kept in a separate ring buffer.
+
+    All GL calls need the context that is drawn to to be current.
+    """
+
+    def __init__(self, capacity: int = 300, gpu_timers: bool = True):
+        """
+
+        Parameters
+        ----------
+        capacity : int
+                number of frames kept
+        gpu_timers : bool
+                measure GPU times with timer queries (needs OpenGL 3.3 or ARB_timer_query)
+        """
+        self.frames = deque(maxlen=capacity)
+        self.outside_frames = deque(maxlen=capacity)  # events recorded while no frame was open
+        self.gpu_timers = gpu_timers
+        self._current = None  # type: dict
+        self._frame_index = 0
+        self._pending = deque()  # events whose GPU queries have not been read yet
+        self._free_queries = []
+        self._result = np.zeros(1, dtype=np.uint64)
+        self._available = np.zeros(1, dtype=np.int32)
+
+    def begin_frame(self):
+        self.collect_gpu_results()
+        self._current = {'frame': self._frame_index, 'start': time.perf_counter(), 'events': []}
+        self._frame_index += 1
+
+    def end_frame(self) -> dict:
+        """
+        Returns
+        -------
+            the finished frame record: dict with 'frame' index, 'start' (perf_counter seconds), 'cpu_ms' and 'events',
+            a list of dicts with 'name', 'start', 'cpu_ms' and 'gpu_ms'.
+        """
+        frame, self._current = self._current, None
+        if frame is None:
+            return None
+        frame['cpu_ms'] = (time.perf_counter() - frame['start']) * 1000
+        self.frames.append(frame)
+        return frame
+
+    @contextmanager
+    def section(self, name: str):
+        queries = self._timestamp() if self.gpu_timers else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            cpu_ms = (time.perf_counter() - start) * 1000
+            event = {'name': name, 'start': start, 'cpu_ms': cpu_ms, 'gpu_ms': None}
+            if queries is not None:
+                event['_queries'] = (queries, self._timestamp())
+                self._pending.append(event)
+            if self._current is not None:
+                self._current['events'].append(event)
+            else:
+                self.outside_frames.append(event)
+
+    def _timestamp(self):
+        if not self._free_queries:
+            try:
+                self._free_queries.extend(int(q) for q in np.atleast_1d(glGenQueries(16)))
+            except Exception:  # no timer queries on this context
+                self.gpu_timers = False
+                return None
+        query = self._free_queries.pop()
+        glQueryCounter(query, GL_TIMESTAMP)
+        return query
+
+    def collect_gpu_results(self):
+        """ Read the results of finished timer queries without waiting for the GPU """
+        while self._pending:
+            event = self._pending[0]
+            start_query, end_query = event['_queries']
+            if start_query is None or end_query is None:  # timer queries failed
+                self._free_queries += [q for q in (start_query, end_query) if q is not None]
+            else:
+                glGetQueryObjectiv(end_query, GL_QUERY_RESULT_AVAILABLE, self._available)
+                if not self._available[0]:
+                    return  # later queries cannot be done either
+                glGetQueryObjectui64v(start_query, GL_QUERY_RESULT, self._result)
+                start_ns = int(self._result[0])
+                glGetQueryObjectui64v(end_query, GL_QUERY_RESULT, self._result)
+                event['gpu_ms'] = (int(self._result[0]) - start_ns) / 1e6
+                self._free_queries += [start_query, end_query]
+            del event['_queries']
+            self._pending.popleft()
+
+    def frame_stats(self) -> dict:
+        """
+        Statistics over the frames in the ring buffer.
+
+        Returns
+        -------
+            dict with the number of 'frames', the 'fps' measured from the frame start times, 'frame_cpu_ms' and per
+            section name the 'cpu_ms' and 'gpu_ms' summaries ('mean', 'p95', 'max' in milliseconds).
+        """
+        frames = list(self.frames)
+        sections = {}
+        for event in [e for frame in frames for e in frame['events']] + list(self.outside_frames):
+            times = sections.setdefault(event['name'], {'cpu_ms': [], 'gpu_ms': []})
+            times['cpu_ms'].append(event['cpu_ms'])
+            if event['gpu_ms'] is not None:
+                times['gpu_ms'].append(event['gpu_ms'])
+        fps = 0.0
+        if len(frames) > 1 and frames[-1]['start'] > frames[0]['start']:
+            fps = (len(frames) - 1) / (frames[-1]['start'] - frames[0]['start'])
+        return {'frames': len(frames),
+                'fps': fps,
+                'frame_cpu_ms': _summary([frame['cpu_ms'] for frame in frames]),
+                'sections': {name: {'cpu_ms': _summary(times['cpu_ms']), 'gpu_ms': _summary(times['gpu_ms'])}
+                             for name, times in sections.items()}}
+
+    def dump_chrome_trace(self, filename: str):
+        """
+        Write the frames in the ring buffer as Chrome trace JSON (open with chrome://tracing or Perfetto). CPU times
+        are on thread 0. GPU durations are on thread 1, placed at the CPU start of their section.
+        """
+        trace = []
+
+        def add(name, start, duration_ms, thread, category):
+            trace.append({'name': name, 'cat': category, 'ph': 'X', 'pid': 0, 'tid': thread,
+                          'ts': start * 1e6, 'dur': duration_ms * 1000})
+
+        for frame in self.frames:
+            add(f'frame {frame["frame"]}', frame['start'], frame['cpu_ms'], 0, 'frame')
+            for event in frame['events']:
+                add(event['name'], event['start'], event['cpu_ms'], 0, 'cpu')
+                if event['gpu_ms'] is not None:
+                    add(event['name'], event['start'], event['gpu_ms'], 1, 'gpu')
+        for event in self.outside_frames:
+            add(event['name'], event['start'], event['cpu_ms'], 0, 'cpu')
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': 0, 'args': {'name': 'CPU'}},
+                    {'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': 1, 'args': {'name': 'GPU'}}]
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': metadata + trace, 'displayTimeUnit': 'ms'}, f)
+
+    def release(self):
+        """ Delete the timer queries. The context they were created in must be current. """
+        queries = self._free_queries + [q for event in self._pending for q in event['_queries'] if q is not None]
+        if queries:
+            glDeleteQueries(len(queries), queries)
+        self._free_queries = []
+        self._pending.clear()
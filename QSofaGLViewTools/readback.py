@@ -0,0 +1,283 @@
+from OpenGL.GL import *
+from OpenGL.raw.GL.VERSION.GL_1_0 import glReadPixels as gl_read_pixels_raw
+from concurrent.futures import Future
+from collections import namedtuple
+import numpy as np
+import ctypes
+import time
+
+
+ReadbackFrame = namedtuple('ReadbackFrame', ['frame_index', 'timestamp', 'color', 'depth'])
+ReadbackFrame.__doc__ = """
+A frame that was read back asynchronously. color is a (height, width, 3|4) array (or None) and depth is the
+linearized (height, width) float32 depth map (or None). Both are already flipped to image orientation.
+"""
+
+
+def linearize_depth(image, near, far, out=None):
+    """
+    Convert values from the depth buffer [0, 1] to the distance from the camera plane.
+
+    Parameters
+    ----------
+    image : np.ndarray
+            float32 depth buffer values
+    near : float
+            camera zNear
+    far : float
+            camera zFar
+    out : np.ndarray
+            optional float32 array with the same shape as image to write the result to. May be image itself.
+
+    Returns
+    -------
+        np.ndarray with the linear depths
+    """
+    out = np.multiply(image, near - far, out=out, dtype=np.float32)
+    out += far
+    np.divide(-far * near, out, out=out)
+    return out
+
+
+def _address(pointer):
+    """ PyOpenGL returns mapped buffers either as an int or as a ctypes pointer depending on version/platform """
+    if isinstance(pointer, int):
+        return pointer
+    return ctypes.cast(pointer, ctypes.c_void_p).value
+
+
+class _ReadbackSlot:
+    """ One entry of the pixel buffer ring. Holds the PBOs and the information needed to map them later. """
+
+    def __init__(self):
+        self.color_pbo = int(glGenBuffers(1))
+        self.depth_pbo = int(glGenBuffers(1))
+        self.color_bytes = 0
+        self.depth_bytes = 0
+        self.fence = None
+        self.in_use = False
+        self.frame_index = -1
+        self.timestamp = 0.0
+        self.width = 0
+        self.height = 0
+        self.near = 0.0
+        self.far = 0.0
+        self.read_color = False
+        self.read_depth = False
+        self.futures = []  # type: list[Future]
+
+    def release(self):
+        if self.fence is not None:
+            glDeleteSync(self.fence)
+            self.fence = None
+        glDeleteBuffers(2, [self.color_pbo, self.depth_pbo])
+
+
+class AsyncReadback:
+    """
+    Reads back the color and/or depth buffer through a ring of pixel buffer objects (PBOs). glReadPixels into a bound
+    PBO returns immediately, the transfer happens while the next frames are drawn and the data is mapped once a fence
+    reports the copy finished (or the ring wraps around). Requests are therefore answered one or two frames later
+    through concurrent.futures.Future objects.
+
+    All methods must be called with the GL context of the view current. Futures are resolved and callbacks are
+    called on the thread that owns the GL context (the GUI thread for a QSofaGLView).
+    """
+
+    def __init__(self,
+                 ring_size: int = 3,
+                 read_color: bool = True,
+                 read_depth: bool = True,
+                 with_alpha: bool = False,
+                 continuous: bool = False):
+        """
+
+        Parameters
+        ----------
+        ring_size : int
+                Number of PBO sets in the ring. Frames are mapped at the latest ring_size - 1 frames after capture.
+        read_color : bool
+                Whether the color buffer is read back.
+        read_depth : bool
+                Whether the depth buffer is read back.
+        with_alpha : bool
+                Whether the color buffer is read as RGBA instead of RGB.
+        continuous : bool
+                If True, every drawn frame is read back and passed to the registered frame callbacks, not only frames
+                for which a request is pending.
+        """
+        if ring_size < 2:
+            raise ValueError('ring_size must be at least 2 for asynchronous readback.')
+        if not (read_color or read_depth):
+            raise ValueError('At least one of read_color or read_depth must be True.')
+        self.ring_size = ring_size
+        self.read_color = read_color
+        self.read_depth = read_depth
+        self.with_alpha = with_alpha
+        self.continuous = continuous
+        self._slots = [_ReadbackSlot() for _ in range(ring_size)]
+        self._next_slot = 0
+        self._frame_index = 0
+        self._requests = []  # type: list[Future]
+        self._frame_callbacks = []
+
+    @property
+    def pending(self):
+        """ Number of frames that were captured but not yet handed out """
+        return sum(1 for slot in self._slots if slot.in_use)
+
+    @property
+    def has_work(self):
+        return bool(self._requests) or self.pending > 0
+
+    def request(self, callback=None) -> Future:
+        """
+        Request that the next drawn frame is read back.
+
+        Parameters
+        ----------
+        callback : callable
+                optional function that is called with the ReadbackFrame once it is available.
+
+        Returns
+        -------
+            Future that resolves to a ReadbackFrame
+        """
+        future = Future()
+        if callback is not None:
+            def _done(f: Future):
+                if not f.cancelled():  # release() cancels the requests that were never drawn
+                    callback(f.result())
+            future.add_done_callback(_done)
+        self._requests.append(future)
+        return future
+
+    def add_frame_callback(self, callback):
+        """ Register a function that is called with every ReadbackFrame read back in continuous mode """
+        self._frame_callbacks.append(callback)
+
+    def remove_frame_callback(self, callback):
+        self._frame_callbacks.remove(callback)
+
+    def capture(self, width: int, height: int, near: float, far: float):
+        """
+        Start the transfer of the currently bound read framebuffer into the next PBO of the ring. Called right after
+        the scene was drawn. Does nothing if there is neither a pending request nor continuous mode enabled.
+        """
+        if not self._requests and not self.continuous:
+            self.poll()
+            return
+        slot = self._slots[self._next_slot]
+        if slot.in_use:
+            # the ring wrapped around before the fence signaled. This is the only place that can stall.
+            self._resolve(slot)
+        self._next_slot = (self._next_slot + 1) % self.ring_size
+
+        slot.frame_index = self._frame_index
+        self._frame_index += 1
+        slot.timestamp = time.time()
+        slot.width, slot.height = width, height
+        slot.near, slot.far = near, far
+        slot.read_color, slot.read_depth = self.read_color, self.read_depth
+        slot.futures, self._requests = self._requests, []
+        slot.in_use = True
+
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        if slot.read_color:
+            channels = 4 if self.with_alpha else 3
+            nbytes = width * height * channels
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, slot.color_pbo)
+            if nbytes != slot.color_bytes:
+                glBufferData(GL_PIXEL_PACK_BUFFER, nbytes, None, GL_STREAM_READ)
+                slot.color_bytes = nbytes
+            gl_read_pixels_raw(0, 0, width, height, GL_RGBA if self.with_alpha else GL_RGB, GL_UNSIGNED_BYTE,
+                               ctypes.c_void_p(0))
+        if slot.read_depth:
+            nbytes = width * height * 4
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, slot.depth_pbo)
+            if nbytes != slot.depth_bytes:
+                glBufferData(GL_PIXEL_PACK_BUFFER, nbytes, None, GL_STREAM_READ)
+                slot.depth_bytes = nbytes
+            gl_read_pixels_raw(0, 0, width, height, GL_DEPTH_COMPONENT, GL_FLOAT, ctypes.c_void_p(0))
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        slot.fence = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        self.poll()
+
+    def poll(self):
+        """ Hand out every frame whose transfer has finished. Never blocks. """
+        for slot in self._ordered_in_use_slots():
+            status = glClientWaitSync(slot.fence, GL_SYNC_FLUSH_COMMANDS_BIT, 0)
+            if status not in (GL_ALREADY_SIGNALED, GL_CONDITION_SATISFIED):
+                break  # frames complete in order. No need to check the younger ones.
+            self._resolve(slot)
+
+    def flush(self):
+        """ Hand out all pending frames, waiting for the transfers if necessary. """
+        for slot in self._ordered_in_use_slots():
+            self._resolve(slot)
+
+    def release(self):
+        """ Resolve everything that is pending and free the GL buffers """
+        self.flush()
+        for future in self._requests:
+            future.cancel()
+        self._requests = []
+        for slot in self._slots:
+            slot.release()
+        self._slots = []
+
+    def _ordered_in_use_slots(self):
+        return sorted((slot for slot in self._slots if slot.in_use), key=lambda s: s.frame_index)
+
+    def _map(self, pbo, nbytes, dtype, shape):
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, pbo)
+        address = _address(glMapBuffer(GL_PIXEL_PACK_BUFFER, GL_READ_ONLY))
+        try:
+            data = np.frombuffer((ctypes.c_char * nbytes).from_address(address), dtype=dtype).reshape(shape)
+            image = np.flipud(data).copy()  # the only copy. Flips the image and detaches it from the mapped memory
+        finally:
+            glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        return image
+
+    def _resolve(self, slot: _ReadbackSlot):
+        color, depth = None, None
+        if slot.read_color:
+            channels = 4 if self.with_alpha else 3
+            color = self._map(slot.color_pbo, slot.color_bytes, np.uint8, (slot.height, slot.width, channels))
+        if slot.read_depth:
+            depth = self._map(slot.depth_pbo, slot.depth_bytes, np.float32, (slot.height, slot.width))
+            linearize_depth(depth, slot.near, slot.far, out=depth)
+        glDeleteSync(slot.fence)
+        slot.fence = None
+        slot.in_use = False
+        frame = ReadbackFrame(slot.frame_index, slot.timestamp, color, depth)
+        futures, slot.futures = slot.futures, []
+        for future in futures:
+            if future.set_running_or_notify_cancel():
+                future.set_result(frame)
+        if self.continuous:
+            for callback in self._frame_callbacks:
+                callback(frame)
+
+
+def frame_field_future(frame_future: Future, field: str, callback=None) -> Future:
+    """
+    Create a Future that resolves to a single field ('color' or 'depth') of the ReadbackFrame that frame_future
+    resolves to.
+    """
+    future = Future()
+
+    def _done(f: Future):
+        if f.cancelled():
+            future.cancel()
+            return
+        if not future.set_running_or_notify_cancel():
+            return
+        result = getattr(f.result(), field)
+        future.set_result(result)
+        if callback is not None:
+            callback(result)
+
+    frame_future.add_done_callback(_done)
+    return future
@@ -0,0 +1,331 @@
+import numpy as np
+import subprocess
+import threading
+import shutil
+import queue
+
+
+class FixedRateResampler:
+    """
+    Maps frames with irregular timestamps onto a fixed frame rate. Every output slot n (at time t0 + n / fps) shows the
+    captured frame closest to it. Frames that lose against a closer frame for the same slot are dropped and slots
+    without a new frame repeat the previous one.
+    """
+
+    def __init__(self, fps: float):
+        self.fps = fps
+        self.frames_dropped = 0
+        self.frames_duplicated = 0
+        self._t0 = None
+        self._next_slot = 0  # next output slot that has not been written yet
+        self._held = None  # (slot, source_time, frame) best candidate for the latest slot
+        self._last_written = None  # (source_time, frame) of the last written slot
+
+    def push(self, timestamp: float, frame: np.ndarray):
+        """
+        Add a captured frame.
+
+        Returns
+        -------
+            list of (slot, source_time, frame, is_duplicate) that are ready to be written, in order.
+        """
+        if self._t0 is None:
+            self._t0 = timestamp
+        slot = int(round((timestamp - self._t0) * self.fps))
+        ready = []
+        if slot < self._next_slot:  # time went backwards or the slot was already written
+            self.frames_dropped += 1
+            return ready
+        if self._held is not None:
+            held_slot, held_time, held_frame = self._held
+            if held_slot == slot:
+                slot_time = self._t0 + slot / self.fps
+                if abs(timestamp - slot_time) < abs(held_time - slot_time):
+                    self._held = (slot, timestamp, frame)
+                self.frames_dropped += 1
+                return ready
+            ready.append(self._write(held_slot, held_time, held_frame, False))
+            # repeat the held frame until the new frame's slot
+            while self._next_slot < slot:
+                ready.append(self._write(self._next_slot, held_time, held_frame, True))
+        self._held = (slot, timestamp, frame)
+        return ready
+
+    def finish(self):
+        """ Returns the frames that are still held back. """
+        if self._held is None:
+            return []
+        held_slot, held_time, held_frame = self._held
+        self._held = None
+        return [self._write(held_slot, held_time, held_frame, False)]
+
+    def _write(self, slot, source_time, frame, duplicate):
+        self._next_slot = slot + 1
+        if duplicate:
+            self.frames_duplicated += 1
+        return slot, source_time, frame, duplicate
+
+
+class VideoRecorder:
+    """
+    Encodes frames into a video file on a background thread while they are being recorded. Frames are handed over
+    through a bounded queue, so memory stays constant no matter how long the recording is. When the queue is full,
+    write() either blocks until the encoder catches up (backpressure) or drops the frame.
+
+    Two backends are available:
+        'opencv' : cv2.VideoWriter with a FOURCC codec. Default is uncompressed video (same as before).
+        'ffmpeg' : frames are piped as raw RGB into an ffmpeg subprocess. Supports CRF and lossless encoding.
+    """
+
+    _STOP = object()
+
+    def __init__(self,
+                 video_file: str,
+                 fps: float = None,
+                 backend: str = 'opencv',
+                 codec: str = None,
+                 crf: int = None,
+                 lossless: bool = False,
+                 max_queue_size: int = 8,
+                 drop_when_full: bool = False,
+                 fps_estimation_frames: int = 10,
+                 ffmpeg_executable: str = 'ffmpeg',
+                 fixed_rate: bool = False,
+                 timestamp_file: str = None):
+        """
+
+        Parameters
+        ----------
+        video_file : str
+                path to the video file to write.
+        fps : float
+                frame rate of the video. If None, it is estimated from the timestamps of the first
+                fps_estimation_frames frames.
+        backend : str
+                'opencv' or 'ffmpeg'
+        codec : str
+                For opencv a FOURCC string (i.e. 'MJPG'), for ffmpeg an encoder name (i.e. 'libx264', 'ffv1').
+                Defaults to uncompressed video for opencv and libx264 for ffmpeg.
+        crf : int
+                Constant rate factor passed to ffmpeg. Lower is better quality. Only for the ffmpeg backend.
+        lossless : bool
+                Encode without loss. For ffmpeg this uses libx264rgb with -qp 0 unless a codec is given.
+        max_queue_size : int
+                Maximum number of frames waiting to be encoded.
+        drop_when_full : bool
+                If True, frames are dropped instead of blocking the caller when the queue is full.
+        fps_estimation_frames : int
+                Number of frames used to estimate the frame rate when fps is None.
+        ffmpeg_executable : str
+                name or path of the ffmpeg executable.
+        fixed_rate : bool
+                If True, the frame timestamps are resampled to fps (default 30) by dropping and duplicating frames, so
+                the video plays at the speed of the clock the timestamps came from.
+        timestamp_file : str
+                optional path of a CSV sidecar with one row per video frame (frame, video_time, source_time,
+                duplicate).
+        """
+        if backend not in ('opencv', 'ffmpeg'):
+            raise ValueError(f'Unknown video backend "{backend}". Use "opencv" or "ffmpeg".')
+        if backend == 'opencv' and crf is not None:
+            raise ValueError('crf is only supported by the ffmpeg backend.')
+        if backend == 'ffmpeg' and shutil.which(ffmpeg_executable) is None:
+            raise FileNotFoundError(f'Could not find the ffmpeg executable "{ffmpeg_executable}".')
+        self.video_file = video_file
+        self.fps = fps
+        self.backend = backend
+        self.codec = codec
+        self.crf = crf
+        self.lossless = lossless
+        self.drop_when_full = drop_when_full
+        self.fps_estimation_frames = max(2, fps_estimation_frames)
+        self.ffmpeg_executable = ffmpeg_executable
+        self.timestamp_file = timestamp_file
+        self.frames_captured = 0
+        self.frames_written = 0
+        self.frames_dropped = 0  # because the queue was full
+        if fixed_rate:
+            if self.fps is None:
+                self.fps = 30.0
+            self._resampler = FixedRateResampler(self.fps)
+        else:
+            self._resampler = None
+        self._timestamps = None
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._writer = None
+        self._process = None
+        self._error = None  # type: Exception
+        self._thread = threading.Thread(target=self._run, name='VideoRecorder', daemon=True)
+        self._thread.start()
+
+    @property
+    def queue_depth(self):
+        """ Number of frames currently waiting to be encoded """
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        """
+        Live counters of the recording.
+
+        Returns
+        -------
+            dict with the number of frames 'captured' (handed to write()), 'written' (encoded into the video),
+            'dropped' (queue full or replaced by resampling), 'duplicated' (repeated by resampling) and the current
+            'queue_depth'.
+        """
+        dropped, duplicated = self.frames_dropped, 0
+        if self._resampler is not None:
+            dropped += self._resampler.frames_dropped
+            duplicated = self._resampler.frames_duplicated
+        return {'captured': self.frames_captured,
+                'written': self.frames_written,
+                'dropped': dropped,
+                'duplicated': duplicated,
+                'queue_depth': self.queue_depth}
+
+    def write(self, timestamp: float, frame: np.ndarray) -> bool:
+        """
+        Hand a frame to the encoder. The frame must not be modified afterwards.
+
+        Parameters
+        ----------
+        timestamp : float
+                time the frame was captured in seconds.
+        frame : np.ndarray
+                (height, width, 3) RGB uint8 image.
+
+        Returns
+        -------
+            bool: False if the frame was dropped because the queue was full.
+        """
+        self._raise_error()
+        self.frames_captured += 1
+        if self.drop_when_full:
+            try:
+                self._queue.put_nowait((timestamp, frame))
+            except queue.Full:
+                self.frames_dropped += 1
+                return False
+        else:
+            self._queue.put((timestamp, frame))
+        return True
+
+    def close(self):
+        """ Encode all remaining frames and finish the video file. Blocks until done. """
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(f'Video encoding of {self.video_file} failed.') from error
+
+    def _run(self):
+        pending = []  # frames held back until the frame rate is known
+        stopped = False
+        try:
+            while True:
+                item = self._queue.get()
+                if item is self._STOP:
+                    stopped = True
+                    break
+                if self._writer is None and self._process is None:
+                    pending.append(item)
+                    if self.fps is None and len(pending) < self.fps_estimation_frames:
+                        continue
+                    self._open(pending)
+                    for timestamp, frame in pending:
+                        self._add(timestamp, frame)
+                    pending = []
+                else:
+                    self._add(*item)
+            if pending:
+                self._open(pending)
+                for timestamp, frame in pending:
+                    self._add(timestamp, frame)
+            if self._resampler is not None:
+                for slot, source_time, frame, duplicate in self._resampler.finish():
+                    self._encode(frame, source_time, duplicate)
+        except Exception as e:
+            self._error = e
+            # keep draining so a blocked producer does not dead-lock
+            while not stopped:
+                stopped = self._queue.get() is self._STOP
+        finally:
+            self._release()
+
+    def _add(self, timestamp, frame):
+        if self._resampler is None:
+            self._encode(frame, timestamp, False)
+        else:
+            for slot, source_time, frame, duplicate in self._resampler.push(timestamp, frame):
+                self._encode(frame, source_time, duplicate)
+
+    def _open(self, first_frames):
+        if self.fps is None:
+            times = np.array([t for t, _ in first_frames])
+            self.fps = 1 / np.average(np.diff(times)) if len(times) > 1 and times[-1] > times[0] else 30.0
+        height, width = first_frames[0][1].shape[:2]
+        if self.timestamp_file is not None:
+            self._timestamps = open(self.timestamp_file, 'w')
+            self._timestamps.write('frame,video_time,source_time,duplicate\n')
+        if self.backend == 'opencv':
+            import cv2
+            if self.codec is None:
+                fourcc = 0  # uncompressed
+            else:
+                fourcc = cv2.VideoWriter_fourcc(*self.codec)
+            self._writer = cv2.VideoWriter(self.video_file, fourcc, self.fps, (width, height))
+            if not self._writer.isOpened():
+                raise IOError(f'cv2.VideoWriter could not open {self.video_file}')
+        else:
+            self._process = subprocess.Popen(self._ffmpeg_command(width, height),
+                                             stdin=subprocess.PIPE,
+                                             stdout=subprocess.DEVNULL,
+                                             stderr=subprocess.DEVNULL)
+
+    def _ffmpeg_command(self, width, height):
+        command = [self.ffmpeg_executable, '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r', f'{self.fps}',
+                   '-i', '-']
+        if self.lossless:
+            codec = self.codec if self.codec is not None else 'libx264rgb'
+            command += ['-c:v', codec]
+            if codec.startswith('libx264'):
+                command += ['-qp', '0']
+        else:
+            # yuv420p needs even dimensions
+            command += ['-c:v', self.codec if self.codec is not None else 'libx264', '-pix_fmt', 'yuv420p',
+                        '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2']
+            if self.crf is not None:
+                command += ['-crf', str(self.crf)]
+        return command + [self.video_file]
+
+    def _encode(self, frame, source_time, duplicate):
+        if frame.shape[-1] == 4:
+            frame = frame[..., :3]
+        if self._writer is not None:
+            import cv2
+            self._writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+        else:
+            self._process.stdin.write(np.ascontiguousarray(frame).data)
+        if self._timestamps is not None:
+            self._timestamps.write(f'{self.frames_written},{self.frames_written / self.fps},{source_time},'
+                                   f'{int(duplicate)}\n')
+        self.frames_written += 1
+
+    def _release(self):
+        if self._timestamps is not None:
+            self._timestamps.close()
+            self._timestamps = None
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+        if self._process is not None:
+            self._process.stdin.close()
+            return_code = self._process.wait()
+            self._process = None
+            if return_code != 0 and self._error is None:
+                self._error = IOError(f'ffmpeg exited with code {return_code}')
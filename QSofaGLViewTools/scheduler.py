@@ -0,0 +1,108 @@
+try:
+    from qtpy.QtCore import *
+except Exception as e:
+    print(e)
+    from PyQt6.QtCore import *
+    Signal = pyqtSignal
+
+import time
+
+
+class RedrawScheduler(QObject):
+    """
+    Repaints a view only when something it shows changed. On every tick (at most max_fps times per second) it checks
+    the simulation time of the root node, the revision of the view's camera state (see camera_state.CameraState) and
+    a dirty flag that can be set with mark_dirty(). Additional change sources can be added with add_watch(). If
+    nothing changed, the view is still repainted idle_fps times per second so changes that are not tracked show up
+    eventually. idle_fps >= max_fps repaints on every tick (same as an unconditional refresh timer).
+    """
+
+    def __init__(self, view, max_fps: float = 30, idle_fps: float = 1):
+        """
+
+        Parameters
+        ----------
+        view : QSofaGLView
+                widget to repaint. Needs visuals_node and camera_state.
+        max_fps : float
+                maximum repaint rate in Hz
+        idle_fps : float
+                repaint rate in Hz while nothing changed. 0 never repaints an unchanged view.
+        """
+        super(RedrawScheduler, self).__init__()
+        self.view = view
+        self.max_fps = max_fps
+        self.idle_fps = idle_fps
+        self.redraws = 0
+        self.skipped = 0
+        self._dirty = True
+        self._watches = []  # callables returning a value that changes when the view needs a repaint
+        self._last_values = []
+        self._last_sim_time = None
+        self._last_camera_revision = None
+        self._last_redraw = 0.0
+        self.clock = time.perf_counter  # seconds, replaceable for tests
+        self._timer = QTimer()
+        self._timer.timeout.connect(self.tick)
+
+    def start(self, max_fps: float = None, idle_fps: float = None):
+        if max_fps is not None:
+            self.max_fps = max_fps
+        if idle_fps is not None:
+            self.idle_fps = idle_fps
+        self._timer.start(max(1, int(round(1000 / self.max_fps))))
+
+    def stop(self):
+        self._timer.stop()
+
+    def is_active(self) -> bool:
+        return self._timer.isActive()
+
+    def mark_dirty(self):
+        """ Repaint on the next tick """
+        self._dirty = True
+
+    def add_watch(self, watch):
+        """
+        :param watch: callable without arguments. The view is repainted whenever its return value changes.
+        """
+        self._watches.append(watch)
+        self._last_values.append(None)
+
+    def stats(self) -> dict:
+        """ Number of ticks that led to a repaint ('redraws') or were skipped because nothing changed ('skipped') """
+        return {'redraws': self.redraws, 'skipped': self.skipped}
+
+    def _changed(self) -> bool:
+        changed = self._dirty
+        self._dirty = False
+        sim_time = self.view.visuals_node.getRoot().time.value
+        if sim_time != self._last_sim_time:
+            self._last_sim_time = sim_time
+            changed = True
+        camera_state = self.view.camera_state
+        camera_state.update(self.view.width(), self.view.height())
+        if camera_state.revision != self._last_camera_revision:
+            self._last_camera_revision = camera_state.revision
+            changed = True
+        for i, watch in enumerate(self._watches):
+            value = watch()
+            if value != self._last_values[i]:
+                self._last_values[i] = value
+                changed = True
+        return changed
+
+    def tick(self):
+        """ Check for changes and repaint if needed. Called by the timer, or by a QSofaViewGroup for all its views. """
+        now = self.clock()
+        changed = self._changed()
+        if self.idle_fps >= self.max_fps:
+            idle_due = True  # every tick, without comparing jittery timer timestamps against the period
+        else:
+            idle_due = self.idle_fps > 0 and now - self._last_redraw >= 1 / self.idle_fps
+        if changed or idle_due:
+            self._last_redraw = now
+            self.redraws += 1
+            self.view.update()
+        else:
+            self.skipped += 1
@@ -9,6 +9,7 @@ except Exception as e:
     Signal = pyqtSignal
 
 from QSofaGLViewTools import QSofaGLView
+from QSofaGLViewTools.frame_sync import SimulationSync
 import threading
 import Sofa
 
@@ -18,7 +19,7 @@ except TypeError as e:
     pass
 
 
-def create_simple_window(main_function, node, camera_kargs=None):
+def create_simple_window(main_function, node, camera_kargs=None, lock_free=False):
     """
     A function to create a super basic window for a SOFA sim. This is not the recommended way to use the viewer, but
     it is sufficient for quick prototyping of SOFA simulations.
@@ -27,12 +28,16 @@ def create_simple_window(main_function, node, camera_kargs=None):
     main_function : callable
             A function that will be called in a second thread. This is meant to imitate your "main()" function. This
             function MUST take two inputs. The first input is the SOFA node (same as the input for this function) and
-            the second is the created SofaGLView.
+            the second is the created SofaGLView. To advance the simulation, call viewer.frame_sync.step() instead of
+            Sofa.Simulation.animate. The view is then only drawn between steps and the visuals (including textures)
+            are updated on the GUI thread. Do not call Sofa.Simulation.updateVisual from main_function.
     node : Sofa.Core.Node
             The node to be used for generating the SOFA view. Usually just the root node for the scene.
     camera_kargs : dict
         A dictionary of Sofa.Components.BaseCamera construction parameters. This is forwarded to a call to
         QSofaGLView.create_view_and_camera().
+    lock_free : bool
+        never let the window wait for a running simulation step. See SimulationSync.
 
     Returns
     -------
@@ -48,7 +53,7 @@ def create_simple_window(main_function, node, camera_kargs=None):
                 self.viewer, self.camera, self.camera_dofs = QSofaGLView.create_view_and_camera(node, internal_refresh_freq=20)
             else:
                 self.viewer, self.camera, self.camera_dofs = QSofaGLView.create_view_and_camera(node, camera_kwargs=camera_kargs, internal_refresh_freq=20)
-            self.viewer.resizedGL.connect(lambda: Sofa.Simulation.updateVisual(node))
+            self.viewer.frame_sync = SimulationSync(node, lock_free=lock_free)
             self.setCentralWidget(self.viewer)
             self.viewer.close = self.close
 
@@ -0,0 +1,116 @@
+import numpy as np
+
+
+def gl_matrix(values) -> np.ndarray:
+    """
+    Convert a matrix as returned by OpenGL (16 values, column-major) to a regular row-major 4x4 numpy matrix.
+    """
+    return np.asarray(values, dtype=np.float64).reshape(4, 4).T
+
+
+def unproject_points(window_points, model_view: np.ndarray, projection: np.ndarray, viewport) -> np.ndarray:
+    """
+    Vectorized equivalent of gluUnProject.
+
+    Parameters
+    ----------
+    window_points : array_like
+            (N, 3) or (3,) window coordinates (x, y, depth) with the origin in the bottom left corner and depth being
+            the depth buffer value in [0, 1].
+    model_view : np.ndarray
+            row-major 4x4 model-view matrix (see gl_matrix)
+    projection : np.ndarray
+            row-major 4x4 projection matrix (see gl_matrix)
+    viewport : array_like
+            (x, y, width, height) of the viewport
+
+    Returns
+    -------
+        np.ndarray of the (N, 3) or (3,) world coordinates
+    """
+    window_points = np.asarray(window_points, dtype=np.float64)
+    single = window_points.ndim == 1
+    window_points = np.atleast_2d(window_points)
+    vx, vy, vw, vh = viewport
+    ndc = np.empty((len(window_points), 4))
+    ndc[:, 0] = 2 * (window_points[:, 0] - vx) / vw - 1
+    ndc[:, 1] = 2 * (window_points[:, 1] - vy) / vh - 1
+    ndc[:, 2] = 2 * window_points[:, 2] - 1
+    ndc[:, 3] = 1
+    world = ndc @ np.linalg.inv(projection @ model_view).T
+    world = world[:, :3] / world[:, 3:]
+    return world[0] if single else world
+
+
+def widget_to_window(x: float, y: float, height: int) -> tuple:
+    """
+    Pixel of a widget position (origin top left, as in Qt events) in OpenGL window coordinates (origin bottom left).
+    """
+    return int(x), height - 1 - int(y)
+
+
+def project_points(points, model_view: np.ndarray, projection: np.ndarray, viewport):
+    """
+    Vectorized equivalent of gluProject.
+
+    Parameters
+    ----------
+    points : array_like
+            (N, 3) world coordinates
+    model_view : np.ndarray
+            row-major 4x4 model-view matrix (see gl_matrix)
+    projection : np.ndarray
+            row-major 4x4 projection matrix (see gl_matrix)
+    viewport : array_like
+            (x, y, width, height) of the viewport
+
+    Returns
+    -------
+        tuple(np.ndarray, np.ndarray): (N, 3) window coordinates (x, y, depth) with the origin in the bottom left
+        corner and a boolean (N,) array that is False for points behind the camera.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    mvp = projection @ model_view
+    clip = points @ mvp[:, :3].T + mvp[:, 3]
+    w = clip[:, 3]
+    in_front = w > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ndc = clip[:, :3] / w[:, None]
+    vx, vy, vw, vh = viewport
+    window = np.empty_like(ndc)
+    window[:, 0] = vx + vw * (ndc[:, 0] + 1) / 2
+    window[:, 1] = vy + vh * (ndc[:, 1] + 1) / 2
+    window[:, 2] = (ndc[:, 2] + 1) / 2
+    return window, in_front
+
+
+def quaternion_to_matrix(quaternion) -> np.ndarray:
+    """
+    Rotation matrix of a unit quaternion given as [x, y, z, w] (SOFA ordering).
+    """
+    x, y, z, w = np.asarray(quaternion, dtype=np.float64) / np.linalg.norm(quaternion)
+    return np.array([[1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+                     [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+                     [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)]])
+
+
+def pose_to_model_view(pose) -> np.ndarray:
+    """
+    Model-view matrix of a camera placed at a pose. Same as BaseCamera.getOpenGLModelViewMatrix() for a camera with
+    this position and orientation.
+
+    Parameters
+    ----------
+    pose : array_like
+            [x, y, z, qx, qy, qz, qw] position and orientation of the camera in world coordinates.
+
+    Returns
+    -------
+        row-major 4x4 np.ndarray (the inverse of the camera's world transform)
+    """
+    pose = np.asarray(pose, dtype=np.float64)
+    rotation = quaternion_to_matrix(pose[3:7])
+    model_view = np.eye(4)
+    model_view[:3, :3] = rotation.T
+    model_view[:3, 3] = -rotation.T @ pose[:3]
+    return model_view
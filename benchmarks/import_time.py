@@ -0,0 +1,94 @@
+"""
+Measure how long `import QSofaGLViewTools` takes in a fresh interpreter and check that optional heavy dependencies
+are not imported with it.
+
+Usage:
+    python benchmarks/import_time.py [--repeat 5] [--max-ms 1500] [--json results.json]
+
+Exits with a non-zero code if a heavy dependency is imported at package import time or if the median import time is
+above --max-ms.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import os
+
+# modules that must only be imported on first use of the feature that needs them
+LAZY_MODULES = ('cv2', 'PIL', 'scipy', 'inputs')
+
+_PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import QSofaGLViewTools
+elapsed = time.perf_counter() - start
+print(json.dumps({'seconds': elapsed, 'loaded': [m for m in %r if m in sys.modules]}))
+"""
+
+
+def _environment() -> dict:
+    """ Environment that imports the package of this repository, wherever the script is run from """
+    env = dict(os.environ)
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = repo_root + os.pathsep + env.get('PYTHONPATH', '')
+    return env
+
+
+def measure_once(python: str) -> dict:
+    output = subprocess.run([python, '-c', _PROBE % (LAZY_MODULES,)], env=_environment(), check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def import_breakdown(python: str, top: int = 15) -> list:
+    """ Slowest modules (cumulative microseconds) according to python -X importtime """
+    stderr = subprocess.run([python, '-X', 'importtime', '-c', 'import QSofaGLViewTools'], env=_environment(),
+                            check=True, capture_output=True, text=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = [x.strip() for x in line[len('import time:'):].split('|')]
+        rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='number of fresh interpreters to measure')
+    parser.add_argument('--max-ms', type=float, default=None, help='fail if the median import time is above this')
+    parser.add_argument('--json', type=str, default=None, help='write the results to this file')
+    parser.add_argument('--python', type=str, default=sys.executable, help='interpreter to measure')
+    args = parser.parse_args()
+
+    runs = [measure_once(args.python) for _ in range(args.repeat)]
+    times_ms = [run['seconds'] * 1000 for run in runs]
+    loaded = sorted(set(m for run in runs for m in run['loaded']))
+    results = {'benchmark': 'import_time',
+               'median_ms': statistics.median(times_ms),
+               'min_ms': min(times_ms),
+               'max_ms': max(times_ms),
+               'eagerly_loaded_optional_modules': loaded,
+               'slowest_modules_us': import_breakdown(args.python)}
+
+    print(f"import QSofaGLViewTools: median {results['median_ms']:.1f} ms "
+          f"(min {results['min_ms']:.1f}, max {results['max_ms']:.1f}) over {args.repeat} runs")
+    for cumulative, name in results['slowest_modules_us']:
+        print(f'  {cumulative / 1000:8.1f} ms  {name}')
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    failed = False
+    if loaded:
+        print(f'FAIL: optional dependencies imported eagerly: {", ".join(loaded)}')
+        failed = True
+    if args.max_ms is not None and results['median_ms'] > args.max_ms:
+        print(f'FAIL: median import time {results["median_ms"]:.1f} ms is above {args.max_ms} ms')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""
+Headless benchmarks of rendering, readback, projection, markers, high resolution capture and recording.
+
+Runs without a display through QSofaOffscreenRenderer (same drawing code as QSofaGLView.paintGL) on either the liver
+scene of test/liver.msh or a synthetic mesh with a given number of vertices, at several resolutions.
+
+Usage:
+    python benchmarks/render_benchmarks.py [--scene liver|synthetic] [--vertices 100000]
+                                           [--resolutions 640x480,1280x720,1920x1080] [--repeat 50]
+                                           [--software] [--json results.json]
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+
+def timings(function, repeat: int, warmup: int = 3) -> dict:
+    """ Call function repeat times and summarize the wall times in milliseconds """
+    from OpenGL.GL import glFinish
+    for _ in range(warmup):
+        function()
+    glFinish()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        glFinish()  # include the GPU work, not only the submission
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return {'mean_ms': statistics.mean(times),
+            'median_ms': statistics.median(times),
+            'p95_ms': times[min(len(times) - 1, int(0.95 * len(times)))],
+            'min_ms': times[0],
+            'repeat': repeat}
+
+
+def create_liver_scene(root):
+    """ Liver of examples/simple_window.py with the coarse mesh from test/liver.msh """
+    from SofaRuntime import importPlugin
+    for plugin in ('SofaOpenglVisual', 'SofaGeneralLoader', 'SofaImplicitOdeSolver', 'SofaLoader', 'SofaSimpleFem',
+                   'SofaBoundaryCondition', 'SofaBaseLinearSolver', 'SofaBaseMechanics'):
+        importPlugin(plugin)
+    root.dt = 0.01
+    root.gravity = [0, -1., 0]
+    root.addObject("MeshGmshLoader", name="meshLoaderCoarse", filename=os.path.join(REPO_ROOT, 'test', 'liver.msh'))
+    root.addObject("EulerImplicitSolver")
+    root.addObject("CGLinearSolver", iterations="200", tolerance="1e-09", threshold="1e-09")
+    liver = root.addChild("liver")
+    liver.addObject("TetrahedronSetTopologyContainer", name="topo", src="@../meshLoaderCoarse")
+    liver.addObject("MechanicalObject", template="Vec3d", name="MechanicalModel")
+    liver.addObject("TetrahedronFEMForceField", name="fem", youngModulus="1000", poissonRatio="0.4", method="large")
+    liver.addObject("MeshMatrixMass", massDensity="1")
+    liver.addObject("FixedConstraint", indices="2 3 50")
+    visual = liver.addChild("visual")
+    visual.addObject('MeshObjLoader', name="meshLoader_0", filename="mesh/liver-smooth.obj", handleSeams="1")
+    visual.addObject('OglModel', name="VisualModel", src="@meshLoader_0", color='red')
+    visual.addObject('BarycentricMapping', input="@../MechanicalModel", output="@VisualModel")
+    root.addObject("LightManager")
+    root.addObject("DirectionalLight", direction=[0, 1, 0])
+
+
+def create_synthetic_scene(root, vertices: int):
+    """ A single OglModel: a UV sphere with about the requested number of vertices """
+    from SofaRuntime import importPlugin
+    from QSofaGLViewTools.markers import sphere_mesh
+    importPlugin('SofaOpenglVisual')
+    stacks = max(2, int(np.sqrt(vertices / 2)))
+    positions, indices = sphere_mesh(stacks, 2 * stacks)
+    root.addObject('OglModel', name='synthetic', position=(positions * 10).tolist(),
+                   triangles=indices.reshape(-1, 3).tolist(), color='red')
+    root.addObject("LightManager")
+    root.addObject("DirectionalLight", direction=[0, 1, 0])
+    return len(positions)
+
+
+def memory_mb() -> float:
+    """ Peak resident memory of the process """
+    scale = 1024 if sys.platform != 'darwin' else 1024 * 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def bench_resolution(renderer, width, height, repeat, results):
+    from QSofaGLViewTools.transforms import project_points
+    renderer.resize(width, height)
+    entry = lambda name, **values: results.append(dict(name=name, resolution=f'{width}x{height}', **values))
+
+    entry('render', **timings(renderer.render, repeat))
+    color = np.empty((height, width, 3), dtype=np.uint8)
+    entry('get_screen_shot', **timings(lambda: renderer.get_screen_shot(out=color), repeat))
+    depth = np.empty((height, width), dtype=np.float32)
+    entry('get_depth_map', **timings(lambda: renderer.get_depth_map(out=depth), repeat))
+    renderer.enable_gpu_depth(True)
+    entry('get_depth_map_gpu', **timings(lambda: renderer.get_depth_map(out=depth), repeat))
+    renderer.enable_gpu_depth(False)
+
+    # get_screen_locations projects with the cached camera matrices
+    state = renderer.camera_state
+    state.update(width, height)
+    bbox = renderer.visuals_node.bbox.array()
+    points = np.random.default_rng(0).uniform(bbox[0], bbox[1], size=(100000, 3))
+    result = timings(lambda: project_points(points, state.model_view, state.projection, state.viewport), repeat)
+    result['points_per_second'] = len(points) / (result['median_ms'] / 1000)
+    entry('screen_locations', points=len(points), **result)
+
+
+def bench_spheres(renderer, repeat, results):
+    bbox = renderer.visuals_node.bbox.array()
+    rng = np.random.default_rng(1)
+    radius = float(np.linalg.norm(bbox[1] - bbox[0])) * 0.005
+    for count in (10, 100, 1000, 10000):
+        positions = rng.uniform(bbox[0], bbox[1], size=(count, 3))
+        colors = rng.uniform(0, 1, size=(count, 3))
+        start = time.perf_counter()
+        renderer.markers.set_spheres(positions, radius, colors)
+        set_ms = (time.perf_counter() - start) * 1000
+        results.append(dict(name='draw_spheres', spheres=count, resolution=f'{renderer.width()}x{renderer.height()}',
+                            set_ms=set_ms, **timings(renderer.render, repeat)))
+    renderer.markers.clear()
+
+
+def bench_capture(renderer, repeat, results):
+    """ capture() at 4K without resizing the renderer, plain, with MSAA and supersampled """
+    for samples, supersample in ((0, 1), (4, 1), (0, 2)):
+        capture = lambda: renderer.capture((3840, 2160), outputs=('rgb', 'depth'), samples=samples,
+                                           supersample=supersample)
+        results.append(dict(name='capture', resolution='3840x2160', samples=samples, supersample=supersample,
+                            **timings(capture, max(1, repeat // 5))))
+
+
+def bench_recording(renderer, frames, results):
+    from QSofaGLViewTools.recording import VideoRecorder
+    try:
+        import cv2  # noqa: F401
+        backend = 'opencv'
+    except ImportError:
+        backend = 'ffmpeg' if shutil.which('ffmpeg') else None
+    if backend is None:
+        results.append(dict(name='recording', skipped='neither OpenCV nor ffmpeg is available'))
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        recorder = VideoRecorder(os.path.join(directory, 'benchmark.avi'), fps=30, backend=backend)
+        tracemalloc.start()
+        rss_before = memory_mb()
+        start = time.perf_counter()
+        for i in range(frames):
+            renderer.render()
+            recorder.write(i / 30, renderer.get_screen_shot())
+        capture_s = time.perf_counter() - start
+        recorder.close()
+        total_s = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append(dict(name='recording', backend=backend, resolution=f'{renderer.width()}x{renderer.height()}',
+                            frames=frames, capture_fps=frames / capture_s, total_fps=frames / total_s,
+                            python_peak_mb=peak / 2 ** 20, rss_growth_mb=memory_mb() - rss_before,
+                            **recorder.stats()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scene', choices=('liver', 'synthetic'), default='liver')
+    parser.add_argument('--vertices', type=int, default=100000, help='vertices of the synthetic scene')
+    parser.add_argument('--resolutions', type=str, default='640x480,1280x720,1920x1080')
+    parser.add_argument('--repeat', type=int, default=50, help='timed repetitions per measurement')
+    parser.add_argument('--recording-frames', type=int, default=120)
+    parser.add_argument('--software', action='store_true', help='use the Mesa software rasterizer')
+    parser.add_argument('--json', type=str, default=None, help='write the results to this file')
+    args = parser.parse_args()
+    resolutions = [tuple(int(v) for v in r.split('x')) for r in args.resolutions.split(',')]
+
+    import Sofa
+    import Sofa.Simulation
+    from QSofaGLViewTools import QSofaOffscreenRenderer
+    from OpenGL.GL import glGetString, GL_RENDERER, GL_VERSION
+
+    app = QSofaOffscreenRenderer.create_application(software_rendering=args.software)
+    root = Sofa.Core.Node('root')
+    if args.scene == 'liver':
+        create_liver_scene(root)
+        scene = {'name': 'liver', 'mesh': 'test/liver.msh'}
+    else:
+        scene = {'name': 'synthetic', 'vertices': create_synthetic_scene(root, args.vertices)}
+    camera = root.addObject('InteractiveCamera', name='camera', fieldOfView=45, computeZClip=False)
+    Sofa.Simulation.init(root)
+    renderer = QSofaOffscreenRenderer(root, camera, size=resolutions[0])
+    camera.setDefaultView()
+    Sofa.Simulation.updateVisual(root)
+
+    results = []
+    for width, height in resolutions:
+        bench_resolution(renderer, width, height, args.repeat, results)
+    renderer.resize(*resolutions[0])
+    bench_spheres(renderer, args.repeat, results)
+    bench_capture(renderer, args.repeat, results)
+    bench_recording(renderer, args.recording_frames, results)
+
+    report = {'benchmark': 'render_benchmarks',
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'environment': {'python': platform.python_version(),
+                              'platform': platform.platform(),
+                              'gl_renderer': glGetString(GL_RENDERER).decode(),
+                              'gl_version': glGetString(GL_VERSION).decode()},
+              'scene': scene,
+              'results': results}
+    for result in results:
+        values = ', '.join(f'{k}={v:.3f}' if isinstance(v, float) else f'{k}={v}'
+                           for k, v in result.items() if k != 'name')
+        print(f'{result["name"]:>20}: {values}')
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    renderer.release()
+    del app
+
+
+if __name__ == '__main__':
+    main()
@@ -67,9 +67,9 @@ def main(node: Sofa.Core.Node, viewer: QSofaGLView):
     while time.time() - start < 10:
         while time.time() - last < node.getDt():
             time.sleep(0.0001)
-        Sofa.Simulation.animate(node, node.getDt())
-        # Sofa.Simulation.updateVisual(node)  # idk why this isn't working right now.
+        viewer.frame_sync.step(node.getDt())  # the visuals are updated by the viewer before drawing
         last = time.time()
+    print(viewer.frame_sync.stats())
     input("\nPress enter to quit:")
     viewer.hide()
     viewer.close()
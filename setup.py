@@ -23,7 +23,6 @@ setup(
     python_requires='>=3',
     install_requires=['numpy',
                       'qtpy',
-                      'scipy',
-                      'pyopengl',
-                      'inputs']
+                      'pyopengl'],
+    extras_require={'xbox': ['inputs']}
 )
@@ -0,0 +1,51 @@
+import os
+import numpy as np
+import pytest
+
+Sofa = pytest.importorskip('Sofa')
+pytest.importorskip('Sofa.Simulation')
+pytest.importorskip('qtpy')
+QSofaGLViewTools = pytest.importorskip('QSofaGLViewTools')
+
+
+@pytest.fixture(scope='module')
+def app():
+    from qtpy.QtWidgets import QApplication
+    if 'DISPLAY' not in os.environ and 'WAYLAND_DISPLAY' not in os.environ:
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    return QApplication.instance() or QApplication(['test_markers'])
+
+
+@pytest.fixture
+def view(app):
+    from SofaRuntime import importPlugin
+    importPlugin('SofaOpenglVisual')
+    importPlugin('SofaLoader')
+    root = Sofa.Core.Node('root')
+    camera = root.addObject('InteractiveCamera', name='camera', position=[0, 0, 10])
+    Sofa.Simulation.init(root)
+    viewer = QSofaGLViewTools.QSofaGLView(sofa_visuals_node=root, camera=camera, size=(64, 48))
+    viewer.show()
+    app.processEvents()
+    if not viewer.isValid():
+        pytest.skip('no OpenGL context available')
+    yield viewer
+    viewer.close()
+
+
+def test_scene_node_spheres_are_reused_after_clear(view, app):
+    view.draw_spheres([[0, 0, 0], [1, 0, 0]], radii=0.5, colors=[1, 0, 0], as_scene_nodes=True)
+    first = list(view.spheres)
+    first_positions = [node.getObject('visual').position.array().copy() for node in first]
+    view.clear_spheres()
+    assert view.spheres == [] and len(view.sphere_pool.pooled) == 2
+
+    view.draw_spheres([[2, 3, 4], [-1, 0, 0]], radii=0.25, colors=[0, 1, 0], as_scene_nodes=True)
+    assert len(view.spheres) == 2
+    assert set(map(id, view.spheres)) == set(map(id, first))  # recycled, not re-created
+    assert view.sphere_pool.stats()['created'] == 2
+    # the second placement is the first one moved and rescaled
+    centers = {id(node): center for node, center in zip(view.spheres, ([2, 3, 4], [-1, 0, 0]))}
+    for node, positions, old_center in zip(first, first_positions, ([0, 0, 0], [1, 0, 0])):
+        expected = (positions - old_center) / 0.5 * 0.25 + centers[id(node)]
+        np.testing.assert_allclose(node.getObject('visual').position.array(), expected, atol=1e-6)
@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+
+point_cloud = pytest.importorskip('QSofaGLViewTools.point_cloud')
+transforms = pytest.importorskip('QSofaGLViewTools.transforms')
+camera_state = pytest.importorskip('QSofaGLViewTools.camera_state')
+
+WIDTH, HEIGHT = 64, 48
+NEAR, FAR = 0.1, 100.0
+POSE = [1.0, 2.0, 10.0, 0.0, 0.0, 0.0, 1.0]  # looking along -z from z = 10
+
+
+def projection():
+    return camera_state.perspective_matrix(45, WIDTH / HEIGHT, NEAR, FAR)
+
+
+def intrinsics():
+    """ Same as CameraState.intrinsics """
+    p = projection()
+    return p[0, 0] * WIDTH / 2, p[1, 1] * HEIGHT / 2, WIDTH / 2, HEIGHT / 2
+
+
+def rays(stride=1):
+    return point_cloud.RayGridCache().get(WIDTH, HEIGHT, intrinsics(), stride)
+
+
+def plane_depth(normal, offset):
+    """ Depth map of the plane normal . p = offset (camera coordinates) """
+    grid = rays().astype(np.float64)
+    directions = np.concatenate([grid, -np.ones(grid.shape[:2] + (1,))], axis=-1)  # points are distance * direction
+    distance = offset / (directions @ normal)
+    return (-distance).astype(np.float32)
+
+
+def test_fronto_parallel_plane():
+    depth = np.full((HEIGHT, WIDTH), -5.0, dtype=np.float32)
+    points = point_cloud.depth_to_point_cloud(depth, rays(), far=FAR)
+    assert points.shape == (WIDTH * HEIGHT, 3)
+    np.testing.assert_allclose(points[:, 2], -5.0)
+
+
+def test_tilted_plane_points_lie_on_the_plane():
+    normal = np.array([0.3, -0.2, 1.0])
+    normal /= np.linalg.norm(normal)
+    offset = -6.0
+    points = point_cloud.depth_to_point_cloud(plane_depth(normal, offset), rays(), far=FAR)
+    assert len(points) == WIDTH * HEIGHT
+    np.testing.assert_allclose(points @ normal, offset, atol=1e-4)
+
+
+def test_points_project_to_their_pixel_centers():
+    depth = plane_depth(np.array([0.0, 0.5, 1.0]) / np.sqrt(1.25), -4.0)
+    model_view = transforms.pose_to_model_view(POSE)
+    points = point_cloud.depth_to_point_cloud(depth, rays(), far=FAR, model_view=model_view)
+    window, in_front = transforms.project_points(points, model_view, projection(), (0, 0, WIDTH, HEIGHT))
+    assert in_front.all()
+    rows, cols = np.mgrid[0:HEIGHT, 0:WIDTH]
+    np.testing.assert_allclose(window[:, 0], cols.ravel() + 0.5, atol=1e-3)
+    np.testing.assert_allclose(window[:, 1], HEIGHT - 1 - rows.ravel() + 0.5, atol=1e-3)  # window y goes up
+
+
+def test_world_frame():
+    depth = np.full((HEIGHT, WIDTH), -4.0, dtype=np.float32)
+    model_view = transforms.pose_to_model_view(POSE)
+    points = point_cloud.depth_to_point_cloud(depth, rays(), far=FAR, model_view=model_view)
+    np.testing.assert_allclose(points[:, 2], 6.0, atol=1e-5)  # 4 in front of the camera at z = 10
+    center = points.reshape(HEIGHT, WIDTH, 3)[HEIGHT // 2 - 1:HEIGHT // 2 + 1, WIDTH // 2 - 1:WIDTH // 2 + 1]
+    np.testing.assert_allclose(center.mean(axis=(0, 1)), [1.0, 2.0, 6.0], atol=1e-5)
+
+
+def test_background_is_left_out():
+    depth = np.full((HEIGHT, WIDTH), -FAR, dtype=np.float32)
+    depth[10:20, 5:15] = -3.0
+    points = point_cloud.depth_to_point_cloud(depth, rays(), far=FAR)
+    assert len(points) == 100
+    np.testing.assert_allclose(points[:, 2], -3.0)
+
+
+def test_stride_and_colors():
+    depth = np.full((HEIGHT, WIDTH), -2.0, dtype=np.float32)
+    colors = np.zeros((HEIGHT, WIDTH, 4), dtype=np.uint8)
+    colors[..., 0] = 255
+    colors[..., 2] = 51
+    points = point_cloud.depth_to_point_cloud(depth, rays(stride=4), far=FAR, stride=4, colors=colors)
+    assert points.shape == (WIDTH // 4 * HEIGHT // 4, 6)
+    np.testing.assert_allclose(points[:, 3:], np.tile([1.0, 0.0, 0.2], (len(points), 1)), atol=1e-6)
+    full = point_cloud.depth_to_point_cloud(depth, rays(), far=FAR).reshape(HEIGHT, WIDTH, 3)
+    np.testing.assert_allclose(points[:, :3], full[::4, ::4].reshape(-1, 3))
+
+
+def test_ray_grids_are_cached():
+    cache = point_cloud.RayGridCache(max_entries=2)
+    grid = cache.get(WIDTH, HEIGHT, intrinsics())
+    assert cache.get(WIDTH, HEIGHT, intrinsics()) is grid
+    cache.get(WIDTH, HEIGHT, intrinsics(), stride=2)
+    cache.get(WIDTH, HEIGHT, intrinsics(), stride=4)
+    assert cache.get(WIDTH, HEIGHT, intrinsics()) is not grid  # the oldest entry was dropped
+
+
+def test_writer(tmp_path):
+    writer = point_cloud.PointCloudWriter(str(tmp_path), file_format='ply')
+    points = np.array([[0, 1, 2, 1, 0, 0.5], [3, 4, 5, 0, 1, 0]], dtype=np.float32)
+    path = writer.write(points, timestamp=0.25)
+    writer.write(points[:1])
+    writer.close()
+    data = open(path, 'rb').read()
+    header, body = data.split(b'end_header\n')
+    assert b'element vertex 2' in header and b'property uchar red' in header
+    vertices = np.frombuffer(body, dtype=[('x', '<f4'), ('y', '<f4'), ('z', '<f4'),
+                                          ('red', 'u1'), ('green', 'u1'), ('blue', 'u1')])
+    assert vertices['z'].tolist() == [2, 5]
+    assert vertices['blue'].tolist() == [128, 0]
+    index = (tmp_path / 'index.csv').read_text().splitlines()
+    assert index == ['frame,timestamp,file,points', '0,0.25,cloud_000000.ply,2', '1,,cloud_000001.ply,1']
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+recording = pytest.importorskip('QSofaGLViewTools.recording')
+
+
+def test_fixed_rate_resampler_fills_gaps_and_keeps_the_closest_frame():
+    resampler = recording.FixedRateResampler(fps=10)
+    frames = {t: np.full((2, 2, 3), i, dtype=np.uint8) for i, t in enumerate((0.0, 0.1, 0.3, 0.31))}
+    written = []
+    for t, frame in frames.items():
+        written += resampler.push(t, frame)
+    written += resampler.finish()
+
+    assert [slot for slot, _, _, _ in written] == [0, 1, 2, 3]
+    assert [source_time for _, source_time, _, _ in written] == [0.0, 0.1, 0.1, 0.3]
+    assert [duplicate for _, _, _, duplicate in written] == [False, False, True, False]
+    assert written[2][2] is frames[0.1]
+    assert resampler.frames_duplicated == 1
+    assert resampler.frames_dropped == 1  # 0.31 lost against 0.3 for slot 3
+
+
+def test_fixed_rate_resampler_drops_frames_going_back_in_time():
+    resampler = recording.FixedRateResampler(fps=10)
+    frame = np.zeros((1, 1, 3), dtype=np.uint8)
+    resampler.push(0.0, frame)
+    resampler.push(0.1, frame)
+    assert resampler.push(-0.5, frame) == []
+    assert resampler.frames_dropped == 1
@@ -0,0 +1,91 @@
+import pytest
+
+pytest.importorskip('qtpy')
+scheduler = pytest.importorskip('QSofaGLViewTools.scheduler')
+
+
+class _Value:
+    def __init__(self, value):
+        self.value = value
+
+
+class _Root:
+    def __init__(self):
+        self.time = _Value(0.0)
+
+    def getRoot(self):
+        return self
+
+
+class _CameraState:
+    revision = 0
+
+    def update(self, width, height):
+        return False
+
+
+class _View:
+    """ Just enough of a QSofaGLView for the scheduler: nothing ever changes """
+
+    def __init__(self):
+        self.visuals_node = _Root()
+        self.camera_state = _CameraState()
+        self.updates = 0
+
+    def width(self):
+        return 64
+
+    def height(self):
+        return 48
+
+    def update(self):
+        self.updates += 1
+
+
+class _Clock:
+    """ Timer ticks at the given period, each one up to 1 ms early or late """
+
+    def __init__(self, period):
+        self.period = period
+        self.ticks = 0
+
+    def __call__(self):
+        self.ticks += 1
+        return self.ticks * self.period + (-0.001 if self.ticks % 2 else 0.001)
+
+
+def run_ticks(max_fps, idle_fps, ticks):
+    view = _View()
+    redraw = scheduler.RedrawScheduler(view, max_fps=max_fps, idle_fps=idle_fps)
+    redraw.clock = _Clock(1 / max_fps)
+    for _ in range(ticks):
+        redraw.tick()
+    return view, redraw
+
+
+def test_idle_fps_at_max_fps_repaints_every_tick_despite_timer_jitter():
+    view, redraw = run_ticks(max_fps=30, idle_fps=30, ticks=100)
+    assert view.updates == 100
+    assert redraw.stats() == {'redraws': 100, 'skipped': 0}
+
+
+def test_idle_fps_above_max_fps_repaints_every_tick():
+    view, _ = run_ticks(max_fps=20, idle_fps=60, ticks=50)
+    assert view.updates == 50
+
+
+def test_unchanged_view_is_repainted_at_idle_fps():
+    view, _ = run_ticks(max_fps=30, idle_fps=1, ticks=300)  # 10 s
+    assert 9 <= view.updates <= 12  # first tick (dirty) plus about one per second
+
+
+def test_unchanged_view_is_never_repainted_with_idle_fps_0():
+    view, _ = run_ticks(max_fps=30, idle_fps=0, ticks=100)
+    assert view.updates == 1  # only the initial dirty frame
+
+
+def test_mark_dirty_repaints_on_the_next_tick():
+    view, redraw = run_ticks(max_fps=30, idle_fps=0, ticks=5)
+    redraw.mark_dirty()
+    redraw.tick()
+    assert view.updates == 2
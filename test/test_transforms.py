@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+transforms = pytest.importorskip('QSofaGLViewTools.transforms')
+camera_state = pytest.importorskip('QSofaGLViewTools.camera_state')
+
+WIDTH, HEIGHT = 640, 480
+POSE = [1.0, 2.0, 10.0, 0.0, 0.0, 0.0, 1.0]  # looking along -z from z = 10
+
+
+def matrices():
+    model_view = transforms.pose_to_model_view(POSE)
+    projection = camera_state.perspective_matrix(45, WIDTH / HEIGHT, 0.1, 100)
+    return model_view, projection, (0, 0, WIDTH, HEIGHT)
+
+
+def test_unproject_inverts_project():
+    points = np.random.default_rng(0).uniform([-3, -3, -5], [3, 3, 5], size=(50, 3))
+    window, in_front = transforms.project_points(points, *matrices())
+    assert in_front.all()
+    np.testing.assert_allclose(transforms.unproject_points(window, *matrices()), points, atol=1e-6)
+
+
+def test_project_points_behind_the_camera():
+    _, in_front = transforms.project_points([[1, 2, 0], [1, 2, 20]], *matrices())
+    assert in_front.tolist() == [True, False]
+
+
+def test_camera_position_projects_to_the_viewport_center():
+    window, _ = transforms.project_points([[1, 2, 0]], *matrices())
+    np.testing.assert_allclose(window[0, :2], [WIDTH / 2, HEIGHT / 2])
+
+
+def test_widget_to_window_flips_y():
+    assert transforms.widget_to_window(0, 0, HEIGHT) == (0, HEIGHT - 1)
+    assert transforms.widget_to_window(10.7, HEIGHT - 1, HEIGHT) == (10, 0)
+
+
+def test_pick_round_trip_through_widget_coordinates():
+    """ A surface point seen at a pixel is recovered from the Qt (top left origin) position of that pixel """
+    window_pixel = (100, 50)
+    point = transforms.unproject_points([*window_pixel, 0.9], *matrices())
+    widget_position = (window_pixel[0], HEIGHT - 1 - window_pixel[1])  # what a Qt mouse event reports
+    x, y = transforms.widget_to_window(*widget_position, HEIGHT)
+    assert (x, y) == window_pixel
+    np.testing.assert_allclose(transforms.unproject_points([x, y, 0.9], *matrices()), point)
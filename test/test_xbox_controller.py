@@ -0,0 +1,112 @@
+import os
+import struct
+import threading
+import time
+import types
+import pytest
+
+pytest.importorskip('qtpy')
+xbox = pytest.importorskip('QSofaGLViewTools.QXboxController')
+
+pytestmark = pytest.mark.skipif(os.name != 'posix', reason='evdev character devices only exist on POSIX')
+
+EVENT_FORMAT = 'llHHi'  # same as inputs.EVENT_FORMAT
+EV_ABS = 0x03
+ABS_X = 0x00
+_CODES = {ABS_X: 'ABS_X'}
+
+
+class _UnpluggedError(Exception):
+    pass
+
+
+class _Event:
+    def __init__(self, code, state):
+        self.code = code
+        self.state = state
+
+
+class _GamePad:
+    """ An inputs.GamePad reading evdev records from a pipe instead of /dev/input/event* """
+
+    def __init__(self, read_fd):
+        self._character_device = os.fdopen(read_fd, 'rb')
+
+    def _make_event(self, tv_sec, tv_usec, ev_type, code, value):
+        return _Event(_CODES.get(code, 'unknown'), value)
+
+    def read(self):
+        raise AssertionError('the buffered reader must not be used when the device has a file descriptor')
+
+
+def _fake_inputs():
+    inputs = types.SimpleNamespace(EVENT_FORMAT=EVENT_FORMAT, UnpluggedError=_UnpluggedError)
+    inputs.DeviceManager = lambda: 'rescanned'
+    inputs.devices = None
+    return inputs
+
+
+def _records(values):
+    return b''.join(struct.pack(EVENT_FORMAT, 0, 0, EV_ABS, ABS_X, value) for value in values)
+
+
+@pytest.fixture
+def controller(tmp_path):
+    read_fd, write_fd = os.pipe()
+    ctrl = xbox.QXboxController()
+    ctrl.gamepad = _GamePad(read_fd)
+    ctrl._watcher = xbox._DeviceWatcher(str(tmp_path))
+    inputs = _fake_inputs()
+    thread = threading.Thread(target=ctrl._read_events, args=(inputs,), daemon=True)
+    thread.start()
+    yield ctrl, write_fd, thread, inputs
+    ctrl.stop()
+    thread.join(2)
+    ctrl._watcher.close()
+    ctrl.gamepad._character_device.close()
+    try:
+        os.close(write_fd)
+    except OSError:
+        pass
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+def test_burst_is_dispatched_without_further_input(controller):
+    ctrl, write_fd, _, _ = controller
+    values = [1000 * i for i in range(1, 50)] + [0]
+    os.write(write_fd, _records(values))
+    assert _wait_for(lambda: ctrl.events_received == len(values))
+    assert ctrl.axis_snapshot().ljoy_x == 0
+    assert ctrl.axis_snapshot().revision == len(values)
+
+
+def test_partial_record_waits_for_the_rest(controller):
+    ctrl, write_fd, _, _ = controller
+    data = _records([16384, 0])
+    os.write(write_fd, data[:-5])
+    assert _wait_for(lambda: ctrl.events_received == 1)
+    assert ctrl.axis_snapshot().ljoy_x == 0.5
+    os.write(write_fd, data[-5:])
+    assert _wait_for(lambda: ctrl.events_received == 2)
+    assert ctrl.axis_snapshot().ljoy_x == 0
+
+
+def test_stop_wakes_up_the_reader(controller):
+    ctrl, _, thread, _ = controller
+    ctrl.stop()
+    thread.join(2)
+    assert not thread.is_alive()
+
+
+def test_unplugged_device_is_forgotten(controller):
+    _, write_fd, thread, inputs = controller
+    os.close(write_fd)  # end of file, like a removed device
+    thread.join(2)
+    assert not thread.is_alive()
+    assert inputs.devices == 'rescanned'